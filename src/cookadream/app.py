@@ -18,7 +18,7 @@
 import sys
 from pathlib import Path, PurePath
 
-from PySide6.QtGui import QFontDatabase, QIcon, QKeySequence, QPixmap
+from PySide6.QtGui import QColor, QFontDatabase, QIcon, QImage, QKeySequence, QPainter, QPixmap
 from PySide6.QtWidgets import QApplication, QSplashScreen
 
 from cookadream.utils.version_info import PRODUCT_VERSION
@@ -65,21 +65,28 @@ splashShow('loading ui framework')
 # --- Remaining imports
 import atexit
 import glob
+import hashlib
 import inspect
+import itertools
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import re
 import site
 import tempfile
 import traceback
 from datetime import datetime
 
-from PySide6.QtCore import (Property, QMutex, QObject, QRunnable, QSettings, QStandardPaths, QSysInfo, Qt, QThreadPool,
-                            QtMsgType, QUrl, QWaitCondition, Signal, Slot, qInstallMessageHandler)
+from PySide6.QtCore import (Property, QAbstractListModel, QByteArray, QModelIndex, QMutex, QObject, QRunnable,
+                            QSettings, QStandardPaths, QSysInfo, Qt, QThreadPool, QTimer, QtMsgType, QUrl,
+                            QWaitCondition, Signal, Slot, qInstallMessageHandler)
 from PySide6.QtQml import QmlElement, QQmlApplicationEngine
 from PySide6.QtQuick import QQuickImageProvider, QQuickItem
 from PySide6.QtQuickControls2 import QQuickStyle
 
+from cookadream import tracing
 from cookadream.utils import style_rc  # pylint: disable=unused-import
 
 LOG_ERROR_LEVELS = ('debug', 'info', 'warning', 'error')
@@ -100,6 +107,23 @@ if LOG_ERROR_MODE not in LOG_ERROR_MODES:
     print(f'WARNING: LOG_ERROR_MODE is not {LOG_ERROR_MODES} --- ignoring', file=sys.stderr)
     LOG_ERROR_MODE = LOG_ERROR_MODE_DEF
 
+TRACE_MODES = ('off', 'on', 'tf') # 'tf' also attaches the TensorFlow profiler
+TRACE_MODE_DEF = 'off'
+TRACE_MODE = os.environ.get('COOKADREAM_TRACE_MODE', TRACE_MODE_DEF)
+if TRACE_MODE not in TRACE_MODES:
+    print(f'WARNING: TRACE_MODE is not {TRACE_MODES} --- ignoring', file=sys.stderr)
+    TRACE_MODE = TRACE_MODE_DEF
+TRACE_PREFIX = 'cookadream_trace_'
+
+IDLE_UNLOAD_MINUTES_DEF = 0 # Idle minutes before the ai model is unloaded (0 = never)
+try:
+    IDLE_UNLOAD_MINUTES = float(os.environ.get('COOKADREAM_IDLE_UNLOAD_MINUTES', IDLE_UNLOAD_MINUTES_DEF))
+    if IDLE_UNLOAD_MINUTES < 0:
+        raise ValueError('negative minutes')
+except ValueError:
+    print('WARNING: IDLE_UNLOAD_MINUTES is not a non-negative number --- ignoring', file=sys.stderr)
+    IDLE_UNLOAD_MINUTES = IDLE_UNLOAD_MINUTES_DEF
+
 def deleteOldest(dir, /, *, prefix, suffix, keep=4):
     path = Path(dir) / f'{prefix}*{suffix}'
     files = glob.glob(str(path))
@@ -135,7 +159,7 @@ splashShow('loading ai framework')
 
 import PIL.Image
 import PIL.ImageOps
-import PIL.ImageQt
+import PIL.PngImagePlugin
 
 if LOG_ERROR_MODE == 'debug':
     LOG_FORMAT = '%(asctime)s: %(levelname)s %(filename)s..%(funcName)s:%(lineno)d] %(message)s'
@@ -155,8 +179,26 @@ def sameStream(stream1, stream2):
         return stream1 == stream2
 sameStream.filenoSupported = True
 
+# Records are queued by the threads that log them, and written to logWrite by a single writer thread, so logging never
+# blocks the GUI thread or the dream workers on the file
+logQueue = queue.SimpleQueue()
+logQueueHandler = logging.handlers.QueueHandler(logQueue)
+logListener = None
+
+def newQueueHandler(level=logging.NOTSET):
+    h = logging.handlers.QueueHandler(logQueue)
+    h.setLevel(level)
+    return h
+
 def configureLoggers():
+    global logListener
     logFormat = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+    writeHandler = logging.StreamHandler(logWrite)
+    writeHandler.setFormatter(logFormat)
+    logListener = logging.handlers.QueueListener(logQueue, writeHandler, respect_handler_level=False)
+    logListener.start()
+    # Writes the records still queued at exit
+    atexit.register(logListener.stop)
     # Reconfigure all existing "visible" log handlers (those streaming to stdout/stderr)
     for l in logging.root.manager.loggerDict.values():
         visibleHandlers = []
@@ -169,19 +211,14 @@ def configureLoggers():
                 visibleHandlers.append(h)
         if visibleHandlers:
             priorityHandler = priorityHandler or visibleHandlers[0]
-            h = logging.StreamHandler(logWrite)
-            h.setFormatter(logFormat)
-            h.setLevel(priorityHandler.level)
-            l.addHandler(h)
+            l.addHandler(newQueueHandler(priorityHandler.level))
         for rh in visibleHandlers:
             l.removeHandler(rh)
     # Adds and returns a new handler for the cookadream module
     for newLoggerName in ('cookadream', 'deep_dream',):
         newLogger = logging.getLogger(newLoggerName)
         newLogger.setLevel(LOG_ERROR_LEVEL_PYTHON)
-        h = logging.StreamHandler(logWrite)
-        h.setFormatter(logFormat)
-        newLogger.addHandler(h)
+        newLogger.addHandler(newQueueHandler())
 
 configureLoggers()
 logger = logging.getLogger('cookadream')
@@ -241,12 +278,10 @@ def qtMessageHandler(level, context, message):
     levelName = qtMessageLevels.get(level, None)
     if levelName is None:
         return
-    # using old-style format so the same LOG_FORMAT may be used in both contexts
-    filename = '<None>' if context.file is None else PurePath(context.file).name
-    print(LOG_FORMAT % {
-            'asctime': datetime.now().strftime(LOG_DATE_FORMAT), 'levelname': levelName, 'pathname': context.file,
-            'filename': filename, 'funcName': context.function, 'lineno': context.line, 'message': message},
-          file=logWrite)
+    # Goes through the log queue, with the location given by Qt, so the same LOG_FORMAT applies in both contexts
+    record = logging.LogRecord('qt', logging.getLevelName(levelName), context.file or '<None>', context.line or 0,
+                               message, None, None, func=context.function)
+    logQueueHandler.handle(record)
 
 qInstallMessageHandler(qtMessageHandler)
 
@@ -256,6 +291,16 @@ qInstallMessageHandler(qtMessageHandler)
 
 logger.debug('loggers configured')
 
+def startTracing():
+    '''Starts the timeline trace; it is written to the log directory when the application exits.'''
+    traceDir = Path(QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation))
+    os.makedirs(traceDir, exist_ok=True)
+    deleteOldest(traceDir, prefix=TRACE_PREFIX, suffix='.json')
+    traceName = TRACE_PREFIX + datetime.now().strftime('%Y%m%d_%H%M%S')
+    tfProfilerDir = traceDir / f'{traceName}_tf' if TRACE_MODE == 'tf' else None
+    tracing.start(tf_profiler_dir=tfProfilerDir)
+    atexit.register(tracing.stop, traceDir / f'{traceName}.json')
+
 
 # --- initialization of backend AI engine
 # deepdream code based upon these examples
@@ -269,8 +314,9 @@ import cookadream.deep_dream_patch_and_load
 
 import numpy as np
 
+from cookadream import noise
 from cookadream.deep_dream import MIN_DIM as MINIMUM_DREAM_IMAGE_SIZE
-from cookadream.deep_dream import DEEP_DREAM_ENGINE_DEVICES, DeepDreamEngine
+from cookadream.deep_dream import CONVERGENCE_TOLERANCE_DEF, DEEP_DREAM_ENGINE_DEVICES, DeepDreamEngine
 
 deepDreamEngine = DeepDreamEngine()
 
@@ -291,9 +337,10 @@ class DreamEngineInfo(QObject):
 # --- Multithreading infra-structure
 splashShow('initializing ui')
 
-from cookadream.utils import about_info
+from cookadream.utils import about_info, imagenet_classes, qml_menus
 
 about_info.configureAboutInfo(applicationObject=app, textDirPathObject=textDir)
+imagenet_classes.configureImagenetClasses(dataDirPathObject=dataDir)
 
 
 # To be used on the @QmlElement decorator
@@ -441,6 +488,10 @@ class Worker(QRunnable):
 
     def run(self):
         '''Starts running workerFunction with parameters specified during Worker creation.'''
+        with tracing.span('Worker.run', task=self.taskName):
+            self._run()
+
+    def _run(self):
         try:
             logger.debug('>>')
             self.signals.started(self.taskName, keepProgress=self.keepProgress)
@@ -463,6 +514,17 @@ class Worker(QRunnable):
                 logger.debug('<< success')
 
 globalThreadPool = QThreadPool.globalInstance()
+# Image files are encoded and written one at a time, without competing with dreams for the global pool
+writerThreadPool = QThreadPool()
+writerThreadPool.setMaxThreadCount(1)
+# Dreams, interactive or queued, share the engine, which holds a single optimization state per module: they run one at a
+# time, highest priority first
+DREAM_JOBS_CONCURRENCY = 1
+DREAM_PRIORITY_INTERACTIVE = 10
+DREAM_PRIORITY_BACKGROUND = 0
+DREAM_PRIORITY_IDLE = -10 # Memory reclamation, after everything else
+dreamThreadPool = QThreadPool()
+dreamThreadPool.setMaxThreadCount(DREAM_JOBS_CONCURRENCY)
 
 #  --- Supported image formats
 DEFAULT_SUFFIX = '.jpg'
@@ -478,9 +540,130 @@ SAVE_FILTERS = ['All image files (*.jpg *.jpeg *.bmp *.gif *.png *.ppm)', 'JPEG
 
 TRANSPARENT_BACKGROUND = (255, 255, 255,)
 
+#  --- Dream parameters embedded in saved images
+METADATA_KEY = 'cookadream'
+EXIF_IMAGE_DESCRIPTION = 0x010E
+EXIF_SOFTWARE = 0x0131
+PNG_COMPRESS_LEVEL_DEF = 6
+JPEG_QUALITY_DEF = 75
+
 #  --- Global clipboard object
 clipboard = app.clipboard()
 
+# --- Dream jobs queued in the background, and the gallery of their results
+
+class DreamJob:
+    '''A background dream: the source image, the layer to excite (None for the current one), and the dream parameters.'''
+
+    def __init__(self, jobId, imageArray, dreamKwargs, *, layerName=None, label='', parameters=None):
+        self.jobId = jobId
+        self.imageArray = imageArray
+        self.dreamKwargs = dreamKwargs
+        self.layerName = layerName
+        self.label = label
+        self.parameters = parameters
+        self.status = 'queued'
+        self.progress = 0.
+        self.message = ''
+        self.resultArray = None
+        self.revision = 0
+        self.worker = None
+        self.preempted = False
+
+    @property
+    def taskId(self):
+        return _NO_TASK_ID if self.worker is None else self.worker.signals.taskId
+
+class DreamGalleryModel(QAbstractListModel):
+    '''List model of the dream jobs, in submission order, with their status and (partial) results.'''
+
+    JobIdRole = Qt.UserRole + 1
+    LabelRole = Qt.UserRole + 2
+    StatusRole = Qt.UserRole + 3
+    ProgressRole = Qt.UserRole + 4
+    ImageSourceRole = Qt.UserRole + 5
+    MessageRole = Qt.UserRole + 6
+
+    _roleAttributes = {
+        JobIdRole: 'jobId',
+        LabelRole: 'label',
+        StatusRole: 'status',
+        ProgressRole: 'progress',
+        MessageRole: 'message',
+    }
+
+    countChanged = Signal(name='countChanged')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._jobs = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._jobs)
+
+    def roleNames(self):
+        roles = {role: QByteArray(name.encode()) for role,name in self._roleAttributes.items()}
+        roles[self.ImageSourceRole] = QByteArray(b'imageSource')
+        return roles
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._jobs):
+            return None
+        job = self._jobs[index.row()]
+        if role == Qt.DisplayRole:
+            return job.label
+        if role == self.ImageSourceRole:
+            if job.resultArray is None:
+                return ''
+            return f'image://neural_images/gallery/{job.jobId}/{job.revision}'
+        attribute = self._roleAttributes.get(role)
+        return None if attribute is None else getattr(job, attribute)
+
+    def countGet(self):
+        return len(self._jobs)
+
+    count = Property(int, countGet, notify=countChanged)
+
+    def jobs(self):
+        return list(self._jobs)
+
+    def job(self, jobId):
+        for job in self._jobs:
+            if job.jobId == jobId:
+                return job
+        return None
+
+    def jobForTask(self, taskId):
+        for job in self._jobs:
+            if job.taskId == taskId:
+                return job
+        return None
+
+    def appendJob(self, job):
+        row = len(self._jobs)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._jobs.append(job)
+        self.endInsertRows()
+        self.countChanged.emit()
+
+    def jobChanged(self, job):
+        row = self._jobs.index(job)
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index)
+
+    def removeJob(self, job):
+        row = self._jobs.index(job)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._jobs[row]
+        self.endRemoveRows()
+        self.countChanged.emit()
+
+    def jobImage(self, jobId):
+        job = self.job(jobId)
+        return None if job is None else job.resultArray
+
+dreamGallery = DreamGalleryModel()
+
 # --- Python-QML bridge element for main window
 
 @QmlElement
@@ -497,6 +680,16 @@ class BridgeMainWindow(QObject):
         self._worker = None
         self._taskId = _NO_TASK_ID
         self._originalImage = None
+        self._setupKwargs = None
+        self._dreamParameters = None
+        self._savingArray = None
+        self._writeWorker = None
+        self._nextJobId = 1
+        self._reclaimWorker = None
+        self._idleTimer = QTimer(self)
+        self._idleTimer.setSingleShot(True)
+        self._idleTimer.setInterval(int(IDLE_UNLOAD_MINUTES * 60_000))
+        self._idleTimer.timeout.connect(self._unloadIdleEngine)
 
     # --- Properties .busy, .taskId (read-only, from private property _worker)
     busyChanged = Signal(name='busyChanged')
@@ -586,6 +779,10 @@ class BridgeMainWindow(QObject):
         # If the engine is busy does nothing
         if self.busy:
             return
+        # Queued jobs were defined for the previous setup
+        self.clearJobs()
+        # The setup runs on another pool: a reclamation must not overlap it
+        self._cancelReclaim(wait=True)
         self._readySet(False)
         if layerName == 'predictions':
             if imagenetLabel == -1 :
@@ -596,6 +793,7 @@ class BridgeMainWindow(QObject):
         setupKwargs = dict(device_name=deviceName, model_name=modelModuleName, layer_name=layerName,
                            neuron_first=neuronFrom, neuron_last=neuronTo, tiled_rendering=tiledRendering)
         logger.debug('-- %s', setupKwargs)
+        self._setupKwargs = setupKwargs
         initWorker = Worker(deepDreamEngine.setup, taskName='loading ai model', **setupKwargs)
         initWorker.signals.connectSelf(workerSignals)
         initWorker.signals.connectSignal('finished', self.finishedSetup)
@@ -635,9 +833,26 @@ class BridgeMainWindow(QObject):
         return str(PurePath(QUrl(url).toLocalFile()).parent)
 
     # --- Main functionality
-    @Slot(WorkerSignals, int, int, float, int, float, float, float, int)
+    @staticmethod
+    def _dreamKwargs(octavesFrom, octavesTo, octavesScaling, stepsPerOctave, octavesBlending, stepSize, smoothingFactor,
+                     jitterPixels, convergenceTolerance=CONVERGENCE_TOLERANCE_DEF):
+        #... the internal notion of "octaves" is the opposite of the more user-friendly notion used in the interface
+        #... the user-friendly octaves_scaling is on a logarithmic scale
+        return dict(octaves=range(-octavesTo, -octavesFrom + 1), octaves_scaling=2.**octavesScaling,
+                    octaves_blending=octavesBlending/100., steps_per_octave=stepsPerOctave, step_size=stepSize,
+                    smoothing_factor=-smoothingFactor, jitter_pixels=jitterPixels,
+                    convergence_tolerance=convergenceTolerance)
+
+    @Slot(WorkerSignals, int, int, float, int, float, float, float, int, float, bool, bool)
+    @tracing.traced()
     def startDreaming(self, workerSignals, octavesFrom, octavesTo, octavesScaling, stepsPerOctave, octavesBlending,
-                      stepSize, smoothingFactor, jitterPixels):
+                      stepSize, smoothingFactor, jitterPixels, convergenceTolerance=CONVERGENCE_TOLERANCE_DEF,
+                      draft=False, draftOnly=False):
+        '''
+        Starts dreaming the current image. Each octave ends early once its loss improves less than convergenceTolerance
+        (never, if zero). If draft, a quick low-resolution draft is shown first, and then refined at full resolution,
+        unless draftOnly, in which case the dream stops at the draft.
+        '''
         global neuralImageBridge, deepDreamEngine
         logger.debug('--')
         # If the engine is not ready, or if an image is not available, does nothing
@@ -645,36 +860,215 @@ class BridgeMainWindow(QObject):
             return
         # If a dream is ongoing, stops it
         self.stopDreaming()
+        # Background jobs yield the engine to the interactive dream, and are resumed afterwards
+        self._preemptJobs()
+        self._cancelReclaim()
         # Starts a new dream
-        pixmap = neuralImageBridge.getRawPixmap()
-        imagePillow = PIL.ImageQt.fromqpixmap(pixmap)
-        #... the internal notion of "octaves" is the opposite of the more user-friendly notion used in the interface
-        #... the user-friendly octaves_scaling is on a logarithmic scale
-        dreamKwargs = dict(octaves=range(-octavesTo, -octavesFrom + 1), octaves_scaling=2.**octavesScaling,
-                           octaves_blending=octavesBlending/100., steps_per_octave=stepsPerOctave, step_size=stepSize,
-                           smoothing_factor=-smoothingFactor, jitter_pixels=jitterPixels)
+        imageArray = neuralImageBridge.getRawArray()
+        dreamKwargs = self._dreamKwargs(octavesFrom, octavesTo, octavesScaling, stepsPerOctave, octavesBlending,
+                                        stepSize, smoothingFactor, jitterPixels, convergenceTolerance)
         logger.debug('-- %s', dreamKwargs)
-        self._workerSet(Worker(deepDreamEngine.dream, imagePillow, dream_kwargs=dreamKwargs,
-                               taskName='dreaming — this may take a while...'))
+        self._dreamParameters = self._describeDream(imageArray, dreamKwargs)
+        if draft or draftOnly:
+            self._dreamParameters['draft'] = 'only' if draftOnly else 'refine'
+        self._workerSet(Worker(deepDreamEngine.dream, imageArray, dream_kwargs=dreamKwargs, draft=draft,
+                               draft_only=draftOnly, taskName='dreaming — this may take a while...'))
         self._worker.setAutoDelete(False)
         self._worker.signals.connectSelf(workerSignals)
         self._worker.signals.connectSignal('progress', self.updateImage)
         self._worker.signals.connectSignal('finished', self.finishedImage)
-        globalThreadPool.start(self._worker)
+        dreamThreadPool.start(self._worker, DREAM_PRIORITY_INTERACTIVE)
 
     @Slot()
     def stopDreaming(self):
         taskId = self.taskId
         logger.debug('>> taskId = %s from worker = %s', taskId, self._worker)
+        notStarted = None
         self._dreamMutex.lock()
         if self._worker is not None and self.taskId == taskId:
             self._worker.signals.stop()
-            self._worker.signals.wait()
+            # A worker still waiting in a pool will never run: waiting for it would block forever
+            if dreamThreadPool.tryTake(self._worker) or globalThreadPool.tryTake(self._worker):
+                notStarted = self._worker
+            else:
+                self._worker.signals.wait()
             self._workerSet(None)
         self._dreamMutex.unlock()
+        if notStarted is not None:
+            notStarted.signals.finished(error=True, finalMessage='the execution was halted before starting')
         logger.debug('<< self._worker = %s', self._worker)
 
+    # --- Dream job queue, property .gallery
+    @Property(QObject, constant=True)
+    def gallery(self):
+        return dreamGallery
+
+    def _newJob(self, imageArray, dreamKwargs, *, layerName='', label=''):
+        job = DreamJob(self._nextJobId, imageArray, dreamKwargs, layerName=layerName or None, label=label,
+                       parameters=self._describeDream(imageArray, dreamKwargs, layerName=layerName or None))
+        self._nextJobId += 1
+        dreamGallery.appendJob(job)
+        self._startJob(job)
+        return job
+
+    def _startJob(self, job):
+        logger.debug('-- jobId = %s', job.jobId)
+        job.worker = Worker(self._runJob, job, taskName=f'dreaming job {job.jobId}')
+        job.worker.setAutoDelete(False)
+        job.worker.signals.connectSignal('progress', self.updateJob)
+        job.worker.signals.connectSignal('finished', self.finishedJob)
+        job.status = 'queued'
+        job.preempted = False
+        dreamGallery.jobChanged(job)
+        self._cancelReclaim()
+        dreamThreadPool.start(job.worker, DREAM_PRIORITY_BACKGROUND)
+
+    @staticmethod
+    def _runJob(job, *, signals, progressCallback):
+        '''Dreams a job; runs on the dream thread pool.'''
+        global deepDreamEngine
+        return deepDreamEngine.dream(job.imageArray, progress_callback=progressCallback, signals=signals,
+                                     dream_kwargs=job.dreamKwargs, deepdream=deepDreamEngine.deepdream_for(job.layerName))
+
+    def _preemptJobs(self):
+        # The status turns 'running' only when the first progress signal of a job arrives: the pool tells whether the
+        # worker has started
+        for job in dreamGallery.jobs():
+            if job.status not in ('queued', 'running') or job.worker.signals.isFinished:
+                continue
+            if dreamThreadPool.tryTake(job.worker):
+                # Not started: back in the pool (in submission order), where the interactive dream goes first
+                dreamThreadPool.start(job.worker, DREAM_PRIORITY_BACKGROUND)
+                continue
+            logger.debug('-- preempting jobId = %s', job.jobId)
+            job.preempted = True
+            job.worker.signals.stop()
+
+    @Slot(int, int, float, int, float, float, float, int, str, result=int)
+    def queueDream(self, octavesFrom, octavesTo, octavesScaling, stepsPerOctave, octavesBlending, stepSize,
+                   smoothingFactor, jitterPixels, layerName):
+        '''
+        Queues a background dream of the current image, for the current layer if layerName is "". Returns int: the job
+        id, or -1 if the engine is not ready or there is no image.
+        '''
+        global neuralImageBridge
+        if not (self.ready and self.hasImage):
+            return -1
+        dreamKwargs = self._dreamKwargs(octavesFrom, octavesTo, octavesScaling, stepsPerOctave, octavesBlending,
+                                        stepSize, smoothingFactor, jitterPixels)
+        label = f'{layerName or self._setupKwargs["layer_name"]}, {stepsPerOctave} steps, step size {stepSize:g}'
+        return self._newJob(neuralImageBridge.getRawArray(), dreamKwargs, layerName=layerName, label=label).jobId
+
+    @Slot(dict, dict, result=int)
+    def queueSweep(self, baseParameters, sweepParameters):
+        '''
+        Queues one background dream of the current image per combination of the swept values. Both arguments are
+        maps of the parameters of queueDream (octavesFrom, ..., layerName); sweepParameters maps each swept parameter
+        to a list of values. Jobs on the same layer are queued together, so each layer module is created once. Returns
+        int: the number of jobs queued.
+        '''
+        global neuralImageBridge
+        if not (self.ready and self.hasImage):
+            return 0
+        parameterNames = list(inspect.signature(self._dreamKwargs).parameters) + ['layerName']
+        unknownNames = (set(baseParameters) | set(sweepParameters)) - set(parameterNames)
+        if unknownNames:
+            logger.warning('unrecognized sweep parameters: %s', unknownNames)
+            return 0
+        imageArray = neuralImageBridge.getRawArray()
+        sweepNames = sorted(sweepParameters, key=lambda name: name != 'layerName')
+        combinations = list(itertools.product(*(sweepParameters[name] for name in sweepNames)))
+        for values in combinations:
+            parameters = dict(baseParameters, **dict(zip(sweepNames, values)))
+            layerName = parameters.pop('layerName', '')
+            dreamKwargs = self._dreamKwargs(**parameters)
+            label = ', '.join(f'{name} {value}' for name,value in zip(sweepNames, values))
+            self._newJob(imageArray, dreamKwargs, layerName=layerName, label=label)
+        logger.debug('-- %s jobs queued', len(combinations))
+        return len(combinations)
+
+    @Slot(int)
+    def cancelJob(self, jobId):
+        job = dreamGallery.job(jobId)
+        logger.debug('-- jobId = %s, job = %s', jobId, job)
+        if job is not None:
+            self._cancelJob(job)
+
+    def _cancelJob(self, job):
+        '''Stops and removes a job. Returns whether its worker had already started, and may still be running.'''
+        started = False
+        if job.status in ('queued', 'running'):
+            job.preempted = False
+            job.worker.signals.stop()
+            if dreamThreadPool.tryTake(job.worker):
+                job.worker.signals.finished(error=True, finalMessage='the job was cancelled before starting')
+            else:
+                # The status may still be 'queued' if the job started but has not reported progress yet
+                started = True
+        dreamGallery.removeJob(job)
+        return started
+
+    @Slot()
+    def clearJobs(self):
+        for job in dreamGallery.jobs():
+            # The engine must be free when this returns (e.g., before a new setup)
+            if self._cancelJob(job):
+                job.worker.signals.wait()
+
+    @Slot(int, float, dict)
+    @tracing.traced()
+    def updateJob(self, taskId, fractionFinished, kwargs):
+        job = dreamGallery.jobForTask(taskId)
+        if job is None:
+            return
+        job.status = 'running'
+        job.progress = fractionFinished
+        if 'image_array' in kwargs:
+            job.resultArray = kwargs['image_array']
+            job.revision += 1
+        dreamGallery.jobChanged(job)
+
+    @Slot(int, object, bool, str)
+    @tracing.traced()
+    def finishedJob(self, taskId, result, error, finalMessage):
+        job = dreamGallery.jobForTask(taskId)
+        logger.debug('-- taskId = %s, job = %s, error = %s', taskId, job, error)
+        if job is None:
+            return
+        if job.preempted and error:
+            # Restarts from the beginning, behind the interactive dream
+            self._startJob(job)
+            return
+        # A job may complete before noticing its preemption
+        if error:
+            job.status = 'stopped' if job.worker.signals.isStopped else 'error'
+            job.message = finalMessage
+        else:
+            job.status = 'done'
+            job.progress = 1.
+            job.resultArray = result
+            job.revision += 1
+        dreamGallery.jobChanged(job)
+        self._dreamFinished()
+
+    @Slot(int, result=list)
+    def useJobImage(self, jobId):
+        '''Makes the result of a job the current image. Returns list(4): success, width, height, Image or message.'''
+        global neuralImageBridge
+        job = dreamGallery.job(jobId)
+        if job is None or job.resultArray is None:
+            return [False, 0, 0, 'no dream available for this job']
+        # If a dream is ongoing, stops it
+        self.stopDreaming()
+        imageArray = job.resultArray
+        neuralImageBridge.setSourceFromArray(imageArray)
+        self._dreamParameters = job.parameters
+        self._hasImageSet(True)
+        self._savedSet(False)
+        return [True, imageArray.shape[1], imageArray.shape[0], imageArray]
+
     @Slot(int, float, dict)
+    @tracing.traced()
     def updateImage(self, taskId, _fractionFinished, kwargs):
         global neuralImageBridge
         if  'image_array' in kwargs and self.taskId == taskId:
@@ -684,14 +1078,71 @@ class BridgeMainWindow(QObject):
             self._hasImageSet(True)
 
     @Slot(object, bool, str)
+    @tracing.traced()
     def finishedImage(self, taskId, _result, _error, _finalMessage):
         logger.debug('>> taskId = %s', taskId)
         self._dreamMutex.lock()
         if self.taskId == taskId:
             self._workerSet(None)
         self._dreamMutex.unlock()
+        self._dreamFinished()
         logger.debug('<< %s', taskId)
 
+    # --- Memory reclamation while idle
+    def _engineIdle(self):
+        return self._worker is None and not any(job.status in ('queued', 'running') for job in dreamGallery.jobs())
+
+    def _dreamFinished(self):
+        '''Once no dream is left, drops the per-dream tensors, and starts counting the idle time.'''
+        if not self._engineIdle():
+            return
+        self._startReclaim()
+        if IDLE_UNLOAD_MINUTES > 0:
+            self._idleTimer.start()
+
+    @Slot()
+    def _unloadIdleEngine(self):
+        if self._engineIdle():
+            self._startReclaim(unload=True)
+
+    def _startReclaim(self, *, unload=False):
+        '''Queues the release of the per-dream tensors or, if unload, the unloading of the whole model.'''
+        if self._reclaimWorker is not None:
+            if not unload:
+                return
+            # An unload supersedes a pending release
+            dreamThreadPool.tryTake(self._reclaimWorker)
+        if unload:
+            reclaimFunction, taskName = deepDreamEngine.unload, 'unloading idle ai model'
+        else:
+            reclaimFunction, taskName = deepDreamEngine.release_dream_state, 'releasing dream memory'
+        # Runs on the dream pool, so it never overlaps a dream
+        self._reclaimWorker = Worker(reclaimFunction, taskName=taskName)
+        self._reclaimWorker.setAutoDelete(False)
+        self._reclaimWorker.signals.connectSignal('finished', self.finishedReclaim)
+        dreamThreadPool.start(self._reclaimWorker, DREAM_PRIORITY_IDLE)
+
+    def _cancelReclaim(self, *, wait=False):
+        '''Stops counting the idle time and withdraws a pending reclamation, or, if it already runs and wait, waits.'''
+        self._idleTimer.stop()
+        worker = self._reclaimWorker
+        if worker is None:
+            return
+        if dreamThreadPool.tryTake(worker):
+            self._reclaimWorker = None
+        elif wait:
+            worker.signals.wait()
+
+    @Slot(int, object, bool, str)
+    def finishedReclaim(self, taskId, result, error, finalMessage):
+        if self._reclaimWorker is not None and self._reclaimWorker.signals.taskId == taskId:
+            self._reclaimWorker = None
+        if error:
+            logger.warning('memory reclamation failed: %s', finalMessage)
+        else:
+            usageBefore, usageAfter = result
+            logger.info('-- memory reclaimed, rss before = %s, after = %s', usageBefore['rss'], usageAfter['rss'])
+
     # --- Other actions
     @Property(list, constant=True)
     def DEFAULT_SUFFIX(self): # pylint: disable=invalid-name
@@ -715,59 +1166,106 @@ class BridgeMainWindow(QObject):
         logger.debug('-- %s => RGB', imagePillow.mode)
         return imagePillow.convert('RGB')
 
-    @Slot(float, float, int, result=list)
-    def newImage(self, width, height, maximumSize):
-        '''Returns list(4): success(bool), width(int), height(int), Image or error message.'''
-        global neuralImageBridge, deepDreamEngine
-        try:
-            # If a dream is ongoing, stops it
-            self.stopDreaming()
-            logger.debug('width = %s, height = %s, maximumSize = %s', width, height, maximumSize)
-            width  = max(int(np.round(width)),  MINIMUM_DREAM_IMAGE_SIZE)
-            height = max(int(np.round(height)), MINIMUM_DREAM_IMAGE_SIZE)
-            if maximumSize > 0:
-                width  = min(width, maximumSize)
-                height = min(height, maximumSize)
-            imageArray = DeepDreamEngine.noise_to_image_array(DeepDreamEngine.get_noise_array(width, height))
-            imagePillow = PIL.Image.fromarray(imageArray)
-            self._originalImage = imagePillow
-            neuralImageBridge.setSourceFromPillow(imagePillow)
-            self._hasImageSet(True)
-            self._savedSet(True)
-            return [True, imagePillow.size[0], imagePillow.size[1], imagePillow]
-        except Exception: # pylint: disable=broad-except
-            etype, evalue, trace = sys.exc_info()
-            errorDescription = logAndFormatException(etype, evalue, trace)
-            self._hasImageSet(False)
-            return [False, 0, 0, errorDescription]
+    @staticmethod
+    def _fitArray(imageArray, maximumSize):
+        '''Fits an image array as DeepDreamEngine.fit_image, without copying it if it already fits.'''
+        height, width = imageArray.shape[:2]
+        imagePillow = PIL.Image.frombuffer('RGB', (width, height), imageArray, 'raw', 'RGB', 0, 1)
+        fittedPillow = DeepDreamEngine.fit_image(imagePillow, max_dim=maximumSize)
+        if fittedPillow is imagePillow:
+            return imageArray
+        return np.asarray(fittedPillow)
 
-    @Slot(str, int, result=list)
-    def openImage(self, path, maximumSize):
-        '''Returns list(4): success(bool), width(int), height(int), Image or error message.'''
-        global neuralImageBridge, deepDreamEngine
-        try:
-            # If a dream is ongoing, stops it
-            self.stopDreaming()
-            logger.debug('path = "%s", maximumSize = %s', path, maximumSize)
-            imageSuffix = PurePath(path).suffix.lower()
-            if imageSuffix not in OPEN_SUFFIXES:
-                self._hasImageSet(False)
-                return [False, 0, 0, f'unrecognized image format: "{imageSuffix}"']
-            image = PIL.Image.open(path)
-            image = PIL.ImageOps.exif_transpose(image)
-            image = self._enforceRGB(image)
-            if maximumSize > 0:
-                image = DeepDreamEngine.fit_image(image, max_dim=maximumSize)
-            self._originalImage = image
-            neuralImageBridge.setSourceFromPillow(image)
+    @staticmethod
+    def _generateImage(width, height):
+        '''Generates a noise image array; runs on a worker thread.'''
+        return noise.noise_image_array(width, height, kind=noise.NOISE_KIND_DEF)
+
+    @Slot(WorkerSignals, float, float, int)
+    def newImage(self, workerSignals, width, height, maximumSize):
+        '''Creates a noise image off the GUI thread. Signal imageOpened(list(4)): success, width, height, Image or message.'''
+        # If a dream is ongoing, stops it
+        self.stopDreaming()
+        logger.debug('width = %s, height = %s, maximumSize = %s', width, height, maximumSize)
+        width  = max(int(np.round(width)),  MINIMUM_DREAM_IMAGE_SIZE)
+        height = max(int(np.round(height)), MINIMUM_DREAM_IMAGE_SIZE)
+        if maximumSize > 0:
+            width  = min(width, maximumSize)
+            height = min(height, maximumSize)
+        newWorker = Worker(self._generateImage, width, height, taskName='creating image')
+        newWorker.setAutoDelete(False)
+        # The bridge must handle the result before the status bar (connections are queued in order)
+        newWorker.signals.connectSignal('finished', self.finishedOpenImage)
+        newWorker.signals.connectSelf(workerSignals)
+        self._workerSet(newWorker)
+        globalThreadPool.start(newWorker)
+
+    # --- Asynchronous image opening, signal .imageOpened
+    imageOpened = Signal(list, name='imageOpened')
+
+    @staticmethod
+    def _loadImage(path, maximumSize):
+        '''Decodes and fits an image file; runs on a worker thread. Raises on unsupported or broken files.'''
+        imageSuffix = PurePath(path).suffix.lower()
+        if imageSuffix not in OPEN_SUFFIXES:
+            raise ValueError(f'unrecognized image format: "{imageSuffix}"')
+        image = PIL.Image.open(path)
+        if maximumSize > 0:
+            # Decodes directly to roughly the fitted size if the format allows (JPEG DCT scaling)...
+            w, h = image.size
+            scale = max(w, h) / maximumSize
+            if scale > 1.:
+                image.draft('RGB', (int(np.ceil(w / scale)), int(np.ceil(h / scale))))
+        image = PIL.ImageOps.exif_transpose(image)
+        image = BridgeMainWindow._enforceRGB(image)
+        if maximumSize > 0:
+            # ...otherwise, reduces by an integer factor, which is much cheaper than the final resize
+            reduceFactor = max(image.size) // maximumSize
+            if reduceFactor >= 2:
+                image = image.reduce(reduceFactor)
+        if maximumSize > 0:
+            image = DeepDreamEngine.fit_image(image, max_dim=maximumSize)
+        logger.debug('-- path = "%s", size = %s', path, image.size)
+        return np.asarray(image)
+
+    @Slot(WorkerSignals, str, int)
+    def openImage(self, workerSignals, path, maximumSize):
+        '''Opens the image off the GUI thread. Signal imageOpened(list(4)): success, width, height, Image or message.'''
+        # If a dream is ongoing, stops it
+        self.stopDreaming()
+        logger.debug('path = "%s", maximumSize = %s', path, maximumSize)
+        openWorker = Worker(self._loadImage, path, maximumSize, taskName='opening image')
+        openWorker.setAutoDelete(False)
+        # The bridge must handle the result before the status bar (connections are queued in order)
+        openWorker.signals.connectSignal('finished', self.finishedOpenImage)
+        openWorker.signals.connectSelf(workerSignals)
+        self._workerSet(openWorker)
+        globalThreadPool.start(openWorker)
+
+    @Slot(int, object, bool, str)
+    @tracing.traced()
+    def finishedOpenImage(self, taskId, result, error, finalMessage):
+        global neuralImageBridge
+        logger.debug('>> taskId = %s', taskId)
+        self._dreamMutex.lock()
+        current = self.taskId == taskId
+        if current:
+            self._workerSet(None)
+        self._dreamMutex.unlock()
+        if not current:
+            logger.debug('<< superseded %s', taskId)
+            return
+        if error:
+            self._hasImageSet(False)
+            self.imageOpened.emit([False, 0, 0, finalMessage])
+        else:
+            neuralImageBridge.setSourceFromArray(result)
+            self._originalImage = neuralImageBridge.getRawArray()
+            self._dreamParameters = None
             self._hasImageSet(True)
             self._savedSet(True)
-            return [True, image.size[0], image.size[1], image]
-        except Exception: # pylint: disable=broad-except
-            etype, evalue, trace = sys.exc_info()
-            errorDescription = logAndFormatException(etype, evalue, trace)
-            self._hasImageSet(False)
-            return [False, 0, 0, errorDescription]
+            self.imageOpened.emit([True, result.shape[1], result.shape[0], result])
+        logger.debug('<< %s', taskId)
 
     @Slot(int, result=list)
     def pasteImage(self, maximumSize):
@@ -779,15 +1277,15 @@ class BridgeMainWindow(QObject):
             logger.debug('-- image = %s, maximumSize = %s', image, maximumSize)
             if image is None or image.isNull():
                 return [None, 0, 0, 'no image available in clipboard']
-            image = PIL.ImageQt.fromqpixmap(image)
-            image = self._enforceRGB(image)
+            imageArray = NeuralImageBridge.qimageToArray(image)
             if maximumSize > 0:
-                image = DeepDreamEngine.fit_image(image, max_dim=maximumSize)
-            self._originalImage = image
-            neuralImageBridge.setSourceFromPillow(image)
+                imageArray = self._fitArray(imageArray, maximumSize)
+            neuralImageBridge.setSourceFromArray(imageArray)
+            self._originalImage = neuralImageBridge.getRawArray()
+            self._dreamParameters = None
             self._hasImageSet(True)
             self._savedSet(False)
-            return [True, image.size[0], image.size[1], image]
+            return [True, imageArray.shape[1], imageArray.shape[0], imageArray]
         except Exception: # pylint: disable=broad-except
             etype, evalue, trace = sys.exc_info()
             errorDescription = logAndFormatException(etype, evalue, trace)
@@ -800,42 +1298,120 @@ class BridgeMainWindow(QObject):
         try:
             # If a dream is ongoing, stops it
             self.stopDreaming()
-            image = self._originalImage
-            logger.debug('-- image = %s', image)
-            if image is None:
+            imageArray = self._originalImage
+            logger.debug('-- imageArray is None = %s', imageArray is None)
+            if imageArray is None:
                 return [None, 0, 0, 'no image to restore to']
-            neuralImageBridge.setSourceFromPillow(image)
+            neuralImageBridge.setSourceFromArray(imageArray)
             self._hasImageSet(True)
             self._savedSet(False)
-            return [True, image.size[0], image.size[1], image]
+            return [True, imageArray.shape[1], imageArray.shape[0], imageArray]
         except Exception: # pylint: disable=broad-except
             etype, evalue, trace = sys.exc_info()
             errorDescription = logAndFormatException(etype, evalue, trace)
             self._hasImageSet(False)
             return [False, 0, 0, errorDescription]
 
+    # --- Asynchronous image saving, signal .imageSaved
+    imageSaved = Signal(str, name='imageSaved')
+
+    def _describeDream(self, imageArray, dreamKwargs, *, layerName=None):
+        '''Parameters that produced a dream, to be embedded in saved images as JSON.'''
+        setupKwargs = self._setupKwargs or {}
+        dreamKwargs = dict(dreamKwargs, octaves=list(dreamKwargs['octaves']))
+        layerName = layerName or setupKwargs.get('layer_name')
+        return dict(version=PRODUCT_VERSION, model=setupKwargs.get('model_name'), layer=layerName,
+                    neurons=[setupKwargs.get('neuron_first'), setupKwargs.get('neuron_last')],
+                    tiled_rendering=setupKwargs.get('tiled_rendering'), dream_kwargs=dreamKwargs,
+                    source_sha256=hashlib.sha256(imageArray).hexdigest(),
+                    source_shape=list(imageArray.shape))
+
+    @staticmethod
+    def _writeImage(imageArray, path, quality, metadata):
+        '''
+        Encodes an image array to path, atomically (a temporary file in the same folder is renamed over the target),
+        embedding metadata as a PNG text chunk or as EXIF. Runs on the writer thread.
+        '''
+        path = Path(path)
+        imageSuffix = path.suffix.lower()
+        height, width = imageArray.shape[:2]
+        imagePillow = PIL.Image.frombuffer('RGB', (width, height), imageArray, 'raw', 'RGB', 0, 1)
+        saveKwargs = {}
+        metadataText = json.dumps(metadata) if metadata else ''
+        if imageSuffix == '.png':
+            # Qt quality scale: 0 is the smallest file, 100 the fastest
+            saveKwargs['compress_level'] = PNG_COMPRESS_LEVEL_DEF if quality < 0 else round((100 - quality) * 9 / 100)
+            pngInfo = PIL.PngImagePlugin.PngInfo()
+            pngInfo.add_text('Software', f'{appName} {PRODUCT_VERSION}')
+            if metadataText:
+                pngInfo.add_itxt(METADATA_KEY, metadataText)
+            saveKwargs['pnginfo'] = pngInfo
+        elif imageSuffix in ('.jpg', '.jpeg'):
+            saveKwargs['quality'] = JPEG_QUALITY_DEF if quality < 0 else quality
+            exif = PIL.Image.Exif()
+            exif[EXIF_SOFTWARE] = f'{appName} {PRODUCT_VERSION}'
+            if metadataText:
+                exif[EXIF_IMAGE_DESCRIPTION] = json.dumps({METADATA_KEY: metadata}, ensure_ascii=True)
+            saveKwargs['exif'] = exif.tobytes()
+        imageFormat = PIL.Image.registered_extensions()[imageSuffix]
+        fileHandle, temporaryPath = tempfile.mkstemp(prefix=f'.{path.stem}_', suffix=imageSuffix, dir=path.parent)
+        try:
+            with os.fdopen(fileHandle, 'wb') as imageFile:
+                imagePillow.save(imageFile, format=imageFormat, **saveKwargs)
+                imageFile.flush()
+                os.fsync(imageFile.fileno())
+            os.replace(temporaryPath, path)
+        except BaseException:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+            raise
+        logger.debug('-- saved "%s"', path)
+        return str(path)
+
     @Slot(str, int, result=str)
+    @tracing.traced()
     def saveImage(self, path, quality):
-        '''Quality is an integer in [0, 100] or -1 for Qt default. Returns str: error message ("" if ok).'''
+        '''
+        Quality is an integer in [0, 100] or -1 for default. Returns str: error message ("" if the save started).
+        Signal imageSaved(str): error message ("" if ok), once the file is written on the writer thread.
+        '''
+        global neuralImageBridge
         try :
             logger.debug('path = "%s"', path)
-            pixmap = neuralImageBridge.getRawPixmap()
             imageSuffix = PurePath(path).suffix.lower()
             if imageSuffix not in SAVE_SUFFIXES:
                 return f'unrecognized image format: "{imageSuffix}"'
-            pixmap.save(path, quality=quality)
-            self._savedSet(True)
+            # Arrays in the bridge are never modified, so the writer may encode it while the dream goes on
+            imageArray = neuralImageBridge.getRawArray()
+            self._savingArray = imageArray
+            writeWorker = Worker(self._writeImage, imageArray, path, quality, self._dreamParameters,
+                                 taskName='saving image')
+            writeWorker.setAutoDelete(False)
+            writeWorker.signals.connectSignal('finished', self.finishedSaveImage)
+            self._writeWorker = writeWorker
+            writerThreadPool.start(writeWorker)
             return ''
         except Exception: # pylint: disable=broad-except
             etype, evalue, trace = sys.exc_info()
             errorDescription = logAndFormatException(etype, evalue, trace)
             return errorDescription
 
+    @Slot(int, object, bool, str)
+    @tracing.traced()
+    def finishedSaveImage(self, taskId, _result, error, finalMessage):
+        global neuralImageBridge
+        logger.debug('-- taskId = %s, error = %s', taskId, error)
+        if not error and neuralImageBridge.currentArray is self._savingArray:
+            self._savedSet(True)
+        self._writeWorker = None
+        self.imageSaved.emit(finalMessage if error else '')
+
     @Slot(result=bool)
     def copyImage(self):
         global neuralImageBridge, clipboard
         try:
-            image = neuralImageBridge.getRawPixmap().toImage()
+            # The clipboard outlives the current array, so it gets its own pixels
+            image = neuralImageBridge.getRawImage().copy()
             clipboard.setImage(image)
             logger.debug('copy ok, image = %s', image)
             return True
@@ -848,43 +1424,71 @@ class BridgeMainWindow(QObject):
 # --- Dynamic image provider for Main window
 
 class NeuralImageBridge(QQuickImageProvider):
+    '''
+    Holds the canonical pixels of the current image: a contiguous uint8 (height, width, 3) numpy array, which is handed
+    as-is to the dream engine, and a QImage wrapping the same memory, for display, saving, and the clipboard. Arrays
+    given to the bridge are never modified afterwards: a new image always replaces the array.
+    '''
 
     imageChangedSignal = Signal(int, name = 'imageChanged')
 
     def __init__(self, flags=None):
         logger.debug('--')
         if flags is None:
-            super().__init__(QQuickImageProvider.ImageType.Pixmap)
+            super().__init__(QQuickImageProvider.ImageType.Image)
         else:
-            super().__init__(QQuickImageProvider.ImageType.Pixmap, flags=flags)
-        self.currentPixmap = None
+            super().__init__(QQuickImageProvider.ImageType.Image, flags=flags)
+        self.currentArray = None
+        self.currentImage = None
         self.currentWidth = None
         self.currentHeight = None
         self.taskId = _NO_TASK_ID
 
-    def _updatePixmap(self, pixmap, taskId):
+    def _updateArray(self, imageArray, taskId):
         logger.debug('taskId = %s', taskId)
-        self.currentPixmap = pixmap
-        self.currentWidth  = pixmap.width()
-        self.currentHeight = pixmap.height()
+        imageArray = np.ascontiguousarray(imageArray, dtype=np.uint8) # No copy for arrays from the engine
+        self.currentHeight, self.currentWidth = imageArray.shape[:2]
+        # The QImage does not own the memory: self.currentArray keeps it alive for as long as the QImage is current
+        self.currentArray = imageArray
+        self.currentImage = QImage(imageArray.data, self.currentWidth, self.currentHeight, imageArray.strides[0],
+                                   QImage.Format.Format_RGB888)
         self.taskId = taskId
         self.imageChanged()
 
     def setSourceFromPath(self, imagePath, /, *, taskId=_SOURCE_IMAGE_TASK_ID):
-        self._updatePixmap(QPixmap(imagePath), taskId=taskId)
+        self.setSourceFromQImage(QImage(imagePath), taskId=taskId)
 
     def setSourceFromPillow(self, imagePillow, /, *, taskId=_SOURCE_IMAGE_TASK_ID):
-        self._updatePixmap(PIL.ImageQt.toqpixmap(imagePillow), taskId=taskId)
+        self._updateArray(np.asarray(imagePillow), taskId=taskId)
 
     def setSourceFromArray(self, imageArray, /, *, taskId=_SOURCE_IMAGE_TASK_ID):
-        imagePillow = PIL.Image.fromarray(imageArray)
-        self._updatePixmap(PIL.ImageQt.toqpixmap(imagePillow), taskId=taskId)
+        self._updateArray(imageArray, taskId=taskId)
 
-    def setSourceFromPixmap(self, pixmap, /, *, taskId=_SOURCE_IMAGE_TASK_ID):
-        self._updatePixmap(pixmap, taskId=taskId)
+    def setSourceFromQImage(self, image, /, *, taskId=_SOURCE_IMAGE_TASK_ID):
+        self._updateArray(self.qimageToArray(image), taskId=taskId)
 
-    def requestPixmap(self, imageId, size, requestedSize):
-        if self.currentPixmap is None:
+    @staticmethod
+    def qimageToArray(image):
+        '''Copies a QImage of any format into a new uint8 RGB array, compositing transparency over a background.'''
+        if image.hasAlphaChannel():
+            background = QImage(image.size(), QImage.Format.Format_RGB888)
+            background.fill(QColor(*TRANSPARENT_BACKGROUND))
+            painter = QPainter(background)
+            painter.drawImage(0, 0, image)
+            painter.end()
+            image = background
+        else:
+            image = image.convertToFormat(QImage.Format.Format_RGB888)
+        width, height, bytesPerLine = image.width(), image.height(), image.bytesPerLine()
+        imageArray = np.frombuffer(image.constBits(), dtype=np.uint8, count=height*bytesPerLine)
+        imageArray = imageArray.reshape(height, bytesPerLine)[:, :width*3].reshape(height, width, 3)
+        return imageArray.copy() # The QImage owns the memory viewed by imageArray
+
+    @tracing.traced()
+    def requestImage(self, imageId, size, requestedSize):
+        if imageId.startswith('gallery/'):
+            return self.requestGalleryImage(imageId, size, requestedSize)
+        if self.currentImage is None:
             raise ValueError('no image available in image bridge!')
         if not imageId.startswith('current/'):
             raise ValueError(f'unrecognized image requested: {imageId}')
@@ -894,16 +1498,44 @@ class NeuralImageBridge(QQuickImageProvider):
         requestedHeight = requestedSize.height()
         width  = requestedWidth  if requestedWidth>0  else self.currentWidth
         height = requestedHeight if requestedHeight>0 else self.currentHeight
-        scaledPixmap =  self.currentPixmap.scaled(width, height, mode=Qt.SmoothTransformation)
+        if width == self.currentWidth and height == self.currentHeight:
+            # The scene graph may hold the image after the current array is replaced: it needs its own pixels
+            scaledImage = self.currentImage.copy()
+        else:
+            scaledImage = self.currentImage.scaled(width, height, mode=Qt.SmoothTransformation)
         logger.debug('id: "%s", requestedSize: %s, width: %s, height: %s, scaled: %s',
-                     imageId, requestedSize, width, height, scaledPixmap)
-        return scaledPixmap
+                     imageId, requestedSize, width, height, scaledImage)
+        return scaledImage
+
+    def requestGalleryImage(self, imageId, size, requestedSize):
+        '''Images of the dream jobs, with ids "gallery/<jobId>/<revision>".'''
+        global dreamGallery
+        jobId = int(imageId.split('/')[1])
+        imageArray = dreamGallery.jobImage(jobId)
+        if imageArray is None:
+            raise ValueError(f'no image available for job {jobId}!')
+        height, width = imageArray.shape[:2]
+        size.width  = width
+        size.height = height
+        image = QImage(imageArray.data, width, height, imageArray.strides[0], QImage.Format.Format_RGB888)
+        requestedWidth  = requestedSize.width()  if requestedSize.width()>0  else width
+        requestedHeight = requestedSize.height() if requestedSize.height()>0 else height
+        if requestedWidth == width and requestedHeight == height:
+            return image.copy()
+        return image.scaled(requestedWidth, requestedHeight, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    def getRawArray(self):
+        logger.debug('--')
+        if self.currentArray is None:
+            raise ValueError('no image available in image bridge!')
+        return self.currentArray
 
-    def getRawPixmap(self):
+    def getRawImage(self):
+        '''The QImage over the current array: valid only until the image changes, copy it to keep it longer.'''
         logger.debug('--')
-        if self.currentPixmap is None:
+        if self.currentImage is None:
             raise ValueError('no image available in image bridge!')
-        return self.currentPixmap
+        return self.currentImage
 
     def connectSignal(self, signal, slot):
         '''Connects a particular signal to a slot'''
@@ -965,50 +1597,11 @@ class KeySequences(QObject):
             return ''
         return  f' <i>{shortcut_text}</i>'
 
-def openUTF8Resource(resourcePath, lines=False):
-    with open(resourcePath, 'rt', encoding='utf-8') as resourceFile:
-        resource = resourceFile.readlines() if lines else resourceFile.read()
-    return resource
-
-def qmlProcessMenu(menuSource, platform, platformPrefix='QtPl.', qtPrefix='', sequenceGetter='mksq'):
-    '''Processes menu source, using or not platform version.'''
-    if platform:
-        menuSource = re.sub(r'action:\s*([A-Za-z0-9_]+)',
-                            r'QtPl.MenuItem { text: \1.text; shortcut: \1.shortcut; checkable: \1.checkable; '
-                            r'checked: \1.checked; enabled: \1.enabled; onTriggered: \1.trigger() }', menuSource)
-        importPrefix = platformPrefix
-        menuElement = 'Menu'
-        openFunction = 'open'
-    else:
-        if sequenceGetter:
-            replacement  = r'MenuItem { text: \1.text + '
-            replacement += sequenceGetter + r'.inMenu(\1.shortcut ? \1.shortcut  : ""); action: \1 }'
-        else:
-            replacement = r'MenuItem { action: \1 }'
-        menuSource = re.sub(r'action:\s*([A-Za-z0-9_]+)', replacement, menuSource)
-        importPrefix = qtPrefix
-        menuElement = 'MenuFit'
-        openFunction = 'popup'
-    menuSource = re.sub(r'^\s*@\.', importPrefix, menuSource, flags=re.MULTILINE)
-    menuSource = re.sub(r'<Menu>', menuElement, menuSource)
-    menuSource = re.sub(r'{([\t ]*\n)*[\t ]*', '{ ', menuSource)
-    menuSource = re.sub(r'}([\t ]*\n)*[\t ]*', '} ', menuSource)
-    menuSource = re.sub(r'([\t ]*\n)+[\t ]*', '; ', menuSource)
-    return menuSource, openFunction
-
-def qmlTranslateAllMenus(qmlSource, menuPathPrefix, platform, sequenceGetter='mksq'):
-    for menuType in ('menubar', 'menucontext',):
-        qmlMenuPath = menuPathPrefix + f'-{menuType}.qml'
-        qmlMenuSource = openUTF8Resource(qmlMenuPath)
-        qmlMenuSource, openFunction = qmlProcessMenu(qmlMenuSource, platform=platform, sequenceGetter=sequenceGetter)
-        if menuType == 'menubar' and not platform:
-            qmlMenuSource = f'menuBar: {qmlMenuSource}'
-        qmlSource = qmlSource.replace(f'//<<<application_{menuType}>>>//', qmlMenuSource)
-        qmlSource = qmlSource.replace(f'application_{menuType}_open_function', openFunction)
-    return qmlSource
-
 # --- main routine
 def main():
+    if TRACE_MODE != 'off':
+        startTracing()
+
     # registers application fonts
 
     # prepares the application
@@ -1055,20 +1648,17 @@ def main():
     if not settings.value('settings/st_firstExecutionAccepted', False):
         return -1
 
-    # opens the QML source and applies necessary translations
+    # opens the QML source with the necessary translations, from the cache of translated sources if possible, so the
+    # engine may reuse its compiled cache for the file
     qmlPath = qmlDir / 'Cookadream.qml'
-    qmlSource = openUTF8Resource(qmlPath)
-    qmlSource = qmlTranslateAllMenus(qmlSource, str(qmlPath.with_suffix('')), platform=PLATFORM_MENUS,
-                                     sequenceGetter = '' if NATIVE_MENUS_SHORTCUTS == 'N' else 'mksq')
-    # qmlTarget = qmlDir / 'translated_source.qml'
-    # with open(qmlTarget , 'wt', encoding='utf-8') as debugSorce:
-    #     print(qmlSource, file=debugSorce)
-    logger.debug('-- QML source translated')
+    qmlCacheDir = Path(QStandardPaths.writableLocation(QStandardPaths.CacheLocation)) / 'qml'
+    qmlVariantPath, qmlCached = qml_menus.qmlCachedVariant(qmlPath, qmlCacheDir, platform=PLATFORM_MENUS,
+                                                          sequenceGetter='' if NATIVE_MENUS_SHORTCUTS == 'N' else 'mksq',
+                                                          theme=CONTROLS_THEME)
+    logger.debug('-- QML source translated, path = "%s", cached = %s', qmlVariantPath, qmlCached)
 
     # loads the QML engine
-    qmlSource = qmlSource.encode()
-    qmlPathToEngine = qmlPath.as_uri()
-    engine.loadData(qmlSource, url=qmlPathToEngine)
+    engine.load(qmlVariantPath.as_uri())
     rootObjects = engine.rootObjects()
     if not rootObjects:
         sys.exit(-1)
@@ -1078,6 +1668,8 @@ def main():
     logger.debug('>> app.exec')
     status = app.exec()
     logger.debug('<< app.exec')
+    # lets pending saves complete
+    writerThreadPool.waitForDone()
     return status
 
 if __name__ == '__main__':
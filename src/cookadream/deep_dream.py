@@ -14,22 +14,34 @@
 # ======================================================================================================================
 # pylint: disable=invalid-name
 # This module uses TensorFlow (instead of Qt) naming conventions
+import collections
+import contextlib
+import ctypes
+import ctypes.util
+import gc
+import hashlib
 import logging
+import os
+import tempfile
+import time
+import types
 # import sys
 from datetime import datetime
 
 import numpy as np
+import PIL.Image
 import tensorflow as tf
-import keras
 # import tensorflow_model_optimization as tfmot
 
+from cookadream import noise, pruning, tracing
+
 logger = logging.getLogger('deep_dream')
 
 MIN_DIM = 128 # Minimum image size that will not cause problems with the convolution operations
 MAX_DIM = 1024
 
 STEPS_MIN = 10
-STEPS_MAX = 20
+STEPS_MAX = 20 # Largest block of steps run between checks, whatever the budget
 STEPS_DEF = 40
 STEP_SIZE_DEF = 0.025
 SMOOTHING_DEF = -100
@@ -37,6 +49,29 @@ JITTER_DEF = 4
 OCTAVE_SCALING_DEF = 1/3
 OCTAVES_BLENDING_DEF = 0.2
 TILE_SIZE_DEF = 512
+ANIMATION_ZOOM_DEF = 1.02
+ATLAS_TILE_SIZE_DEF = 256
+ATLAS_BATCH_SIZE_DEF = 16
+ATLAS_SPACING_DEF = 4
+TILE_MARGIN_DEF = 64 # Context around each out-of-core tile, feathered when blending the tile back
+STRIP_ROWS_DEF = 256 # Rows processed at once when converting or resizing out-of-core images
+PYRAMID_CACHE_SIZE = 2 # Inputs whose image pyramids are kept, for re-dreams of the same image
+JIT_COMPILE_MODES = ('off', 'on', 'auto',)
+JIT_PROBE_STEPS = 4 # Timed steps of each kind of graph before deciding whether XLA compilation pays off
+JIT_MIN_SPEEDUP = 1.1 # Compilation happens again at each octave size, so a marginal gain is not worth it
+DRAFT_MAX_DIM = 256 # Size of the quick drafts of the interactive dreams, refined afterwards at full resolution
+DRAFT_STEPS = STEPS_MIN # Steps per octave of the drafts
+PARAMETERIZATIONS = ('pixels', 'fourier',)
+PARAMETERIZATION_DEF = 'pixels'
+FOURIER_DECAY_DEF = 0.25 # Decay of the spectrum scales (1/f^decay): the pink noise's 1 saturates the low frequencies
+# Square root of the colour correlation of natural images (from its SVD), for RGB channels
+COLOR_CORRELATION_SVD_SQRT = [[0.26,  0.09,  0.02],
+                              [0.27,  0.00, -0.05],
+                              [0.27, -0.09,  0.03]]
+
+ADAM_BETA_1 = 0.99
+ADAM_BETA_2 = 0.999
+ADAM_EPSILON = 1e-1
 
 TF_BOOL = tf.bool
 TF_FLOAT = tf.float32
@@ -46,23 +81,335 @@ TF_TO_IMAGE_ARRAY_TYPE = tf.uint8
 NP_FLOAT = np.float32
 NP_IMAGE_TYPE = np.uint8
 
-PROGRESS_INTERVAL = 5 # Progress feedback in seconds
+PREVIEW_BUDGET = 1. # Seconds between previews of an ongoing dream (freshness)
+STEP_BLOCK_BUDGET = 0.2 # Seconds of steps run at once, between checks for cancellation (responsiveness)
+LOG_SAMPLE_INTERVAL = 2. # Seconds between debug records of the hot paths
+CONVERGENCE_TOLERANCE_DEF = 0. # Relative improvement of the loss per STEPS_MIN steps below which it plateaus (0: off)
+CONVERGENCE_PATIENCE_DEF = 2 # Windows of STEPS_MIN or more steps on the plateau before an octave stops early
 
 DEEP_DREAM_ENGINE_DEVICES = [d.name for d in tf.config.list_logical_devices()]
 
 PREPROCESS_CAFFE_MEAN = [103.939, 116.779, 123.68]
 
 RELU_WARMUP_STEPS = 8
-relu_warmup_steps_tf = None
-global_relu_step = None
-global_relu_step_increment = None
+
+
+class ReluWarmup:
+    '''
+    The ReLU warm-up state of an engine. For the first warmup_steps steps of each optimization, the ReLUs patched by
+    patch_relus let through the gradients that push negative inputs up (see transparent_relu_for). Each engine owns
+    its state, so engines in the same process, even on parallel threads, do not disturb each other's warm-up.
+
+    The phase is fixed when a graph is traced: the modules trace one graph for the warm-up and another for the normal
+    steps, and switch between them at the boundary, so the normal steps run the native ReLU gradient.
+    '''
+
+    def __init__(self, warmup_steps=RELU_WARMUP_STEPS):
+        self.warmup_steps = warmup_steps
+        self.step = 0
+        self.patched = 0
+        self.tracing_warmup = False
+        self.transparent_relu = transparent_relu_for(self)
+
+    @property
+    def active(self):
+        '''Whether the next step is a warm-up step. Always False if no ReLU was patched.'''
+        return self.patched > 0 and self.step < self.warmup_steps
+
+    @contextlib.contextmanager
+    def phase(self, warmup):
+        '''Sets the phase read by the patched ReLUs while the graphs called in the block are traced.'''
+        tracing_warmup = self.tracing_warmup
+        self.tracing_warmup = warmup
+        try:
+            yield
+        finally:
+            self.tracing_warmup = tracing_warmup
+
+    def patch_relus(self, model):
+        '''Replaces the function of the ReLU activation layers of model (and only of that model instance).'''
+        patched = 0
+        for layer in model.layers:
+            if isinstance(layer, tf.keras.layers.Activation) and layer.get_config().get('activation') == 'relu':
+                layer.activation = self.transparent_relu
+                patched += 1
+        self.patched += patched
+        logger.debug('-- patched %s relu activations with transparent_relu', patched)
+
+
+def memory_usage(device_name=None):
+    '''
+    Returns a dict with the resident memory of the process (rss, on Linux) and, for accelerators, the memory in use by
+    TensorFlow on the device (device_current, device_peak), in bytes. Unavailable measures are None.
+    '''
+    rss = None
+    try:
+        with open('/proc/self/statm', 'rt', encoding='ascii') as statm:
+            rss = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    device_current = device_peak = None
+    if device_name is not None and 'CPU' not in device_name.upper():
+        try:
+            memory_info = tf.config.experimental.get_memory_info(device_name.replace('/device:', ''))
+            device_current, device_peak = memory_info['current'], memory_info['peak']
+        except (ValueError, tf.errors.OpError):
+            pass
+    return dict(rss=rss, device_current=device_current, device_peak=device_peak)
+
+
+def format_memory_usage(usage):
+    return ', '.join(f'{k} = {v/2**20:.0f} MiB' for k,v in usage.items() if v is not None) or 'unavailable'
+
+
+def trim_memory():
+    '''Collects the garbage and asks the C allocator to return its free arenas to the system (glibc only).'''
+    gc.collect()
+    libc_name = ctypes.util.find_library('c')
+    if libc_name:
+        with contextlib.suppress(OSError, AttributeError):
+            ctypes.CDLL(libc_name).malloc_trim(0)
+
+
+class LogSampler:
+    '''
+    Rate-limits the debug records of a hot path to one every interval seconds, counting the records skipped, so debug
+    logging may stay on without slowing the dreams. Calling the sampler answers whether to log now.
+    '''
+
+    def __init__(self, interval=LOG_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.next_time = 0.
+        self.skipped = 0
+
+    def __call__(self):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return False
+        now = time.monotonic()
+        if now < self.next_time:
+            self.skipped += 1
+            return False
+        self.next_time = now + self.interval
+        return True
+
+    def take_skipped(self):
+        skipped, self.skipped = self.skipped, 0
+        return skipped
+
+
+class StepScheduler:
+    '''
+    Sizes the blocks of optimizer steps to a wall-time budget, from the time per step measured during the dream, so that
+    cancellation checks and previews come at a steady pace whatever the size of the octave. The first block of each
+    octave includes the retracing of the graphs and is not measured: the estimate carries over from the previous octave,
+    scaled by the number of pixels, or a single step probes the cost on the first octave.
+    '''
+
+    def __init__(self, *, budget=STEP_BLOCK_BUDGET, max_block=STEPS_MAX):
+        self.budget = budget
+        self.max_block = max_block
+        self.seconds_per_step = None
+        self.pixels = None
+        self.measuring = False
+
+    def start_octave(self, pixels):
+        if self.seconds_per_step is not None and self.pixels:
+            self.seconds_per_step *= pixels / self.pixels
+        self.pixels = pixels
+        self.measuring = False
+
+    def next_block(self, steps_left):
+        if self.seconds_per_step is None:
+            block = 1
+        else:
+            block = int(self.budget / max(self.seconds_per_step, 1e-6))
+        return max(1, min(block, self.max_block, steps_left))
+
+    def record(self, steps, seconds):
+        if not self.measuring:
+            self.measuring = True
+            return
+        seconds_per_step = seconds / steps
+        if self.seconds_per_step is None:
+            self.seconds_per_step = seconds_per_step
+        else:
+            self.seconds_per_step = 0.5 * (self.seconds_per_step + seconds_per_step)
+
+
+class ConvergenceMonitor:
+    '''
+    Detects the plateau of the loss of an octave, from the mean loss of the blocks of steps, gathered in windows of at
+    least STEPS_MIN steps, since the loss of single steps is noisy (random crops, jitter). The octave has converged
+    once the loss improved by less than tolerance, relative and scaled to STEPS_MIN steps, in patience windows in a row.
+    A tolerance of zero never stops.
+    '''
+
+    def __init__(self, *, tolerance=CONVERGENCE_TOLERANCE_DEF, patience=CONVERGENCE_PATIENCE_DEF):
+        self.tolerance = tolerance
+        self.patience = patience
+        self.start_octave()
+
+    def start_octave(self):
+        self.last_loss = None
+        self.window_steps = 0
+        self.window_loss = 0.
+        self.stalled = 0
+
+    def record(self, steps, mean_loss):
+        '''Records a block of steps and their mean loss (minimized); returns whether the octave has converged.'''
+        if self.tolerance <= 0.:
+            return False
+        self.window_steps += steps
+        self.window_loss += steps * mean_loss
+        if self.window_steps < STEPS_MIN:
+            return False
+        loss = self.window_loss / self.window_steps
+        if self.last_loss is not None:
+            improvement = (self.last_loss - loss) / max(abs(self.last_loss), 1e-8) * STEPS_MIN / self.window_steps
+            self.stalled = self.stalled + 1 if improvement < self.tolerance else 0
+        self.last_loss = loss
+        self.window_steps = 0
+        self.window_loss = 0.
+        return self.stalled >= self.patience
+
+
+class ImagePyramid:
+    '''
+    The preprocessed input of a dream at every octave scale. The scales are downsampled with anti-aliasing, computed on
+    first use, and kept, so the octave loop, the blending of octaves and repeated dreams of the same input share them.
+    The input may be a batch of same-size images.
+    '''
+
+    def __init__(self, original_tf):
+        self.original_tf = original_tf
+        self.base_shape = tf.shape(original_tf)[-3:-1]
+        self.float_base_shape = tf.cast(self.base_shape, TF_FLOAT)
+        self.levels = {tuple(self.base_shape.numpy()): original_tf}
+
+    def octave_shape(self, octaves_scaling, octave):
+        return tf.cast(self.float_base_shape*(octaves_scaling**octave), TF_INT)
+
+    def level(self, shape):
+        '''Returns the preprocessed input resized to shape.'''
+        key = tuple(int(d) for d in shape)
+        level_tf = self.levels.get(key)
+        if level_tf is None:
+            with tracing.span('pyramid_level', shape=key):
+                level_tf = self.levels[key] = tf.image.resize(self.original_tf, shape, antialias=True)
+        return level_tf
+
+
+class FourierParameterization(tf.Module):
+    '''
+    Parameterizes images of a fixed shape by the Fourier spectrum of their colour-decorrelated channels, scaled by
+    1/f^decay, as the noise of the noise module. An optimizer working on that spectrum takes steps of similar size on
+    all frequencies and colours, instead of mostly on the high, correlated ones, as on raw pixels, so it converges in
+    fewer steps and with less high-frequency noise. The mapping is linear and invertible: spectra are stored as real
+    tensors of shape (..., channels, height, frequencies, 2), with the real and imaginary parts on the last axis.
+
+    Adam moves every coefficient by about the same amount per step, whatever its gradient, so the scales are the
+    spectrum of the steps on the image: a steep decay or a weak colour axis would take huge steps on the lowest
+    frequencies, which saturate the image, and tiny ones elsewhere. The decay is milder than the noise's, and the
+    colour axes (the principal axes of the colour correlation) all have unit gain.
+    '''
+
+    def __init__(self, shape, /, *, channels='RGB', decay=FOURIER_DECAY_DEF):
+        super().__init__()
+        self.height, self.width = int(shape[-3]), int(shape[-2])
+        # Odd widths are parameterized one column wider, the extra column being cropped from the images
+        self.fft_shape = (self.height, self.width + self.width % 2)
+        scale = noise.spectrum_scale(self.fft_shape[1], self.height, decay)
+        scale = scale / np.sqrt(np.mean(np.square(scale))) # Unit RMS: step sizes stay comparable to the pixels
+        self.scale = tf.constant(scale[..., None], dtype=TF_FLOAT)
+        self.fft_norm = tf.constant(np.sqrt(np.prod(self.fft_shape)), dtype=TF_FLOAT) # Orthonormal transform
+        color = np.asarray(COLOR_CORRELATION_SVD_SQRT, dtype=NP_FLOAT)
+        color /= np.linalg.norm(color, axis=0)
+        if channels == 'BGR':
+            color = color[::-1, ::-1]
+        self.color = tf.constant(color, dtype=TF_FLOAT)
+        self.color_inverse = tf.constant(np.linalg.inv(color), dtype=TF_FLOAT)
+
+    @tf.function
+    def to_image(self, spectrum_tf):
+        logger.info('-- retracing tf.function fourier.to_image(spectrum_tf.shape=%s)', spectrum_tf.shape)
+        spectrum_tf = spectrum_tf * self.scale
+        channels_tf = tf.signal.irfft2d(tf.complex(spectrum_tf[..., 0], spectrum_tf[..., 1]),
+                                        fft_length=self.fft_shape) * self.fft_norm
+        image_tf = tf.einsum('...chw,dc->...hwd', channels_tf, self.color)
+        return image_tf[..., :self.width, :]
+
+    @tf.function
+    def to_spectrum(self, image_tf):
+        logger.info('-- retracing tf.function fourier.to_spectrum(image_tf.shape=%s)', image_tf.shape)
+        if self.fft_shape[1] != self.width:
+            paddings = [[0, 0]] * (len(image_tf.shape)-2) + [[0, 1], [0, 0]]
+            image_tf = tf.pad(image_tf, paddings, mode='SYMMETRIC')
+        channels_tf = tf.einsum('...hwc,dc->...dhw', image_tf, self.color_inverse)
+        spectrum_tf = tf.signal.rfft2d(channels_tf) / tf.cast(self.fft_norm, tf.complex64)
+        return tf.stack([tf.math.real(spectrum_tf), tf.math.imag(spectrum_tf)], axis=-1) / self.scale
+
+    @tf.function
+    def spectrum_gradients(self, spectrum_tf, image_gradients):
+        '''Back-propagates gradients with respect to the image of spectrum_tf to gradients with respect to it.'''
+        logger.info('-- retracing tf.function fourier.spectrum_gradients(spectrum_tf.shape=%s)', spectrum_tf.shape)
+        with tf.GradientTape() as tape:
+            tape.watch(spectrum_tf)
+            image_tf = self.to_image(spectrum_tf)
+        return tape.gradient(image_tf, spectrum_tf, output_gradients=image_gradients)
+
+    @tf.function
+    def clip(self, spectrum_tf, minimum, maximum):
+        '''Returns the spectrum of the image of spectrum_tf clipped to [minimum; maximum], and that image.'''
+        logger.info('-- retracing tf.function fourier.clip(spectrum_tf.shape=%s)', spectrum_tf.shape)
+        image_tf = tf.clip_by_value(self.to_image(spectrum_tf), minimum, maximum)
+        return self.to_spectrum(image_tf), image_tf
+
+
+class JitPolicy:
+    '''
+    Whether the gradient steps of a model run XLA-compiled (jit_compile), shared by all the modules of the model. In
+    'auto' mode, the first steps alternate between the compiled and the plain graphs, timed after the warm-up of each
+    image shape, and compilation is kept only if it is faster by JIT_MIN_SPEEDUP. In any mode, a failure compiling the
+    graph falls back to the plain graph for good.
+    '''
+
+    def __init__(self, model_name, mode):
+        if mode not in JIT_COMPILE_MODES:
+            raise ValueError(f'unrecognized jit_compile mode "{mode}", expected one of {JIT_COMPILE_MODES}')
+        self.model_name = model_name
+        self.mode = mode
+        self.state = 'probing' if mode == 'auto' else mode
+        self.timings = {True: [], False: []}
+
+    @property
+    def probing(self):
+        return self.state == 'probing'
+
+    def use_jit(self):
+        if self.probing:
+            return len(self.timings[True]) <= len(self.timings[False])
+        return self.state == 'on'
+
+    def record(self, jit, seconds):
+        self.timings[jit].append(seconds)
+        if min(len(t) for t in self.timings.values()) < JIT_PROBE_STEPS:
+            return
+        jit_time = float(np.median(self.timings[True]))
+        plain_time = float(np.median(self.timings[False]))
+        self.state = 'on' if plain_time >= JIT_MIN_SPEEDUP*jit_time else 'off'
+        logger.info('-- jit_compile for %s is %s: %.1f ms/step compiled, %.1f ms/step plain', self.model_name,
+                    self.state, 1000.*jit_time, 1000.*plain_time)
+
+    def fail(self, error):
+        logger.warning('-- jit_compile failed for %s, falling back to plain graphs: %s', self.model_name, error)
+        self.state = 'off'
 
 
 class DeepDream(tf.Module):
 
     '''Deep dream gradient ascent module.'''
-    def __init__(self, model, input_range, lr_multiplier, layer_name, neuron_first, neuron_last):
-        global relu_warmup_steps_tf, global_relu_step, global_relu_step_increment
+    def __init__(self, model, input_range, lr_multiplier, layer_name, neuron_first, neuron_last, jit_policy=None,
+                 relu_warmup=None, channels='RGB'):
         super().__init__()
         self.model = model
         self.input_range = input_range
@@ -80,11 +427,17 @@ class DeepDream(tf.Module):
         self.crop_size = None
         self.jitter_pixels = None
         self.image_tf_var = None
+        self.channels = channels
+        self.parameterization = None # A FourierParameterization while optimizing a spectrum, else None (pixels)
+        self.spectrum_tf_var = None
+        self.spectrum_image_tf = None # The image of spectrum_tf_var, clipped to the input range
         self.run_extra_args = []
         self.image_limits = None
-        relu_warmup_steps_tf = tf.constant(RELU_WARMUP_STEPS, dtype=TF_INT)
-        global_relu_step_increment = tf.constant(1, dtype=TF_INT)
-        global_relu_step = tf.Variable(initial_value=0, trainable=False, dtype=TF_INT)
+        self.jit_policy = jit_policy
+        self.jit_warm_shapes = set()
+        # Shared by the modules of an engine: its patched ReLUs read this state
+        self.relu_warmup = ReluWarmup() if relu_warmup is None else relu_warmup
+        self.phase_functions = {} # Created on demand by phase_function
 
     def range_hot(self, size, start, end):
         '''Returns a 1D tensor of given size with zeros in the range [start; end) and zeros elsewhere.'''
@@ -93,30 +446,154 @@ class DeepDream(tf.Module):
 
     @property
     def current_result(self):
-        return self.image_tf_var
+        return self.image_tf_var if self.parameterization is None else self.spectrum_image_tf
+
+    def release(self):
+        '''Drops the tensors of the last optimization (the image variable and the optimizer slots).'''
+        self.optimizer = None
+        self.image_tf_var = None
+        self.parameterization = self.spectrum_tf_var = self.spectrum_image_tf = None
 
     def start_optimizer(self, image_tf, /, *, crop_size=None, step_size=STEP_SIZE_DEF, smoothing_factor=SMOOTHING_DEF,
-                        jitter_pixels=JITTER_DEF):
-        global global_relu_step
+                        jitter_pixels=JITTER_DEF, parameterization=PARAMETERIZATION_DEF):
+        '''
+        Starts an optimization from image_tf. The optimizer works on the pixels, or, if parameterization is 'fourier',
+        on the decorrelated spectrum of the image (see FourierParameterization).
+        '''
         logger.debug('-- start_optimizer(image_tf.shape=%s, crop_size=%s, step_size=%s, smoothing_factor=%s, '
-                     'jitter_pixels=%s)', image_tf.shape, crop_size, step_size, smoothing_factor, jitter_pixels)
+                     'jitter_pixels=%s, parameterization=%s)', image_tf.shape, crop_size, step_size, smoothing_factor,
+                     jitter_pixels, parameterization)
+        if parameterization not in PARAMETERIZATIONS:
+            raise ValueError(f'unrecognized parameterization "{parameterization}"')
         # beta_1 = defaults to 0.9, beta_2 = defaults to 0.999, epsilon = defaults to 1e-7
-        self.optimizer = tf.optimizers.Adam(learning_rate=step_size * self.lr_multiplier, beta_1=0.99, epsilon=1e-1)
-        self.image_tf_var = tf.Variable(image_tf)
+        self.optimizer = tf.optimizers.Adam(learning_rate=step_size * self.lr_multiplier, beta_1=ADAM_BETA_1,
+                                            beta_2=ADAM_BETA_2, epsilon=ADAM_EPSILON)
+        if parameterization == 'fourier':
+            self.image_tf_var = None
+            self.parameterization = FourierParameterization(image_tf.shape, channels=self.channels)
+            self.spectrum_tf_var = tf.Variable(self.parameterization.to_spectrum(image_tf))
+            self.spectrum_image_tf = tf.convert_to_tensor(image_tf)
+        else:
+            self.parameterization = self.spectrum_tf_var = self.spectrum_image_tf = None
+            self.image_tf_var = tf.Variable(image_tf)
         self.crop_size = tf.constant(crop_size, dtype=TF_INT)
         self.smoothing_factor = tf.constant(smoothing_factor / (crop_size[0] * crop_size[1]), dtype=TF_FLOAT)
         self.jitter_pixels = tf.constant(jitter_pixels, dtype=TF_INT)
         self.run_extra_args = [self.jitter_pixels]
-        global_relu_step.assign(0)
+        self.relu_warmup.step = 0
+
+    def restart_optimizer(self, image_tf, /, *, relu_warmup=False):
+        '''
+        Restarts the optimization from image_tf, which must have the shape given to start_optimizer. The variable, the
+        optimizer and its slots are kept, so no graph is retraced and the moments carry over as a warm start.
+        '''
+        if self.parameterization is None:
+            self.image_tf_var.assign(image_tf)
+        else:
+            self.spectrum_tf_var.assign(self.parameterization.to_spectrum(image_tf))
+            self.spectrum_image_tf = tf.convert_to_tensor(image_tf)
+        self.relu_warmup.step = 0 if relu_warmup else self.relu_warmup.warmup_steps
 
+    @tracing.traced('run_steps')
     def run_steps(self, steps_to_run):
-        global global_relu_step, global_relu_step_increment
+        '''Runs steps_to_run optimizer steps; returns the mean loss of the steps, as a scalar tensor.'''
+        if self.parameterization is not None:
+            return self.run_spectrum_steps(steps_to_run)
+        loss_sum = 0.
         for _ in range(steps_to_run):
-            gradients = self.gradient_step(self.image_tf_var, self.smoothing_factor, self.crop_size,
-                                           *self.run_extra_args)
+            gradients, loss = self.step_gradients(self.image_tf_var, self.smoothing_factor, self.crop_size,
+                                                  *self.run_extra_args)
             self.optimizer.apply_gradients([[gradients, self.image_tf_var]])
             self.image_tf_var.assign(tf.clip_by_value(self.image_tf_var, self.input_range[0], self.input_range[1]))
-            global_relu_step.assign_add(global_relu_step_increment)
+            self.relu_warmup.step += 1
+            loss_sum += loss
+        return loss_sum / steps_to_run
+
+    def run_spectrum_steps(self, steps_to_run):
+        '''
+        Same steps as run_steps, on the spectrum of a FourierParameterization: the gradients of the pixels are taken
+        on its image, as usual, and mapped back to the spectrum, which is then projected back to the input range.
+        '''
+        parameterization = self.parameterization
+        loss_sum = 0.
+        for _ in range(steps_to_run):
+            gradients, loss = self.step_gradients(self.spectrum_image_tf, self.smoothing_factor, self.crop_size,
+                                                  *self.run_extra_args)
+            gradients = parameterization.spectrum_gradients(self.spectrum_tf_var, gradients)
+            self.optimizer.apply_gradients([[gradients, self.spectrum_tf_var]])
+            spectrum_tf, self.spectrum_image_tf = parameterization.clip(self.spectrum_tf_var, self.input_range[0],
+                                                                        self.input_range[1])
+            self.spectrum_tf_var.assign(spectrum_tf)
+            self.relu_warmup.step += 1
+            loss_sum += loss
+        return loss_sum / steps_to_run
+
+    def phase_function(self, name, *, warmup=False, jit=False):
+        '''
+        Returns the graph of the tf.function method name for a ReLU phase and a compilation mode (XLA if jit). The plain
+        graphs share the input signature of the method, and the plain graph of the normal steps is the method itself.
+        The XLA graphs have no input signature: they are traced for each image shape and each value of the Python
+        arguments (see static_arguments), so every shape in them is known at compile time.
+        '''
+        warmup = warmup and self.relu_warmup.patched > 0
+        if not warmup and not jit:
+            return getattr(self, name)
+        key = (name, warmup, jit)
+        function = self.phase_functions.get(key)
+        if function is None:
+            method = getattr(type(self), name)
+            function = self.phase_functions[key] = tf.function(types.MethodType(method.python_function, self),
+                                                               input_signature=None if jit else method.input_signature,
+                                                               jit_compile=jit)
+        return function
+
+    def phase_call(self, name, *args, jit=False):
+        '''Calls the graph of the tf.function method name for the current ReLU phase.'''
+        warmup = self.relu_warmup.active
+        with self.relu_warmup.phase(warmup):
+            return self.phase_function(name, warmup=warmup, jit=jit)(*args)
+
+    def window_gradients(self, image_tf, smoothing_factor):
+        return self.phase_call('window_gradient_step', image_tf, smoothing_factor)
+
+    @staticmethod
+    def static_arguments(args):
+        '''
+        The arguments of gradient_step with the crop size and the other arguments after the image and the smoothing
+        factor as Python values, so the jitter crop of an XLA graph has a fixed size for each octave.
+        '''
+        image_tf, smoothing_factor, *shape_args = args
+        return (image_tf, smoothing_factor,
+                *(tuple(a.numpy().tolist()) if a.shape.rank else a.numpy().item() for a in shape_args))
+
+    def step_gradients(self, *args):
+        '''
+        Calls the gradient_step graph of the current ReLU phase, XLA-compiled or not as the jit_policy decides, timing
+        the steps while probing. Returns the gradients and the loss, as gradient_step.
+        '''
+        policy = self.jit_policy
+        if policy is None or policy.state == 'off':
+            return self.phase_call('gradient_step', *args)
+        jit = policy.use_jit()
+        probing = policy.probing
+        step_start = time.perf_counter()
+        try:
+            gradients, loss = self.phase_call('gradient_step', *(self.static_arguments(args) if jit else args), jit=jit)
+            if probing:
+                DeepDreamEngine.wait_for(gradients)
+        except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError, tf.errors.InternalError) as error:
+            if not jit:
+                raise
+            policy.fail(error)
+            return self.phase_call('gradient_step', *args)
+        if probing:
+            # The first step of each graph on each shape includes the tracing and the compilation
+            warm_key = (jit, self.relu_warmup.active, tuple(args[0].shape))
+            if warm_key in self.jit_warm_shapes:
+                policy.record(jit, time.perf_counter() - step_start)
+            else:
+                self.jit_warm_shapes.add(warm_key)
+        return gradients, loss
 
     @tf.function(
         input_signature=(
@@ -127,6 +604,7 @@ class DeepDream(tf.Module):
             )
     )
     def gradient_step(self, image_tf, smoothing_factor, crop_size, jitter_pixels):
+        '''Returns the normalized gradients of the loss with respect to image_tf, and the loss.'''
         logger.info('-- retracing tf.function gradient_step(image_tf.shape=%s, smoothing_factor=%s, crop_size=%s, '
                     'jitter_pixels=%s)', image_tf.shape, smoothing_factor, crop_size, jitter_pixels)
         with tf.GradientTape() as tape:
@@ -138,11 +616,56 @@ class DeepDream(tf.Module):
             loss = self.dream_loss(image_crop_tf, smoothing_factor)
         # Calculates the gradient of the loss with respect to the pixels of the input image.
         gradients = tape.gradient(loss, image_tf)
-        # Normalizes the gradients
+        return self.normalize_gradients(gradients), loss
+
+    @tf.function(
+        input_signature=(
+            tf.TensorSpec(shape=[None,None,3], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[], dtype=TF_FLOAT),
+            )
+    )
+    def window_gradient_step(self, image_tf, smoothing_factor):
+        '''Gradient of the whole image_tf, without cropping or tiling: used on the windows of out-of-core dreams.'''
+        logger.info('-- retracing tf.function window_gradient_step(image_tf.shape=%s, smoothing_factor=%s)',
+                    image_tf.shape, smoothing_factor)
+        with tf.GradientTape() as tape:
+            tape.watch(image_tf)
+            loss = self.dream_loss(image_tf, smoothing_factor)
+        gradients = tape.gradient(loss, image_tf)
+        return self.normalize_gradients(gradients)
+
+    @tf.function(
+        input_signature=(
+            tf.TensorSpec(shape=[None,None,3], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[None,None,3], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[None,None,3], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[None,None,3], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[], dtype=TF_FLOAT),
+            )
+    )
+    def adam_window_update(self, image_tf, m_tf, v_tf, gradients, learning_rate, step):
+        '''
+        Same update as tf.optimizers.Adam in start_optimizer, but with the moments as explicit tensors, so they can be
+        paged in and out of disk together with the pixels of an out-of-core window. Step counts from 1.
+        '''
+        logger.info('-- retracing tf.function adam_window_update(image_tf.shape=%s)', image_tf.shape)
+        m_tf = ADAM_BETA_1*m_tf + (1.-ADAM_BETA_1)*gradients
+        v_tf = ADAM_BETA_2*v_tf + (1.-ADAM_BETA_2)*tf.square(gradients)
+        learning_rate_t = learning_rate * tf.sqrt(1.-tf.pow(ADAM_BETA_2, step)) / (1.-tf.pow(ADAM_BETA_1, step))
+        image_tf = image_tf - learning_rate_t*m_tf/(tf.sqrt(v_tf) + ADAM_EPSILON)
+        image_tf = tf.clip_by_value(image_tf, self.input_range[0], self.input_range[1])
+        return image_tf, m_tf, v_tf
+
+    @staticmethod
+    def normalize_gradients(gradients):
         gradients /= tf.math.reduce_std(gradients) + 1e-8
         gradients = tf.clip_by_value(gradients, -3, 3)
         return gradients
 
+    def set_relu_step(self, step):
+        self.relu_warmup.step = step
+
     def dream_loss(self, image_tf, smoothing_factor):
         '''Forward pass on the image through the model to retrieve the activations.'''
         logger.info('-- retracing tf.function dream_loss(image_tf.shape=%s, smoothing_factor=%s)',
@@ -163,21 +686,103 @@ class DeepDream(tf.Module):
         final_loss = -final_loss # Important! We are maximizing, not minimizing the activations!
         return final_loss
 
-    def raw_reduction(self, activations):
+    def raw_reduction(self, activations, axis=None):
         logger.info('-- retracing tf.function raw_reduction(activations.shape=%s)', activations.shape)
         if self.layer_name == 'predictions' and self.neuron_first == self.neuron_last:
-            return tf.reduce_sum(activations) # More appealing visually for single-neuron on prediction layer
+            return tf.reduce_sum(activations, axis=axis) # More appealing visually for single-neuron on prediction layer
         else:
-            return tf.sqrt(tf.reduce_sum(tf.square(activations))) # More appealing visually for all other cases
+            # More appealing visually for all other cases
+            return tf.sqrt(tf.reduce_sum(tf.square(activations), axis=axis))
         # Other possible reductions:
         # return tf.reduce_sum(tf.abs(activations))
         # return tf.reduce_sum(tf.square(activations))
 
 
+class BatchedDeepDream(DeepDream):
+    '''
+    Deep dream gradient ascent module for a batch of same-size images, optimized together through one model call per
+    step. Loss normalization and gradient standardization are per image, and, since Adam works element-wise, so is the
+    optimizer state.
+    '''
+    def start_optimizer(self, image_tf, /, *, crop_size=None, step_size=STEP_SIZE_DEF, smoothing_factor=SMOOTHING_DEF,
+                        jitter_pixels=JITTER_DEF, parameterization=PARAMETERIZATION_DEF):
+        super().start_optimizer(image_tf, crop_size=crop_size, step_size=step_size, smoothing_factor=smoothing_factor,
+                                jitter_pixels=jitter_pixels, parameterization=parameterization)
+        # crop_size is (batch, height, width, channels)
+        self.smoothing_factor = tf.constant(smoothing_factor / (crop_size[1] * crop_size[2]), dtype=TF_FLOAT)
+
+    @tf.function(
+        input_signature=(
+            tf.TensorSpec(shape=[None,None,None,3], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[], dtype=TF_FLOAT),
+            tf.TensorSpec(shape=[4], dtype=TF_INT),
+            tf.TensorSpec(shape=[], dtype=TF_INT),
+            )
+    )
+    def gradient_step(self, image_tf, smoothing_factor, crop_size, jitter_pixels):
+        logger.info('-- retracing tf.function batched.gradient_step(image_tf.shape=%s, smoothing_factor=%s, '
+                    'crop_size=%s, jitter_pixels=%s)', image_tf.shape, smoothing_factor, crop_size, jitter_pixels)
+        with tf.GradientTape() as tape:
+            tape.watch(image_tf)
+            if jitter_pixels > 0:
+                image_crop_tf = tf.image.random_crop(image_tf, size=crop_size)
+            else:
+                image_crop_tf = image_tf
+            # The images are independent, so the gradient of the sum is the gradient of each loss on its own image
+            loss = tf.reduce_sum(self.dream_loss(image_crop_tf, smoothing_factor))
+        gradients = tape.gradient(loss, image_tf)
+        # Normalizes the gradients of each image
+        gradients /= tf.math.reduce_std(gradients, axis=(1, 2, 3), keepdims=True) + 1e-8
+        gradients = tf.clip_by_value(gradients, -3, 3)
+        return gradients, loss / tf.cast(tf.shape(image_tf)[0], TF_FLOAT)
+
+    def dream_loss(self, image_tf, smoothing_factor):
+        '''Forward pass on the batch through the model, returning one loss per image.'''
+        logger.info('-- retracing tf.function batched.dream_loss(image_tf.shape=%s, smoothing_factor=%s)',
+                    image_tf.shape, smoothing_factor)
+        layer_activations = self.model(image_tf)
+        masked_activations = self.mask_activations(layer_activations)
+        reduction_axis = tuple(range(1, len(masked_activations.shape)))
+        dream_loss_raw = self.raw_reduction(masked_activations, axis=reduction_axis)
+        dream_loss = dream_loss_raw / self.mask_size
+        smooth_loss = tf.image.total_variation(image_tf)
+        final_loss = dream_loss + smoothing_factor * smooth_loss
+        return -final_loss # Important! We are maximizing, not minimizing the activations!
+
+    def mask_activations(self, activations):
+        return activations * self.loss_mask
+
+
+class AtlasDeepDream(BatchedDeepDream):
+    '''
+    Batched deep dream module where each image of the batch excites a single neuron of its own, for rendering atlases
+    of a layer. The masks are variables, so changing the neurons between batches does not retrace the graph.
+    '''
+    def __init__(self, model, input_range, lr_multiplier, layer_name, neuron_first, neuron_last, **kwargs):
+        # Each image has a single neuron: this selects the single-neuron reduction on the prediction layer
+        super().__init__(model, input_range, lr_multiplier, layer_name, neuron_first, neuron_first, **kwargs)
+        self.loss_mask = tf.Variable(tf.zeros((1, self.output_layer_size), dtype=self.output_layer_dtype),
+                                     shape=tf.TensorShape((None, self.output_layer_size)), trainable=False)
+        self.mask_size = tf.Variable(tf.ones((1,), dtype=self.output_layer_dtype), shape=tf.TensorShape((None,)),
+                                     trainable=False)
+
+    def set_neurons(self, neurons):
+        '''Sets the neuron to excite for each image of the next batch (in order).'''
+        masks = tf.stack([self.range_hot(self.output_layer_size, n, n+1) for n in neurons])
+        self.loss_mask.assign(masks)
+        self.mask_size.assign(tf.ones((len(neurons),), dtype=self.output_layer_dtype))
+
+    def mask_activations(self, activations):
+        # Broadcasts the (batch, channels) masks over the spatial dimensions, if any
+        mask_shape = tf.concat([tf.shape(self.loss_mask)[:1], tf.ones(len(activations.shape)-2, dtype=TF_INT),
+                                tf.shape(self.loss_mask)[1:]], axis=0)
+        return activations * tf.reshape(self.loss_mask, mask_shape)
+
+
 class TiledDeepDream(DeepDream):
     '''Deep dream gradient ascent module.'''
-    def __init__(self, model, input_range, lr_multiplier, layer_name, neuron_first, neuron_last):
-        super().__init__(model, input_range, lr_multiplier, layer_name, neuron_first, neuron_last)
+    def __init__(self, model, input_range, lr_multiplier, layer_name, neuron_first, neuron_last, **kwargs):
+        super().__init__(model, input_range, lr_multiplier, layer_name, neuron_first, neuron_last, **kwargs)
         if layer_name == 'predictions':
             assert model.input_shape[1] == model.input_shape[2]
             self.tile_size = model.input_shape[1]
@@ -186,9 +791,9 @@ class TiledDeepDream(DeepDream):
         self.remove_last_tile = None
 
     def start_optimizer(self, image_tf, /, *, crop_size=None, step_size=STEP_SIZE_DEF, smoothing_factor=SMOOTHING_DEF,
-                        jitter_pixels=JITTER_DEF):
+                        jitter_pixels=JITTER_DEF, parameterization=PARAMETERIZATION_DEF):
         super().start_optimizer(image_tf, crop_size=crop_size, step_size=step_size, smoothing_factor=smoothing_factor,
-                                jitter_pixels=jitter_pixels)
+                                jitter_pixels=jitter_pixels, parameterization=parameterization)
         if jitter_pixels > 0:
             logger.warning('-- tiled - jitter_pixels = %s will be ignored!', jitter_pixels)
         else:
@@ -210,8 +815,9 @@ class TiledDeepDream(DeepDream):
                     ' remove_last_tile=%s', image_tf.shape, smoothing_factor, crop_size, remove_last_tile)
         # Rolls the image by a random amount to avoid "seam"
         shift, image_tf = self.random_roll(image_tf, self.tile_size)
-        # Accumulates the gradient for each tile
+        # Accumulates the gradient and the loss for each tile
         gradients = tf.zeros_like(image_tf)
+        total_loss = tf.constant(0., dtype=TF_FLOAT)
 
         # Remove the last tile if it should not be processed
         ys = tf.range(0, crop_size[0], self.tile_size)
@@ -230,12 +836,11 @@ class TiledDeepDream(DeepDream):
                 # Calculates the gradient of the loss with respect to the pixels of the input image.
                 partial_gradient = tape.gradient(loss, image_tf)
                 gradients += partial_gradient
-        # Normalizes the gradients
-        gradients /= tf.math.reduce_std(gradients) + 1e-8
-        gradients = tf.clip_by_value(gradients, -3, 3)
+                total_loss += loss
+        gradients = self.normalize_gradients(gradients)
         # Unrolls the gradient to the right place
         gradients = tf.roll(gradients, shift=-shift, axis=[0,1])
-        return gradients
+        return gradients, total_loss
 
     @staticmethod
     def random_roll(image_tf, max_roll):
@@ -256,7 +861,8 @@ class DeepDreamEngine():
             'input_range' :  (-1., 1.),
             'lr_multiplier': 1.,
             'channels':      'RGB',
-            'patch_relus':   keras.applications.inception_v3,
+            'patch_relus':   True,
+            'jit_compile':   'off',
             },
         'ResNet50': {
             'model':         tf.keras.applications.ResNet50,
@@ -265,7 +871,8 @@ class DeepDreamEngine():
             'input_range' :  (-176., 177.), # The range is not exact, this covers ~3 standard deviations from mean
             'lr_multiplier': 128.,
             'channels':      'BGR',
-            'patch_relus':   'kwargs',
+            'patch_relus':   True,
+            'jit_compile':   'off',
             },
         'EfficientNetB0' :  {
             'model':         tf.keras.applications.EfficientNetB0,
@@ -274,7 +881,8 @@ class DeepDreamEngine():
             'input_range' :  (0, 255), # There is no actual preprocessing in efficientnet, the range is unchanged
             'lr_multiplier': 128.,
             'channels':      'RGB',
-            'patch_relus':   None,
+            'patch_relus':   False,
+            'jit_compile':   'off',
             },
         'EfficientNetB4' :  {
             'model':         tf.keras.applications.EfficientNetB4,
@@ -283,7 +891,8 @@ class DeepDreamEngine():
             'input_range' :  (0, 255), # There is no actual preprocessing in efficientnet, the range is unchanged
             'lr_multiplier': 128.,
             'channels':      'RGB',
-            'patch_relus':   None,
+            'patch_relus':   False,
+            'jit_compile':   'off',
             },
     }
 
@@ -298,38 +907,45 @@ class DeepDreamEngine():
         self.layer = None
         self.deepdream_model = None
         self.deepdream = None
+        self.deepdream_kwargs = None
+        self.batched_deepdream = None
+        self.atlas_deepdream = None
+        self.layer_deepdreams = {}
+        self.prune_models = True
+        self.relu_warmup = None
+        self.jit_policies = {} # By model name: kept across setups, so each model is probed once
+        self.pyramids = collections.OrderedDict()
         self.device_name = None
         self.tiled_rendering = False
+        self.setup_kwargs = None # Kept to reload the model transparently after unload
 
     def setup(self, device_name, model_name='InceptionV3', layer_name=None, neuron_first=None, neuron_last=None,
-              tiled_rendering=False):
+              tiled_rendering=False, jit_compile=None, prune_models=True, weights='imagenet'):
+        '''
+        Loads the model and prepares the modules for the layer. jit_compile, one of JIT_COMPILE_MODES, overrides the
+        'jit_compile' entry of the model. If prune_models, the modules of narrow neuron ranges run on models pruned to
+        those neurons (see create_module). weights is passed to the Keras model: None gives random weights, which only
+        make sense for timing benchmarks.
+        '''
         logger.debug('>> loading ai model')
+        self.setup_kwargs = dict(device_name=device_name, model_name=model_name, layer_name=layer_name,
+                                 neuron_first=neuron_first, neuron_last=neuron_last, tiled_rendering=tiled_rendering,
+                                 jit_compile=jit_compile, prune_models=prune_models, weights=weights)
         self.device_name = device_name
+        self.prune_models = prune_models
 
         if model_name not in self.models:
             raise ValueError(f'unrecognized model module name "{model_name}"')
 
         self.tiled_rendering = layer_name == 'predictions' or tiled_rendering
 
-        # Patches the ReLU activations
-        patch_relus = self.models[model_name]['patch_relus']
-        if patch_relus is None:
-            relu_kwargs = {}
-        elif patch_relus == 'kwargs':
-            relu_kwargs = { 'layers' : CustomLayers() }
-        else:
-            # We have to monkey-patch a module to fix the relus
-            relu_kwargs = {}
-            # print(patch_relus)
-            # print(patch_relus.layers)
-            # setattr(patch_relus, 'layers',  CustomLayers())
-            assert hasattr(patch_relus, 'layers')
-            patch_relus.layers = CustomLayers()
-            # print(patch_relus.layers)
-
         # Prepares the feature extraction model
-        self.base_model = self.models[model_name]['model'](weights='imagenet', include_top=layer_name == 'predictions',
-                                                           classifier_activation=None, **relu_kwargs)
+        self.base_model = self.models[model_name]['model'](weights=weights, include_top=layer_name == 'predictions',
+                                                           classifier_activation=None)
+        # Patches the ReLU activations of this model instance, before any graph is traced
+        self.relu_warmup = ReluWarmup()
+        if self.models[model_name]['patch_relus']:
+            self.relu_warmup.patch_relus(self.base_model)
         self.preprocess = self.models[model_name]['preprocess']
         self.input_type = self.models[model_name]['input_type']
         input_range = self.models[model_name]['input_range']
@@ -345,39 +961,194 @@ class DeepDreamEngine():
         self.layer = self.base_model.get_layer(layer_name).output
         self.deepdream_model = tf.keras.Model(inputs=self.base_model.input, outputs=self.layer)
 
+        jit_compile = self.models[model_name]['jit_compile'] if jit_compile is None else jit_compile
+        jit_policy = self.jit_policies.get(model_name)
+        if jit_policy is None or jit_policy.mode != jit_compile:
+            jit_policy = self.jit_policies[model_name] = JitPolicy(model_name, jit_compile)
+
         # Create the feature extraction model
-        if self.tiled_rendering:
-            self.deepdream = TiledDeepDream(self.deepdream_model, input_range=input_range, lr_multiplier=lr_multiplier,
-                                            layer_name=layer_name, neuron_first=neuron_first, neuron_last=neuron_last)
-        else:
-            self.deepdream = DeepDream(self.deepdream_model,  input_range=input_range, lr_multiplier=lr_multiplier,
-                                       layer_name=layer_name, neuron_first=neuron_first, neuron_last=neuron_last)
+        self.deepdream_kwargs = dict(input_range=input_range, lr_multiplier=lr_multiplier, layer_name=layer_name,
+                                     neuron_first=neuron_first, neuron_last=neuron_last, jit_policy=jit_policy,
+                                     relu_warmup=self.relu_warmup, channels=self.models[model_name]['channels'])
+        self.batched_deepdream = None # Created on demand by dream_batch
+        self.atlas_deepdream = None # Created on demand by dream_atlas
+        self.layer_deepdreams = {} # Created on demand by deepdream_for
+        self.pyramids.clear() # The preprocessing depends on the model
+        deepdream_class = TiledDeepDream if self.tiled_rendering else DeepDream
+        self.deepdream = self.create_module(deepdream_class, self.deepdream_model, self.deepdream_kwargs)
 
         logger.debug('<< done!')
 
-    def dream(self, image_pillow, /, *, progress_callback=None, signals=None, dream_kwargs=None):
-        logger.debug('>> dreaming with ai model')
-        image_array = np.asarray(image_pillow)
+    # --- Memory reclamation while idle
+
+    @property
+    def loaded(self):
+        return self.base_model is not None
+
+    def modules(self):
+        '''The gradient ascent modules created since the last setup.'''
+        modules = [self.deepdream, self.batched_deepdream, self.atlas_deepdream, *self.layer_deepdreams.values()]
+        return [m for m in modules if m is not None]
+
+    def release_dream_state(self):
+        '''Drops the per-dream tensors of all modules, and the cached image pyramids. Returns the memory usage before
+        and after, as memory_usage.'''
+        usage_before = memory_usage(self.device_name)
+        for module in self.modules():
+            module.release()
+        self.pyramids.clear()
+        trim_memory()
+        usage_after = memory_usage(self.device_name)
+        logger.info('-- released dream state, memory before: %s; after: %s', format_memory_usage(usage_before),
+                    format_memory_usage(usage_after))
+        return usage_before, usage_after
+
+    def unload(self):
+        '''
+        Drops the models and the modules, keeping the setup arguments: the next dream reloads them transparently, with
+        ensure_loaded. Returns the memory usage before and after, as memory_usage.
+        '''
+        usage_before = memory_usage(self.device_name)
+        if self.loaded:
+            self.base_model = self.layer = self.deepdream_model = None
+            self.deepdream = self.batched_deepdream = self.atlas_deepdream = None
+            self.layer_deepdreams = {}
+            self.pyramids.clear()
+            self.relu_warmup = None
+            trim_memory()
+        usage_after = memory_usage(self.device_name)
+        logger.info('-- unloaded ai model, memory before: %s; after: %s', format_memory_usage(usage_before),
+                    format_memory_usage(usage_after))
+        return usage_before, usage_after
+
+    def ensure_loaded(self):
+        '''Reloads the model if it was unloaded since the last setup.'''
+        if not self.loaded and self.setup_kwargs is not None:
+            logger.info('-- reloading unloaded ai model')
+            self.setup(**self.setup_kwargs)
+
+    def create_module(self, deepdream_class, model, kwargs):
+        '''
+        Creates a gradient ascent module of deepdream_class on model. If prune_models is set, the model is first pruned
+        to the range of neurons of kwargs, and the range is renumbered from zero to match the pruned output layer. If
+        the pruning fails, the module falls back to the full model.
+        '''
+        neuron_first, neuron_last = kwargs['neuron_first'], kwargs['neuron_last']
+        if self.prune_models:
+            try:
+                pruned_model = pruning.prune_output_channels(model, neuron_first, neuron_last+1)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('could not prune model for layer "%s"', kwargs['layer_name'])
+                pruned_model = model
+            if pruned_model is not model:
+                model = pruned_model
+                kwargs = dict(kwargs, neuron_first=0, neuron_last=neuron_last-neuron_first)
+        return deepdream_class(model, **kwargs)
+
+    def deepdream_for(self, layer_name=None):
+        '''
+        Returns the gradient ascent module for another layer of the same base model, sharing its loaded weights, so
+        parameter sweeps across layers need a single setup. The neuron range is clipped to the size of the layer.
+        Modules are cached until the next setup.
+        '''
+        self.ensure_loaded()
+        if layer_name is None or layer_name == self.layer_name:
+            return self.deepdream
+        if (layer_name == 'predictions') != (self.layer_name == 'predictions'):
+            raise ValueError(f'layer "{layer_name}" needs a different setup than layer "{self.layer_name}"')
+        deepdream = self.layer_deepdreams.get(layer_name)
+        if deepdream is None:
+            logger.debug('-- creating module for layer_name = %s', layer_name)
+            layer = self.base_model.get_layer(layer_name).output
+            layer_size = layer.shape[-1]
+            kwargs = dict(self.deepdream_kwargs, layer_name=layer_name,
+                          neuron_first=min(self.deepdream_kwargs['neuron_first'], layer_size-1),
+                          neuron_last=min(self.deepdream_kwargs['neuron_last'], layer_size-1))
+            model = tf.keras.Model(inputs=self.base_model.input, outputs=layer)
+            deepdream_class = TiledDeepDream if self.tiled_rendering else DeepDream
+            deepdream = self.layer_deepdreams[layer_name] = self.create_module(deepdream_class, model, kwargs)
+        return deepdream
+
+    def pyramid_for(self, input_image_array):
+        '''
+        Returns the ImagePyramid of an uint8 image array (or batch), preprocessed for the model. The pyramids of the
+        last PYRAMID_CACHE_SIZE inputs are cached, by hash of their pixels, until the next setup.
+        '''
+        input_image_array = np.ascontiguousarray(input_image_array)
+        key = (hashlib.blake2b(input_image_array.data, digest_size=16).digest(), input_image_array.shape,
+               input_image_array.dtype.str)
+        pyramid = self.pyramids.get(key)
+        if pyramid is None:
+            logger.debug('-- new pyramid for shape = %s', input_image_array.shape)
+            pyramid = ImagePyramid(tf.convert_to_tensor(self.preprocess(input_image_array)))
+            self.pyramids[key] = pyramid
+            while len(self.pyramids) > PYRAMID_CACHE_SIZE:
+                self.pyramids.popitem(last=False)
+        else:
+            self.pyramids.move_to_end(key)
+        return pyramid
+
+    @staticmethod
+    def dream_kwargs_with_defaults(dream_kwargs):
+        '''Completes the user-supplied dream_kwargs with the defaults, rejecting unknown arguments.'''
         dream_kwargs = dream_kwargs or {}
         kwargs = dict(octaves=range(-2, 3), octaves_scaling=2.**(1./OCTAVE_SCALING_DEF), steps_per_octave=STEPS_DEF,
                       octaves_blending=OCTAVES_BLENDING_DEF, step_size=STEP_SIZE_DEF, smoothing_factor=SMOOTHING_DEF,
-                      jitter_pixels=JITTER_DEF)
+                      jitter_pixels=JITTER_DEF, parameterization=PARAMETERIZATION_DEF,
+                      convergence_tolerance=CONVERGENCE_TOLERANCE_DEF, convergence_patience=CONVERGENCE_PATIENCE_DEF)
         dream_kwargs_extra = set(dream_kwargs.keys()) - set(kwargs.keys())
         if dream_kwargs_extra:
-            raise TypeError(f'unexpected arguments in drwam_kwargs: {dream_kwargs_extra}')
+            raise TypeError(f'unexpected arguments in dream_kwargs: {dream_kwargs_extra}')
         kwargs.update(dream_kwargs)
+        return kwargs
+
+    def dream(self, image_pillow, /, *, progress_callback=None, signals=None, dream_kwargs=None, deepdream=None,
+              draft=False, draft_only=False):
+        '''
+        Dreams a Pillow image or a uint8 (height, width, 3) array; arrays are used in place, without copying. The
+        optional deepdream is a module from deepdream_for, to dream another layer of the model.
+
+        If draft, a quick draft is dreamed first (see dream_draft) and sent right away to progress_callback, with
+        draft=True; the dream then refines it at full resolution. If draft_only, the draft, at full size, is the
+        result.
+        '''
+        logger.debug('>> dreaming with ai model')
+        self.ensure_loaded()
+        image_array = np.asarray(image_pillow)
+        kwargs = self.dream_kwargs_with_defaults(dream_kwargs)
         if progress_callback:
             progress_callback(0., image_array=image_array)
         with tf.device(self.device_name):
+            warm_start_tf = None
+            refine_kwargs = kwargs
+            if draft or draft_only:
+                warm_start_tf, refine_kwargs = self.dream_draft(image_array, kwargs=kwargs, deepdream=deepdream,
+                                                                signals=signals)
+                if signals and signals.isStopped:
+                    return None
+            if warm_start_tf is not None:
+                draft_result = self.image_tf_to_image_array(warm_start_tf)
+                if draft_only:
+                    if progress_callback:
+                        progress_callback(1., image_array=draft_result, draft=True)
+                    logger.debug('<< draft complete!')
+                    return draft_result
+                if progress_callback:
+                    progress_callback(0., image_array=draft_result, draft=True)
+                kwargs = refine_kwargs
             image_tf = image_result = None
-            for image_tf, progress in self.main_loop(image_array, **kwargs):
+            steps_saved = 0
+            for image_tf, progress, steps_saved in self.main_loop(image_array, deepdream=deepdream, signals=signals,
+                                                                  warm_start_tf=warm_start_tf, **kwargs):
                 if progress_callback:
                     image_result = self.image_tf_to_image_array(image_tf)
-                    progress_callback(progress, image_array=image_result)
+                    progress_callback(progress, image_array=image_result, steps_saved=steps_saved)
                 if signals and signals.isStopped:
                     return None
+            if signals and signals.isStopped:
+                return None
         if progress_callback:
-            progress_callback(1.)
+            progress_callback(1., steps_saved=steps_saved)
         logger.debug('<< dream complete!')
         if image_result is None and image_tf is not None:
             image_result = self.image_tf_to_image_array(image_tf)
@@ -385,31 +1156,185 @@ class DeepDreamEngine():
             return image_array
         return image_result
 
+    def dream_draft(self, image_array, /, *, kwargs, deepdream=None, signals=None):
+        '''
+        Dreams a draft of image_array: the same schedule on the input downscaled to fit DRAFT_MAX_DIM, with at most
+        DRAFT_STEPS steps per octave. Returns the draft, preprocessed and upsampled to the size of image_array, and the
+        dream kwargs that refine it: the octaves finer than the draft, at full resolution. Returns (None, kwargs) if
+        stopped, or if the schedule is empty.
+        '''
+        height, width = image_array.shape[:2]
+        draft_scale = min(1., DRAFT_MAX_DIM / max(height, width))
+        if draft_scale < 1.:
+            draft_size = (max(1, round(width*draft_scale)), max(1, round(height*draft_scale)))
+            draft_array = np.asarray(PIL.Image.fromarray(image_array).resize(draft_size))
+        else:
+            draft_array = image_array
+        logger.debug('-- dreaming draft, draft_array.shape = %s', draft_array.shape)
+        draft_kwargs = dict(kwargs, steps_per_octave=min(DRAFT_STEPS, kwargs['steps_per_octave']))
+        draft_tf = None
+        for draft_tf, _progress, _steps_saved in self.main_loop(draft_array, deepdream=deepdream, signals=signals,
+                                                                **draft_kwargs):
+            if signals and signals.isStopped:
+                return None, kwargs
+        if draft_tf is None:
+            return None, kwargs
+        draft_tf = tf.image.resize(draft_tf, (height, width))
+        # The draft already holds the detail of the octaves up to its own scale: the refinement starts above them
+        octaves = list(kwargs['octaves'])
+        refine_octaves = [o for o in octaves if kwargs['octaves_scaling']**o > draft_scale] or octaves[-1:]
+        return draft_tf, dict(kwargs, octaves=refine_octaves)
+
+    def dream_batch(self, images_pillow, /, *, progress_callback=None, signals=None, dream_kwargs=None):
+        '''
+        Dreams a list of same-size images together, with one model call per step for the whole batch. Returns the
+        list of resulting image arrays, in the same order, or None if stopped. Images of different sizes may be grouped
+        with bucket_images first.
+        '''
+        logger.debug('>> dreaming batch of %s images with ai model', len(images_pillow))
+        self.ensure_loaded()
+        if self.tiled_rendering:
+            raise ValueError('batched dreaming is not available with tiled rendering')
+        sizes = {image_pillow.size for image_pillow in images_pillow}
+        if len(sizes) != 1:
+            raise ValueError(f'batched dreaming requires images of the same size, got sizes {sorted(sizes)}')
+        if self.batched_deepdream is None:
+            self.batched_deepdream = self.create_module(BatchedDeepDream, self.deepdream_model, self.deepdream_kwargs)
+        images_array = np.stack([np.asarray(image_pillow) for image_pillow in images_pillow])
+        kwargs = self.dream_kwargs_with_defaults(dream_kwargs)
+        if progress_callback:
+            progress_callback(0., image_arrays=list(images_array))
+        with tf.device(self.device_name):
+            images_tf = None
+            steps_saved = 0
+            for images_tf, progress, steps_saved in self.main_loop(images_array, deepdream=self.batched_deepdream,
+                                                                   signals=signals, **kwargs):
+                if progress_callback and progress < 1.:
+                    progress_callback(progress, image_arrays=list(self.image_tf_to_image_array(images_tf)),
+                                      steps_saved=steps_saved)
+                if signals and signals.isStopped:
+                    return None
+            if signals and signals.isStopped:
+                return None
+            images_result = self.image_tf_to_image_array(images_tf)
+        if progress_callback:
+            progress_callback(1., image_arrays=list(images_result), steps_saved=steps_saved)
+        logger.debug('<< batch dream complete!')
+        return list(images_result)
+
+    @staticmethod
+    def bucket_images(images_pillow, /, *, batch_size):
+        '''
+        Groups images by size into batches of at most batch_size, for dream_batch. Returns a list of (indices, images)
+        pairs, where indices are the positions of the images in the input list.
+        '''
+        buckets = {}
+        for i,image_pillow in enumerate(images_pillow):
+            buckets.setdefault(image_pillow.size, []).append(i)
+        batches = []
+        for indices in buckets.values():
+            for b in range(0, len(indices), batch_size):
+                batch_indices = indices[b:b+batch_size]
+                batches.append((batch_indices, [images_pillow[i] for i in batch_indices]))
+        return batches
+
+    def dream_atlas(self, neurons, /, *, tile_size=ATLAS_TILE_SIZE_DEF, batch_size=ATLAS_BATCH_SIZE_DEF, columns=None,
+                    seed=None, progress_callback=None, signals=None, dream_kwargs=None):
+        '''
+        Renders an atlas of the neurons (or, on the prediction layer, the ImageNet classes, by Keras id) of the layer
+        set up in the engine. The neurons are dreamed in batches, each image exciting its own neuron, all starting
+        from the same noise. Returns (mosaic, tiles): the atlas as a single image array, and the list of tile image
+        arrays in the order of neurons; or None if stopped.
+        '''
+        logger.debug('>> dreaming atlas of %s neurons with ai model', len(neurons))
+        self.ensure_loaded()
+        kwargs = self.dream_kwargs_with_defaults(dream_kwargs)
+        if self.tiled_rendering:
+            # The prediction layer has a fixed input size: each tile is exactly one model input, at a single octave
+            tile_size = self.deepdream.tile_size
+            kwargs['octaves'] = range(0, 1)
+        if self.atlas_deepdream is None:
+            # Not pruned: the neurons of each batch are chosen later, by set_neurons
+            self.atlas_deepdream = AtlasDeepDream(self.deepdream_model, **self.deepdream_kwargs)
+        rng = np.random.default_rng(seed)
+        noise_array = self.noise_to_image_array(self.get_noise_array(tile_size, tile_size, rng=rng))
+        batches = [neurons[b:b+batch_size] for b in range(0, len(neurons), batch_size)]
+        tiles = []
+        with tf.device(self.device_name):
+            for batch_i,batch_neurons in enumerate(batches):
+                self.atlas_deepdream.set_neurons(batch_neurons)
+                images_array = np.repeat(noise_array[None], len(batch_neurons), axis=0)
+                images_tf = None
+                for images_tf, progress, _steps_saved in self.main_loop(images_array,
+                                                                        deepdream=self.atlas_deepdream,
+                                                                        signals=signals, **kwargs):
+                    if progress_callback:
+                        progress_callback((batch_i + progress) / len(batches))
+                    if signals and signals.isStopped:
+                        return None
+                if signals and signals.isStopped:
+                    return None
+                tiles.extend(self.image_tf_to_image_array(images_tf))
+        mosaic = self.mosaic_tiles(tiles, columns=columns)
+        if progress_callback:
+            progress_callback(1., image_array=mosaic)
+        logger.debug('<< atlas complete!')
+        return mosaic, tiles
+
+    @staticmethod
+    def mosaic_tiles(tiles, /, *, columns=None, spacing=ATLAS_SPACING_DEF, background=255):
+        '''Arranges a list of same-size image arrays in a grid, row by row.'''
+        n = len(tiles)
+        columns = columns or int(np.ceil(np.sqrt(n)))
+        rows = (n + columns - 1) // columns
+        h, w, c = tiles[0].shape
+        mosaic = np.full((rows*h + (rows-1)*spacing, columns*w + (columns-1)*spacing, c), background,
+                         dtype=NP_IMAGE_TYPE)
+        for i,tile in enumerate(tiles):
+            y = (i // columns) * (h+spacing)
+            x = (i % columns) * (w+spacing)
+            mosaic[y:y+h, x:x+w] = tile
+        return mosaic
+
     def main_loop(self, input_image_array, /, *, octaves, octaves_scaling, steps_per_octave, octaves_blending,
-                  step_size, smoothing_factor, jitter_pixels):
-        '''runs the specified number of octaves and the number of steps withing each octave, yielding periodically'''
-        octave_image_array = self.preprocess(input_image_array)
-        octave_image_tf = original_image_tf = tf.convert_to_tensor(octave_image_array)
+                  step_size, smoothing_factor, jitter_pixels, parameterization=PARAMETERIZATION_DEF,
+                  convergence_tolerance=CONVERGENCE_TOLERANCE_DEF, convergence_patience=CONVERGENCE_PATIENCE_DEF,
+                  warm_start_tf=None, deepdream=None, signals=None):
+        '''
+        runs the specified number of octaves and the number of steps withing each octave (rounded up to a multiple of
+        STEPS_MIN, as in out_of_core_loop), yielding (image, progress, steps saved) for a preview every PREVIEW_BUDGET
+        seconds and for the final result. The steps run in blocks of about STEP_BLOCK_BUDGET seconds, and the loop
+        returns early, without a final result, as soon as signals is stopped. If convergence_tolerance is positive, each
+        octave also ends early once its loss plateaus (see ConvergenceMonitor); the steps saved so far are counted. The
+        input may be a batch of same-size images if deepdream is a BatchedDeepDream. The optimizer works on the given
+        parameterization, one of PARAMETERIZATIONS. If warm_start_tf, a preprocessed image of the size of the input, is
+        given, the first octave starts from it, blended with the input as the following octaves.
+        '''
         steps_per_octave = self.round_steps(steps_per_octave)
+        pyramid = self.pyramid_for(input_image_array)
+        octave_image_tf = pyramid.original_tf if warm_start_tf is None else warm_start_tf
+        scheduler = StepScheduler()
+        convergence = ConvergenceMonitor(tolerance=convergence_tolerance, patience=convergence_patience)
+        steps_saved = 0
+        log_sampler = LogSampler()
         octaves_n = len(octaves)
         steps_total = octaves_n * steps_per_octave
-        base_shape = tf.shape(octave_image_tf)[:-1]
-        float_base_shape = tf.cast(base_shape, TF_FLOAT)
+        base_shape = pyramid.base_shape
         dream_start = progress_time = datetime.now()
         progress_last = step_global = -1
         logger.debug('base_shape = %s, octaves = %s, steps_per_octave = %s, octaves_blending = %s, step_size = %s, '
                      'smoothing_factor = %s, jitter_pixels = %s, dream_start = %s',
                      base_shape, octaves, steps_per_octave, octaves_blending, step_size, smoothing_factor,
-                     jitter_pixels, dream_start.isoformat())
-        firstOctave = True
+                     jitter_pixels, dream_start)
         for octave_i,octave in enumerate(octaves):
-            new_shape = tf.cast(float_base_shape*(octaves_scaling**octave), TF_INT)
-            octave_image_tf = tf.image.resize(octave_image_tf, new_shape)
-            if octaves_blending>0. and not firstOctave:
-                original_resized_tf = tf.image.resize(original_image_tf, new_shape)
-                octave_image_tf = (1.-octaves_blending)*octave_image_tf + octaves_blending*original_resized_tf
+            new_shape = pyramid.octave_shape(octaves_scaling, octave)
+            if octave_i == 0 and warm_start_tf is None:
+                octave_image_tf = pyramid.level(new_shape)
             else:
-                firstOctave = False
+                octave_image_tf = tf.image.resize(octave_image_tf, new_shape)
+                if octaves_blending>0.:
+                    octave_image_tf = (1.-octaves_blending)*octave_image_tf + \
+                                      octaves_blending*pyramid.level(new_shape)
             loop_image_tf = octave_image_tf
             if self.tiled_rendering:
                 jitter_pixels = 0
@@ -417,45 +1342,436 @@ class DeepDreamEngine():
                                                                      jitter_pixels=0)
             else:
                 octave_image_tf, padding, crop_size = self.pad_image(octave_image_tf, jitter_pixels=jitter_pixels)
-            logger.debug('octaves_scaling = %s, octave = %s, exp = %s, new_shape = %s, octave_image_tf.shape = %s, '
+            logger.debug('octaves_scaling = %s, octave = %s, new_shape = %s, octave_image_tf.shape = %s, '
                          'padding = %s, crop_size = %s, steps = %s',
-                         octaves_scaling, octave, octaves_scaling**octave, new_shape, octave_image_tf.shape,
-                         padding, crop_size, steps_per_octave)
+                         octaves_scaling, octave, new_shape, octave_image_tf.shape, padding, crop_size,
+                         steps_per_octave)
             # logger.debug('dream_loss_raw, dream_loss, smooth_loss, smooth_loss_weighted, final_loss')
-            for loop_image_tf, step in self.octave_loop(octave_image_tf, steps=steps_per_octave, step_size=step_size,
-                    smoothing_factor=smoothing_factor, crop_size=crop_size, jitter_pixels=jitter_pixels):
-                dream_now = datetime.now()
-                step_global = octave_i * steps_per_octave + step
-                logger.debug('step_global = %s, step = %s, dream_now = %s', step_global, step, dream_now.isoformat())
-                if (dream_now-progress_time).total_seconds() > PROGRESS_INTERVAL:
-                    progress_time = dream_now
-                    progress_last = step_global
-                    progress = step_global / steps_total
-                    image_result = self.unpad_image(loop_image_tf, padding=padding)
-                    image_result = tf.image.resize(image_result, base_shape)
-                    yield image_result, progress
+            step = 0
+            with tracing.span('octave', octave=octave, shape=tuple(octave_image_tf.shape)):
+                for loop_image_tf, step in self.octave_loop(octave_image_tf, steps=steps_per_octave, step_size=step_size,
+                        smoothing_factor=smoothing_factor, crop_size=crop_size, jitter_pixels=jitter_pixels,
+                        parameterization=parameterization, deepdream=deepdream, scheduler=scheduler,
+                        convergence=convergence):
+                    if signals is not None and signals.isStopped:
+                        return
+                    dream_now = datetime.now()
+                    step_global = octave_i * steps_per_octave + step
+                    if log_sampler():
+                        logger.debug('step_global = %s, step = %s, dream_now = %s, skipped records = %s', step_global,
+                                     step, dream_now, log_sampler.take_skipped())
+                    if (dream_now-progress_time).total_seconds() > PREVIEW_BUDGET:
+                        progress_time = dream_now
+                        progress_last = step_global
+                        progress = step_global / steps_total
+                        image_result = self.unpad_image(loop_image_tf, padding=padding)
+                        image_result = tf.image.resize(image_result, base_shape, antialias=True)
+                        yield image_result, progress, steps_saved
+            steps_saved += steps_per_octave - step
             octave_image_tf = self.unpad_image(loop_image_tf, padding=padding)
-        if progress_last != step_global:
+        if steps_saved:
+            logger.debug('-- octaves converged early, steps_saved = %s of %s', steps_saved, steps_total)
+        # The last octave may have stopped early after the last preview: yields again to report the steps it saved
+        if progress_last != step_global or steps_saved:
             image_result = octave_image_tf
-            image_result = tf.image.resize(image_result, base_shape)
-            yield image_result, 1.
+            image_result = tf.image.resize(image_result, base_shape, antialias=True)
+            yield image_result, 1., steps_saved
 
-    def octave_loop(self, image_tf, /, *, steps, step_size, smoothing_factor, crop_size, jitter_pixels):
+    def octave_loop(self, image_tf, /, *, steps, step_size, smoothing_factor, crop_size, jitter_pixels,
+                    parameterization=PARAMETERIZATION_DEF, deepdream=None, scheduler=None, convergence=None):
+        '''
+        Runs the steps of one octave in blocks sized by scheduler, yielding after each block. Stops before steps if the
+        convergence monitor finds the loss on a plateau.
+        '''
+        deepdream = self.deepdream if deepdream is None else deepdream
+        scheduler = StepScheduler() if scheduler is None else scheduler
+        scheduler.start_octave(int(np.prod([int(d) for d in crop_size[:-1]])))
+        convergence = ConvergenceMonitor(tolerance=0.) if convergence is None else convergence
+        convergence.start_octave()
         step = 0
-        self.deepdream.start_optimizer(image_tf, crop_size=crop_size, step_size=step_size,
-                                       smoothing_factor=smoothing_factor, jitter_pixels=jitter_pixels)
+        deepdream.start_optimizer(image_tf, crop_size=crop_size, step_size=step_size,
+                                  smoothing_factor=smoothing_factor, jitter_pixels=jitter_pixels,
+                                  parameterization=parameterization)
         while step < steps:
-            steps_to_run = min(STEPS_MAX, steps-step)
+            steps_to_run = scheduler.next_block(steps-step)
+            block_start = time.perf_counter()
+            mean_loss_tf = deepdream.run_steps(steps_to_run)
+            image_result = deepdream.current_result
+            # The ops are dispatched asynchronously: waits for them, so the block is timed and not just queued
+            self.wait_for(image_result)
+            scheduler.record(steps_to_run, time.perf_counter() - block_start)
             step += steps_to_run
-            self.deepdream.run_steps(steps_to_run)
-            image_result = self.deepdream.current_result
+            converged = convergence.record(steps_to_run, float(mean_loss_tf))
             yield image_result, step
+            if converged and step < steps:
+                logger.debug('-- octave converged after %s of %s steps', step, steps)
+                return
+
+    @staticmethod
+    def wait_for(tensor):
+        '''Blocks until tensor is computed, fetching a single element.'''
+        tensor[(0,) * len(tensor.shape)].numpy()
 
     @staticmethod
     def round_steps(steps):
         '''rounds up the number of steps in groups of STEP_MIN'''
         return ((steps + STEPS_MIN - 1) // STEPS_MIN) * STEPS_MIN
 
+    # --- Streaming animation: each frame is warm-started from the transformed previous frame
+
+    def animate(self, image_pillow, /, *, frames, zoom=ANIMATION_ZOOM_DEF, rotation=0., translation=(0., 0.),
+                frame_steps=STEPS_MIN, progress_callback=None, signals=None, dream_kwargs=None):
+        '''
+        Generator of (frame_index, image_array) for an animation of the given number of frames. The first frame is a
+        complete dream with all octaves. Each subsequent frame applies the per-frame transform (zoom factor, rotation in
+        degrees, translation in pixels, all around the image center) to the previous result, and runs only frame_steps
+        steps at the base resolution, reusing the same traced graph and optimizer. Frames are produced one at a time,
+        so memory stays flat regardless of the number of frames.
+        '''
+        logger.debug('>> animating with ai model, frames = %s', frames)
+        self.ensure_loaded()
+        image_array = np.asarray(image_pillow)
+        kwargs = self.dream_kwargs_with_defaults(dream_kwargs)
+        step_size = kwargs['step_size']
+        smoothing_factor = kwargs['smoothing_factor']
+        jitter_pixels = 0 if self.tiled_rendering else kwargs['jitter_pixels']
+        min_dim = self.deepdream.tile_size if self.tiled_rendering else MIN_DIM
+        with tf.device(self.device_name):
+            image_tf = None
+            for image_tf, _progress, _steps_saved in self.main_loop(image_array, signals=signals, **kwargs):
+                if signals and signals.isStopped:
+                    return
+            if signals and signals.isStopped:
+                return
+            if progress_callback:
+                progress_callback(1. / frames)
+            yield 0, self.image_tf_to_image_array(image_tf)
+            transform = self.animation_transform(image_tf.shape[:2], zoom=zoom, rotation=rotation,
+                                                 translation=translation)
+            optimizer_started = False
+            for frame in range(1, frames):
+                if signals and signals.isStopped:
+                    return
+                image_tf = self.transform_image(image_tf, transform)
+                padded_tf, padding, crop_size = self.pad_image(image_tf, min_dim=min_dim, jitter_pixels=jitter_pixels)
+                if optimizer_started:
+                    self.deepdream.restart_optimizer(padded_tf)
+                else:
+                    self.deepdream.start_optimizer(padded_tf, crop_size=crop_size, step_size=step_size,
+                                                   smoothing_factor=smoothing_factor, jitter_pixels=jitter_pixels,
+                                                   parameterization=kwargs['parameterization'])
+                    optimizer_started = True
+                self.deepdream.run_steps(frame_steps)
+                image_tf = tf.convert_to_tensor(self.unpad_image(self.deepdream.current_result, padding=padding))
+                if progress_callback:
+                    progress_callback((frame+1) / frames)
+                yield frame, self.image_tf_to_image_array(image_tf)
+        logger.debug('<< animation complete!')
+
+    @staticmethod
+    def animation_transform(shape, /, *, zoom=ANIMATION_ZOOM_DEF, rotation=0., translation=(0., 0.)):
+        '''
+        Returns the 8 projective transform parameters that map output to input pixel coordinates for zooming,
+        rotating (in degrees), and translating (in pixels) an image of the given shape around its center.
+        '''
+        h, w = int(shape[0]), int(shape[1])
+        theta = np.deg2rad(rotation)
+        center = np.array([[1., 0., (w-1)/2.], [0., 1., (h-1)/2.], [0., 0., 1.]])
+        uncenter = np.array([[1., 0., -(w-1)/2.], [0., 1., -(h-1)/2.], [0., 0., 1.]])
+        rotate_scale = np.array([[zoom*np.cos(theta), -zoom*np.sin(theta), 0.],
+                                 [zoom*np.sin(theta),  zoom*np.cos(theta), 0.], [0., 0., 1.]])
+        translate = np.array([[1., 0., translation[0]], [0., 1., translation[1]], [0., 0., 1.]])
+        forward = translate @ center @ rotate_scale @ uncenter
+        inverse = np.linalg.inv(forward)
+        inverse /= inverse[2, 2]
+        return tf.constant(inverse.flatten()[:8][None, :], dtype=TF_FLOAT)
+
+    @staticmethod
+    def transform_image(image_tf, transform):
+        '''Applies an animation_transform to a (h, w, c) image, reflecting the borders uncovered by it.'''
+        image_batch = tf.expand_dims(image_tf, axis=0)
+        transformed = tf.raw_ops.ImageProjectiveTransformV3(images=image_batch, transforms=transform,
+                                                            output_shape=tf.shape(image_tf)[:2],
+                                                            fill_value=tf.constant(0., dtype=TF_FLOAT),
+                                                            interpolation='BILINEAR', fill_mode='REFLECT')
+        return transformed[0]
+
+    @staticmethod
+    def write_frames(frames, /, *, path_pattern=None, pipe=None):
+        '''
+        Consumes a frames generator (as returned by animate), writing each frame as it arrives: either to numbered
+        image files, with path_pattern formatted with the frame index (e.g., 'dream_{:05d}.png'), or as raw RGB24 bytes
+        to a binary pipe (e.g., the stdin of an encoder). Returns the number of frames written.
+        '''
+        if (path_pattern is None) == (pipe is None):
+            raise ValueError('exactly one of path_pattern or pipe must be given')
+        frames_written = 0
+        for frame, image_array in frames:
+            if pipe is not None:
+                pipe.write(np.ascontiguousarray(image_array).tobytes())
+            else:
+                PIL.Image.fromarray(image_array).save(path_pattern.format(frame))
+            frames_written += 1
+        if pipe is not None:
+            pipe.flush()
+        return frames_written
+
+    # --- Out-of-core dreaming: the octave image, and the optimizer moments, live in memory-mapped arrays on disk
+
+    def dream_out_of_core(self, image, /, *, output_path=None, scratch_dir=None, tile_size=TILE_SIZE_DEF,
+                          tile_margin=TILE_MARGIN_DEF, progress_callback=None, signals=None, dream_kwargs=None):
+        '''
+        Dreams images far larger than MAX_DIM. Each octave is kept in memory-mapped arrays in scratch_dir, and is
+        optimized by windows of tile_size+2*tile_margin pixels, paged in, optimized, and feather-blended back, so the
+        memory used by the dream is bounded by a few windows instead of growing with the image. Returns a memory-mapped
+        uint8 array (a .npy file in output_path, or a temporary file in scratch_dir, owned by the caller), or None if
+        stopped, in which case no file is left behind.
+
+        The image may be a path or a Pillow image. A .npy path (a uint8 (height, width, 3) array) is read by strips,
+        without ever being resident as a whole. Other files are decoded whole by Pillow, which cannot decode by strips:
+        the decoded image (3 bytes per pixel) is resident while it is converted to the octave arrays, and is released
+        before the dream starts, unless the caller passed it as a Pillow image and still holds it.
+        '''
+        logger.debug('>> dreaming out-of-core with ai model')
+        self.ensure_loaded()
+        kwargs = self.dream_kwargs_with_defaults(dream_kwargs)
+        if self.tiled_rendering:
+            # The model has a fixed input size: the windows must match it exactly
+            tile_margin = min(tile_margin, self.deepdream.tile_size // 4)
+            tile_size = self.deepdream.tile_size - 2*tile_margin
+        if isinstance(image, (str, os.PathLike)) and os.fspath(image).lower().endswith('.npy'):
+            image = np.load(image, mmap_mode='r')
+        elif isinstance(image, (str, os.PathLike)):
+            image = PIL.Image.open(image).convert('RGB')
+        h, w = image.shape[:2] if isinstance(image, np.ndarray) else image.size[::-1]
+        output_owned = output_path is None
+        if output_owned:
+            output_handle, output_path = tempfile.mkstemp(prefix='cookadream_dream_', suffix='.npy', dir=scratch_dir)
+            os.close(output_handle)
+        output_mm = None
+        with tempfile.TemporaryDirectory(prefix='cookadream_octaves_', dir=scratch_dir) as octaves_dir:
+            original_mm = np.lib.format.open_memmap(os.path.join(octaves_dir, 'original.npy'), mode='w+',
+                                                    dtype=NP_FLOAT, shape=(h, w, 3))
+            for y0 in range(0, h, STRIP_ROWS_DEF):
+                y1 = min(y0+STRIP_ROWS_DEF, h)
+                if isinstance(image, np.ndarray):
+                    strip_array = np.asarray(image[y0:y1], dtype=NP_FLOAT)
+                else:
+                    strip_array = np.asarray(image.crop((0, y0, w, y1)), dtype=NP_FLOAT)
+                original_mm[y0:y1] = self.preprocess(strip_array)
+            del image
+            if progress_callback:
+                progress_callback(0., image_array=self.preview_memmap(original_mm))
+            with tf.device(self.device_name):
+                octave_mm = None
+                octaves_loop = self.out_of_core_loop(original_mm, octaves_dir=octaves_dir, tile_size=tile_size,
+                                                     tile_margin=tile_margin, **kwargs)
+                stopped = False
+                for octave_mm, progress in octaves_loop:
+                    if progress_callback and progress < 1.:
+                        progress_callback(progress, image_array=self.preview_memmap(octave_mm))
+                    if signals and signals.isStopped:
+                        stopped = True
+                        break
+                # Closes the loop, so it drops its own mappings of the octave files
+                octaves_loop.close()
+                if not stopped:
+                    output_mm = np.lib.format.open_memmap(output_path, mode='w+', dtype=NP_IMAGE_TYPE,
+                                                          shape=(h, w, 3))
+                    for y0 in range(0, h, STRIP_ROWS_DEF):
+                        y1 = min(y0+STRIP_ROWS_DEF, h)
+                        strip_tf = tf.convert_to_tensor(octave_mm[y0:y1])
+                        output_mm[y0:y1] = self.image_tf_to_image_array(strip_tf)
+                    output_mm.flush()
+            # The files cannot be removed while mapped, on Windows
+            del octave_mm, original_mm
+        if output_mm is None:
+            if output_owned:
+                os.remove(output_path)
+            logger.debug('<< out-of-core dream stopped')
+            return None
+        if progress_callback:
+            progress_callback(1., image_array=self.preview_memmap(output_mm, preprocessed=False))
+        logger.debug('<< out-of-core dream complete!')
+        return output_mm
+
+    def out_of_core_loop(self, original_mm, /, *, octaves_dir, tile_size, tile_margin, octaves, octaves_scaling,
+                         steps_per_octave, octaves_blending, step_size, smoothing_factor, jitter_pixels,
+                         parameterization=PARAMETERIZATION_DEF, convergence_tolerance=CONVERGENCE_TOLERANCE_DEF,
+                         convergence_patience=CONVERGENCE_PATIENCE_DEF):
+        '''
+        Out-of-core counterpart of main_loop, yielding the octave memmap after each pass over the tiles. The
+        parameterization and the early stopping on convergence apply to the octaves dreamed in memory; the windows
+        are always optimized on the pixels, whose moments are paged with them, for all the steps.
+        '''
+        steps_per_octave = self.round_steps(steps_per_octave)
+        octaves_n = len(octaves)
+        base_shape = np.array(original_mm.shape[:2])
+        window_size = tile_size + 2*tile_margin
+        logger.debug('base_shape = %s, octaves = %s, steps_per_octave = %s, tile_size = %s, tile_margin = %s, '
+                     'jitter_pixels = %s (out-of-core jitter comes from the randomized tile grid)',
+                     base_shape, octaves, steps_per_octave, tile_size, tile_margin, jitter_pixels)
+        convergence = ConvergenceMonitor(tolerance=convergence_tolerance, patience=convergence_patience)
+        octave_mm = original_mm
+        for octave_i,octave in enumerate(octaves):
+            new_shape = tuple((base_shape*(octaves_scaling**octave)).astype(int))
+            new_path = os.path.join(octaves_dir, f'octave_{octave_i}.npy')
+            blend_mm = original_mm if octave_i > 0 and octaves_blending > 0. else None
+            new_octave_mm = self.resize_memmap(octave_mm, new_shape, new_path, blend_mm=blend_mm,
+                                               blending=octaves_blending)
+            if octave_mm is not original_mm:
+                octave_path = octave_mm.filename
+                del octave_mm
+                os.remove(octave_path)
+            octave_mm = new_octave_mm
+            logger.debug('octave = %s, new_shape = %s', octave, new_shape)
+            if new_shape[0] <= window_size and new_shape[1] <= window_size:
+                # The whole octave fits in a single window: dreams it in memory
+                octave_image_tf = tf.convert_to_tensor(octave_mm[...])
+                if self.tiled_rendering:
+                    octave_image_tf, padding, crop_size = self.pad_image(octave_image_tf,
+                                                                         min_dim=self.deepdream.tile_size)
+                    jitter_octave = 0
+                else:
+                    octave_image_tf, padding, crop_size = self.pad_image(octave_image_tf, jitter_pixels=jitter_pixels)
+                    jitter_octave = jitter_pixels
+                loop_image_tf = octave_image_tf
+                for loop_image_tf, _step in self.octave_loop(octave_image_tf, steps=steps_per_octave,
+                                                             step_size=step_size, smoothing_factor=smoothing_factor,
+                                                             crop_size=crop_size, jitter_pixels=jitter_octave,
+                                                             parameterization=parameterization,
+                                                             convergence=convergence):
+                    pass
+                octave_mm[...] = self.unpad_image(loop_image_tf.numpy(), padding=padding)
+                octave_mm.flush()
+                yield octave_mm, (octave_i+1) / octaves_n
+                continue
+            moments_mm = [np.lib.format.open_memmap(os.path.join(octaves_dir, f'moment_{k}.npy'), mode='w+',
+                                                    dtype=NP_FLOAT, shape=octave_mm.shape) for k in range(2)]
+            passes = steps_per_octave // STEPS_MIN
+            learning_rate = tf.constant(step_size * self.deepdream.lr_multiplier, dtype=TF_FLOAT)
+            window_smoothing = tf.constant(smoothing_factor / (window_size * window_size), dtype=TF_FLOAT)
+            for pass_i in range(passes):
+                for y0, y1, x0, x1 in self.tile_schedule(new_shape, tile_size=tile_size, tile_margin=tile_margin):
+                    self.out_of_core_window(octave_mm, moments_mm, (y0, y1, x0, x1), tile_margin=tile_margin,
+                                            first_step=pass_i*STEPS_MIN, learning_rate=learning_rate,
+                                            smoothing_factor=window_smoothing)
+                octave_mm.flush()
+                yield octave_mm, (octave_i + (pass_i+1)/passes) / octaves_n
+            for moment_mm in moments_mm:
+                moment_path = moment_mm.filename
+                del moment_mm
+                os.remove(moment_path)
+            del moments_mm
+        if octave_mm.shape[:2] != tuple(base_shape):
+            final_mm = self.resize_memmap(octave_mm, tuple(base_shape), os.path.join(octaves_dir, 'final.npy'))
+            octave_mm = final_mm
+        yield octave_mm, 1.
+
+    def out_of_core_window(self, octave_mm, moments_mm, window, /, *, tile_margin, first_step, learning_rate,
+                           smoothing_factor):
+        '''Pages in one window of pixels and moments, runs STEPS_MIN optimizer steps on it, and blends it back.'''
+        y0, y1, x0, x1 = window
+        image_np = np.array(octave_mm[y0:y1, x0:x1])
+        m_np = np.array(moments_mm[0][y0:y1, x0:x1])
+        v_np = np.array(moments_mm[1][y0:y1, x0:x1])
+        image_tf = tf.convert_to_tensor(image_np)
+        m_tf = tf.convert_to_tensor(m_np)
+        v_tf = tf.convert_to_tensor(v_np)
+        min_dim = self.deepdream.tile_size if self.tiled_rendering else MIN_DIM
+        for step in range(first_step, first_step+STEPS_MIN):
+            self.deepdream.set_relu_step(step)
+            padded_tf, padding, _crop_size = self.pad_image(image_tf, min_dim=min_dim)
+            gradients = self.deepdream.window_gradients(padded_tf, smoothing_factor)
+            gradients = self.unpad_image(gradients, padding=padding)
+            image_tf, m_tf, v_tf = self.deepdream.adam_window_update(image_tf, m_tf, v_tf, gradients, learning_rate,
+                                                                     tf.constant(step+1, dtype=TF_FLOAT))
+        # Feathers the window margins that border other windows, so no seams appear when blending back
+        h, w = octave_mm.shape[:2]
+        weights = self.feather_weights(y1-y0, tile_margin, y0 > 0, y1 < h)[:, None, None] * \
+                  self.feather_weights(x1-x0, tile_margin, x0 > 0, x1 < w)[None, :, None]
+        octave_mm[y0:y1, x0:x1] = image_np + weights*(image_tf.numpy() - image_np)
+        moments_mm[0][y0:y1, x0:x1] = m_np + weights*(m_tf.numpy() - m_np)
+        moments_mm[1][y0:y1, x0:x1] = v_np + weights*(v_tf.numpy() - v_np)
+
+    @staticmethod
+    def tile_schedule(shape, /, *, tile_size, tile_margin):
+        '''
+        Yields (y0, y1, x0, x1) windows covering an image of the given shape, on a grid randomly offset at each call (as
+        random_roll does for in-memory tiles), in serpentine order so consecutive windows share pages of the memmap.
+        '''
+        h, w = shape[:2]
+        window_size = tile_size + 2*tile_margin
+        stride = tile_size + tile_margin
+        def starts(size):
+            if size <= window_size:
+                return [0]
+            offset = np.random.randint(stride)
+            return sorted({min(max(0, s), size-window_size) for s in range(-offset, size, stride)})
+        ys = starts(h)
+        xs = starts(w)
+        for row,y0 in enumerate(ys):
+            for x0 in (xs if row % 2 == 0 else xs[::-1]):
+                yield y0, min(y0+window_size, h), x0, min(x0+window_size, w)
+
+    @staticmethod
+    def feather_weights(size, margin, ramp_start, ramp_end):
+        '''1D blending weights: linear ramps on the margins that border other windows, ones elsewhere.'''
+        weights = np.ones(size, dtype=NP_FLOAT)
+        ramp = np.arange(1, margin+1, dtype=NP_FLOAT) / (margin+1)
+        margin = min(margin, size//2)
+        if ramp_start and margin > 0:
+            weights[:margin] = ramp[:margin]
+        if ramp_end and margin > 0:
+            weights[-margin:] = ramp[:margin][::-1]
+        return weights
+
+    @staticmethod
+    def resize_memmap(source_mm, shape, path, /, *, blend_mm=None, blending=0.):
+        '''
+        Bilinear resize of a memory-mapped (h, w, c) float image into a new memmap at path, by strips of output rows.
+        If blend_mm is given, the result is blended with it (also resized) by the factor blending, as in main_loop.
+        '''
+        h, w = shape
+        target_mm = np.lib.format.open_memmap(path, mode='w+', dtype=NP_FLOAT, shape=(h, w, source_mm.shape[2]))
+        sources = [source_mm] if blend_mm is None else [source_mm, blend_mm]
+        for y0 in range(0, h, STRIP_ROWS_DEF):
+            y1 = min(y0+STRIP_ROWS_DEF, h)
+            resized = []
+            for s in sources:
+                sh, sw = s.shape[:2]
+                # Same half-pixel convention as tf.image.resize
+                ys = np.clip((np.arange(y0, y1) + 0.5) * (sh / h) - 0.5, 0, sh-1)
+                xs = np.clip((np.arange(w) + 0.5) * (sw / w) - 0.5, 0, sw-1)
+                ys_0 = np.floor(ys).astype(int)
+                xs_0 = np.floor(xs).astype(int)
+                ys_1 = np.minimum(ys_0+1, sh-1)
+                xs_1 = np.minimum(xs_0+1, sw-1)
+                ys_f = (ys - ys_0).astype(NP_FLOAT)[:, None, None]
+                xs_f = (xs - xs_0).astype(NP_FLOAT)[None, :, None]
+                rows_0, rows_1 = ys_0[0], ys_1[-1]+1
+                rows = np.asarray(s[rows_0:rows_1])
+                top = rows[ys_0-rows_0]
+                bottom = rows[ys_1-rows_0]
+                strip = top + ys_f*(bottom-top)
+                resized.append(strip[:, xs_0] + xs_f*(strip[:, xs_1]-strip[:, xs_0]))
+            if blend_mm is None:
+                target_mm[y0:y1] = resized[0]
+            else:
+                target_mm[y0:y1] = (1.-blending)*resized[0] + blending*resized[1]
+        target_mm.flush()
+        return target_mm
+
+    @tracing.traced('preview')
+    def preview_memmap(self, image_mm, /, *, max_dim=MAX_DIM, preprocessed=True):
+        '''Subsamples a (possibly huge) memory-mapped image to at most max_dim for progress feedback.'''
+        stride = max(1, int(np.ceil(max(image_mm.shape[:2]) / max_dim)))
+        preview = np.array(image_mm[::stride, ::stride])
+        if preprocessed:
+            return self.image_tf_to_image_array(tf.convert_to_tensor(preview))
+        return preview
+
+    @tracing.traced('preview')
     def image_tf_to_image_array(self, image_tf):
         '''Converts a normalized float image_tf to a uint8 pixel image_array.'''
         if self.input_type == 'tf':
@@ -503,27 +1819,32 @@ class DeepDreamEngine():
 
     @classmethod
     def pad_image(cls, image_tf, /, *, min_dim=MIN_DIM, jitter_pixels=0):
-        '''Adds padding such that image dimensions are at least min_dim+2*jitter_pixels.'''
+        '''
+        Adds padding such that image dimensions are at least min_dim+2*jitter_pixels. Leading (batch) dimensions, if
+        any, are left unpadded.
+        '''
         # On Tensorflow 2.7.0 padding is complicated due to 'reflect' and 'symmetric' being restricted to size of the
         # image. One solution would be to resize the input image, but here I decided to use a double padding, with
         # the maximum size allowed by 'reflect' and then an arbitrary padding with a constant padding
-        h, w, c = image_tf.shape.as_list()
-        max_reflect_padding = np.array(( (h//2, (h+1)//2), (w//2, (w+1)//2), (0, 0), ))
+        *batch, h, w, c = image_tf.shape.as_list()
+        batch_padding = [(0, 0)] * len(batch)
+        max_reflect_padding = np.array(batch_padding + [ (h//2, (h+1)//2), (w//2, (w+1)//2), (0, 0), ])
         # Gets the padding to apply except for the jitter padding
         w_pad = max(0, min_dim - w)
         h_pad = max(0, min_dim - h)
-        padding = np.array(( (h_pad//2, (h_pad+1)//2), (w_pad//2, (w_pad+1)//2), (0, 0), ))
+        padding = np.array(batch_padding + [ (h_pad//2, (h_pad+1)//2), (w_pad//2, (w_pad+1)//2), (0, 0), ])
         # Gets the jitter and the full padding
-        jitter_padding = np.array(( (jitter_pixels, jitter_pixels), (jitter_pixels, jitter_pixels), (0, 0), ))
+        jitter_padding = np.array(batch_padding + [ (jitter_pixels, jitter_pixels), (jitter_pixels, jitter_pixels),
+                                                    (0, 0), ])
         full_padding = padding + jitter_padding
         # Splits the full padding into reflect and constant padding and applies them
         reflect_padding = np.minimum(full_padding, max_reflect_padding)
         constant_padding = full_padding-reflect_padding
         if np.sum(constant_padding) > 0:
             # [TF2.7] This is needed because constant_value in tf.pad must be a scalar
-            constant_value_r = tf.math.reduce_mean(image_tf[...,0], axis=(0, 1))
-            constant_value_g = tf.math.reduce_mean(image_tf[...,1], axis=(0, 1))
-            constant_value_b = tf.math.reduce_mean(image_tf[...,2], axis=(0, 1))
+            constant_value_r = tf.math.reduce_mean(image_tf[...,0])
+            constant_value_g = tf.math.reduce_mean(image_tf[...,1])
+            constant_value_b = tf.math.reduce_mean(image_tf[...,2])
         else:
             constant_padding = None
         padded = image_tf
@@ -535,7 +1856,7 @@ class DeepDreamEngine():
             padded_b = tf.pad( padded[...,2:3], constant_padding, mode='constant', constant_values=constant_value_b )
             padded = tf.concat((padded_r, padded_g, padded_b,), axis=-1)
         # Computes the crop size corresponding to the image with the padding, but not the jitter padding
-        crop_size = (h+h_pad, w+w_pad, c)
+        crop_size = (*batch, h+h_pad, w+w_pad, c)
         return padded, full_padding, crop_size
 
     @staticmethod
@@ -549,80 +1870,43 @@ class DeepDreamEngine():
         unpadded_image = unpad_image(padded_image, padding=padding)
         '''
         if np.sum(padding) > 0:
-            h, w, c = image_array.shape
-            slices = tuple((slice(start, size-end) for size,(start,end) in zip((h,w,c),padding)))
+            slices = tuple((slice(start, size-end) for size,(start,end) in zip(image_array.shape,padding)))
             return image_array[slices]
         else:
             return image_array
 
-    @classmethod
-    def get_noise_array(cls, width, height, channels=3, *, scale=0.01, decay=1.):
-        """An image paramaterization using 2D Fourier coefficients."""
-        # Creates starting complex spectrum from Gaussian distribution
-        fft_frequencies = cls.compute_fft_frequencies_2d(width, height)
-        image_shape = (2, channels,) + fft_frequencies.shape # Real/Imaginary, Channels, Height, Width
-        image_unscaled_spectrum = np.random.normal(size=image_shape, scale=scale)
-        image_unscaled_spectrum = image_unscaled_spectrum[0] + 1j*image_unscaled_spectrum[1]
-        # ...the IFT at this point would produce the so called "white" noise, with a flat power spectrum
-        # Scales the spectrum with the inverse of the frequencies creating a "pinkish" noise
-        scale  = 1.0 / np.maximum(fft_frequencies, 1.0 / max(width, height)) ** decay
-        # This makes the spectrum size-invariant and is equivalent to NumPy's norm='ortho'
-        # scale /= np.sqrt(width * height)
-        image_scaled_spectrum = image_unscaled_spectrum * scale
-        # Applies inverse transform to obtain scaled image in the space domain
-        image_pixels = np.fft.irfft2(image_scaled_spectrum, norm='ortho')
-        image_pixels = np.transpose(image_pixels, axes=(1,2,0))
-        image_pixels = image_pixels[:height, :width, :channels]
-        return image_pixels
+    @staticmethod
+    def get_noise_array(width, height, channels=3, *, scale=noise.NOISE_SCALE_DEF, decay=1., rng=None):
+        """An image paramaterization using 2D Fourier coefficients. See noise.noise_array()."""
+        return noise.noise_array(width, height, channels, scale=scale, decay=decay, rng=rng)
 
     @staticmethod
     def compute_fft_frequencies_2d(width, height):
-        '''Computes 2D spectrum frequencies'''
-        # When we have an odd width we need to add one frequency and later cut it off
-        width += width % 2
-        # On the n-dimensional real fft/inverse-fft only the innermost dimension uses the rfft, all the others use the
-        # complex fft, so np.irfft2 expects those frequencies:
-        fx = np.fft.rfftfreq(width)
-        fy = np.fft.fftfreq(height)
-        fy = fy[:, None] # Transposes into column vector
-        fft_frequencies = np.sqrt(fx*fx + fy*fy)
-        return fft_frequencies
+        '''Computes 2D spectrum frequencies (cached, read-only).'''
+        return noise.fft_frequencies_2d(width, height)
 
     @staticmethod
     def noise_to_image_array(noise_array):
-        return (255. * (noise_array + 1.) / 2.).astype(NP_IMAGE_TYPE)
+        return noise.noise_to_image_array(noise_array)
 
 # Replace ReLU layers with custom layer that allows negative gradients being backpropagated
 # This is based in Lucid's procedure:
 # https://github.com/tensorflow/lucid/blob/master/lucid/optvis/overrides/redirected_relu_grad.py
 
-class CustomLayers:
-    def __getattr__(self, name):
-        if name == 'Activation':
-            return CustomReluActivation
-        else:
-            return getattr(tf.keras.layers, name)
-
-# https://github.com/keras-team/keras/blob/948df87f1669e203e16e39daeaca52e2ea3253ad/keras/layers/core/activation.py#L24
-class CustomReluActivation(tf.keras.layers.Activation):
-    def __init__(self, activation, **kwargs):
-        super().__init__(activation, **kwargs)
-        if activation == 'relu':
-            logger.debug('plugged new patched transparent_relu in place of native relu')
-            self.activation = transparent_relu
-
-# ReLU layer with custom gradient that backpropagates the negative gradient
-@tf.custom_gradient
-def transparent_relu(inputs, alpha=0., max_value=None, threshold=0.):
-    assert alpha==0. and threshold==0. and max_value is None, 'advanced parameters for transparent_relu not implemented'
-    outputs = tf.nn.relu(inputs)
-    def grad(grad_upstream):
-        global global_relu_step, relu_warmup_steps_tf
-        # This is the "vanilla" relu gradient
-        relu_grad = tf.where(inputs < 0., tf.zeros_like(grad_upstream), grad_upstream)
-        # In this version we will allow negative gradients to pass through in the negative region (because gradient
-        # descent_ will push the values towards zero)
-        negative_pushing_lower = tf.logical_and(inputs < 0., grad_upstream > 0.)
-        transparent_relu_grad = tf.where(negative_pushing_lower, tf.zeros_like(grad_upstream), grad_upstream)
-        return tf.where(global_relu_step < relu_warmup_steps_tf, transparent_relu_grad, relu_grad)
-    return outputs, grad
+# ReLU that, while a warm-up graph of relu_warmup is traced, has a custom gradient that backpropagates the negative
+# gradient; the graphs of the normal steps get the native ReLU and its gradient
+def transparent_relu_for(relu_warmup):
+    @tf.custom_gradient
+    def warmup_relu(inputs):
+        outputs = tf.nn.relu(inputs)
+        def grad(grad_upstream):
+            # Unlike the "vanilla" relu gradient, we allow negative gradients to pass through in the negative region
+            # (because gradient descent_ will push the values towards zero)
+            negative_pushing_lower = tf.logical_and(inputs < 0., grad_upstream > 0.)
+            return tf.where(negative_pushing_lower, 0., grad_upstream)
+        return outputs, grad
+    def transparent_relu(inputs):
+        if relu_warmup.tracing_warmup:
+            return warmup_relu(inputs)
+        return tf.nn.relu(inputs)
+    return transparent_relu
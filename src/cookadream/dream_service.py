@@ -0,0 +1,449 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+# pylint: disable=invalid-name
+# This module uses TensorFlow (instead of Qt) naming conventions
+'''
+Local dream service: serves dreams over HTTP on localhost to the other tools of the same host, without the Qt
+application. Only the standard library is used, besides the engine, which is imported only by the server, so the
+client needs neither TensorFlow nor Qt.
+
+    python -m cookadream.dream_service serve [--port PORT] [--device DEVICE]
+    python -m cookadream.dream_service dream INPUT OUTPUT [--model MODEL] [--layer LAYER] [--port PORT]
+
+POST /dream takes a JSON request:
+
+    {"model": "InceptionV3", "layer": "mixed3", "neuron_first": 0, "neuron_last": 31, "tiled_rendering": false,
+     "dream_kwargs": {"steps_per_octave": 40}, "previews": true, "image": <base64 of a PNG or JPEG file>}
+
+and answers with a stream of JSON lines, one per event:
+
+    {"event": "queued", "coalesced": false}
+    {"event": "progress", "progress": 0.25, "steps_saved": 0, "preview": <base64 PNG, if previews were requested>}
+    {"event": "result", "image": <base64 PNG>}      or      {"event": "error", "message": "..."}
+
+When the queue is full, POST /dream answers 503 with a Retry-After header (backpressure). GET /status describes the
+warm engines and the queue.
+
+The engines are kept warm in a pool keyed by (model, layer, neuron_first, neuron_last, tiled_rendering). Identical
+requests (same engine, dream arguments and image) arriving while one is queued or running are coalesced: they
+subscribe to the same computation, and receive its latest preview and all its events from then on. A computation
+without subscribers left (all clients disconnected) is stopped.
+'''
+import argparse
+import base64
+import collections
+import contextlib
+import hashlib
+import http.client
+import http.server
+import io
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from pathlib import Path
+
+logger = logging.getLogger('cookadream')
+
+SERVICE_HOST = '127.0.0.1' # Local only: there is no authentication
+SERVICE_PORT_DEF = 8765
+SERVICE_ENGINES_DEF = 2 # Warm engines kept in the pool
+SERVICE_WORKERS_DEF = 1 # Dreams computed at once
+SERVICE_QUEUE_SIZE_DEF = 8 # Computations waiting for a worker, beyond which requests are refused
+SERVICE_RETRY_AFTER = 5 # Seconds suggested to refused clients
+SUBSCRIBER_BACKLOG = 4 # Events buffered for a slow client; older previews are dropped first
+FINAL_EVENTS = ('result', 'error',)
+IMAGE_MAX_DIM = 1024
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class Computation:
+    '''
+    A dream shared by all the coalesced requests that subscribe to it. Each subscriber is a bounded queue of events.
+    Also serves as the signals of DeepDreamEngine.dream, which stops when isStopped.
+    '''
+
+    def __init__(self, key, engine_key, image_bytes, dream_kwargs):
+        self.key = key
+        self.engine_key = engine_key
+        self.image_bytes = image_bytes
+        self.dream_kwargs = dream_kwargs
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.previews = 0 # Subscribers that asked for previews
+        self.last_progress = None
+        self.final_event = None
+
+    @property
+    def isStopped(self): # Named as in WorkerSignals, for DeepDreamEngine
+        with self.lock:
+            return not self.subscribers
+
+    def subscribe(self, previews):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_BACKLOG)
+        subscriber.previews = previews
+        with self.lock:
+            if self.final_event is not None:
+                subscriber.put_nowait(self.final_event)
+                return subscriber
+            self.subscribers.append(subscriber)
+            self.previews += previews
+            if self.last_progress is not None:
+                self.put(subscriber, self.last_progress)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                self.previews -= subscriber.previews
+
+    @property
+    def wants_previews(self):
+        with self.lock:
+            return self.previews > 0
+
+    def publish(self, event):
+        with self.lock:
+            if event['event'] in FINAL_EVENTS:
+                self.final_event = event
+            elif event['event'] == 'progress':
+                self.last_progress = event
+            for subscriber in self.subscribers:
+                self.put(subscriber, event)
+            if self.final_event is not None:
+                self.subscribers = []
+
+    @staticmethod
+    def put(subscriber, event):
+        if not subscriber.previews and 'preview' in event:
+            event = {k: v for k,v in event.items() if k != 'preview'}
+        while True:
+            try:
+                subscriber.put_nowait(event)
+                return
+            except queue.Full:
+                # Drops the oldest event: only progress events may accumulate before the final one
+                with contextlib.suppress(queue.Empty):
+                    subscriber.get_nowait()
+
+
+class EnginePool:
+    '''Warm engines, set up on demand and evicted least recently used. Each engine computes one dream at a time.'''
+
+    def __init__(self, device_name, max_engines=SERVICE_ENGINES_DEF):
+        self.device_name = device_name
+        self.max_engines = max_engines
+        self.lock = threading.Lock()
+        self.engines = collections.OrderedDict() # engine_key -> (engine, lock)
+
+    @contextlib.contextmanager
+    def engine(self, engine_key):
+        from cookadream.deep_dream import DeepDreamEngine  # pylint: disable=import-outside-toplevel
+        with self.lock:
+            entry = self.engines.get(engine_key)
+            if entry is None:
+                entry = self.engines[engine_key] = (DeepDreamEngine(), threading.Lock())
+                while len(self.engines) > self.max_engines:
+                    evicted_key, _evicted = self.engines.popitem(last=False)
+                    logger.info('-- evicted engine %s', evicted_key)
+            else:
+                self.engines.move_to_end(engine_key)
+        engine, engine_lock = entry
+        with engine_lock:
+            # Also true for the requests that waited on a setup that failed: each tries again
+            if not engine.loaded:
+                model_name, layer_name, neuron_first, neuron_last, tiled_rendering = engine_key
+                logger.info('>> setting up engine %s', engine_key)
+                try:
+                    engine.setup(self.device_name, model_name=model_name, layer_name=layer_name,
+                                 neuron_first=neuron_first, neuron_last=neuron_last, tiled_rendering=tiled_rendering)
+                except Exception:
+                    # A half-built engine must neither poison its key nor take the place of a warm engine
+                    with self.lock:
+                        if self.engines.get(engine_key) is entry:
+                            del self.engines[engine_key]
+                    raise
+                logger.info('<< engine ready')
+            yield engine
+
+    def status(self):
+        with self.lock:
+            return [list(engine_key) for engine_key in self.engines]
+
+
+class DreamService:
+    '''Queues the computations, coalescing identical requests, and runs them on worker threads.'''
+
+    def __init__(self, device_name, *, max_engines=SERVICE_ENGINES_DEF, workers=SERVICE_WORKERS_DEF,
+                 queue_size=SERVICE_QUEUE_SIZE_DEF):
+        self.pool = EnginePool(device_name, max_engines)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.inflight = {} # Computations queued or running, by key
+        self.workers = [threading.Thread(target=self.run_worker, name=f'dream_worker_{w}', daemon=True)
+                        for w in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    @staticmethod
+    def request_keys(request, image_bytes):
+        engine_key = (str(request.get('model', 'InceptionV3')), str(request['layer']),
+                      int(request.get('neuron_first', 0)), int(request.get('neuron_last', 0)),
+                      bool(request.get('tiled_rendering', False)))
+        dream_kwargs = request.get('dream_kwargs') or {}
+        digest = hashlib.sha256(json.dumps([engine_key, dream_kwargs], sort_keys=True).encode())
+        digest.update(image_bytes)
+        return digest.hexdigest(), engine_key, dream_kwargs
+
+    def submit(self, request):
+        '''Returns (computation, subscriber, coalesced), or raises ServiceBusy if the queue is full.'''
+        image_bytes = base64.b64decode(request['image'])
+        key, engine_key, dream_kwargs = self.request_keys(request, image_bytes)
+        previews = bool(request.get('previews', False))
+        with self.lock:
+            computation = self.inflight.get(key)
+            if computation is not None:
+                return computation, computation.subscribe(previews), True
+            computation = Computation(key, engine_key, image_bytes, dream_kwargs)
+            subscriber = computation.subscribe(previews)
+            try:
+                self.queue.put_nowait(computation)
+            except queue.Full:
+                raise ServiceBusy(f'{self.queue.maxsize} dreams already queued') from None
+            self.inflight[key] = computation
+        return computation, subscriber, False
+
+    def finish(self, computation, event):
+        with self.lock:
+            self.inflight.pop(computation.key, None)
+            computation.publish(event)
+
+    def run_worker(self):
+        while True:
+            computation = self.queue.get()
+            if computation.isStopped:
+                self.finish(computation, dict(event='error', message='cancelled'))
+                continue
+            try:
+                event = self.compute(computation)
+            except Exception as e: # pylint: disable=broad-except
+                logger.exception('dream %s failed', computation.key)
+                event = dict(event='error', message=f'{type(e).__name__}: {e}')
+            self.finish(computation, event)
+
+    def compute(self, computation):
+        import PIL.Image  # pylint: disable=import-outside-toplevel
+        from cookadream.deep_dream import DeepDreamEngine  # pylint: disable=import-outside-toplevel
+        image_pillow = PIL.Image.open(io.BytesIO(computation.image_bytes)).convert('RGB')
+        image_pillow = DeepDreamEngine.fit_image(image_pillow, max_dim=IMAGE_MAX_DIM)
+        def progress_callback(progress, image_array=None, steps_saved=0):
+            event = dict(event='progress', progress=progress, steps_saved=steps_saved)
+            if image_array is not None and computation.wants_previews:
+                event['preview'] = encode_image_array(image_array)
+            computation.publish(event)
+        with self.pool.engine(computation.engine_key) as engine:
+            result = engine.dream(image_pillow, progress_callback=progress_callback, signals=computation,
+                                  dream_kwargs=computation.dream_kwargs)
+        if result is None:
+            return dict(event='error', message='cancelled')
+        return dict(event='result', image=encode_image_array(result))
+
+    def status(self):
+        with self.lock:
+            inflight = len(self.inflight)
+        return dict(engines=self.pool.status(), queued=self.queue.qsize(), queue_size=self.queue.maxsize,
+                    inflight=inflight)
+
+
+def encode_image_array(image_array):
+    import PIL.Image  # pylint: disable=import-outside-toplevel
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(image_array).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+class DreamRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        logger.debug('-- %s %s', self.address_string(), format % args)
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, dict(message=f'unknown path {self.path}'))
+            return
+        self.send_json(200, self.server.service.status())
+
+    def do_POST(self):
+        if self.path != '/dream':
+            self.send_json(404, dict(message=f'unknown path {self.path}'))
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            computation, subscriber, coalesced = self.server.service.submit(request)
+        except ServiceBusy as e:
+            self.send_json(503, dict(message=str(e)), headers=[('Retry-After', str(SERVICE_RETRY_AFTER))])
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, dict(message=f'bad request: {type(e).__name__}: {e}'))
+            return
+        # Streams the events as JSON lines, until the final one; the end of the stream is the end of the connection
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            self.write_event(dict(event='queued', coalesced=coalesced))
+            while True:
+                event = subscriber.get()
+                self.write_event(event)
+                if event['event'] in FINAL_EVENTS:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info('-- client %s disconnected', self.address_string())
+        finally:
+            computation.unsubscribe(subscriber)
+
+    def write_event(self, event):
+        self.wfile.write(json.dumps(event).encode() + b'\n')
+        self.wfile.flush()
+
+
+def serve(port=SERVICE_PORT_DEF, *, device_name=None, max_engines=SERVICE_ENGINES_DEF, workers=SERVICE_WORKERS_DEF,
+          queue_size=SERVICE_QUEUE_SIZE_DEF):
+    '''Runs the service on localhost until interrupted.'''
+    os.environ.setdefault('COOKADREAM_RESOURCES_DIR', str(Path(__file__).resolve().parent / 'resources'))
+    import cookadream.deep_dream_patch_and_load  # pylint: disable=import-outside-toplevel,unused-import
+    from cookadream.deep_dream import DEEP_DREAM_ENGINE_DEVICES  # pylint: disable=import-outside-toplevel
+    # The last device is the first accelerator, if there is any
+    device_name = DEEP_DREAM_ENGINE_DEVICES[-1] if device_name is None else device_name
+    server = http.server.ThreadingHTTPServer((SERVICE_HOST, port), DreamRequestHandler)
+    server.daemon_threads = True
+    server.service = DreamService(device_name, max_engines=max_engines, workers=workers, queue_size=queue_size)
+    logger.info('-- dream service on http://%s:%s, device_name = %s', SERVICE_HOST, port, device_name)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class DreamClient:
+    '''Client of the local dream service.'''
+
+    def __init__(self, port=SERVICE_PORT_DEF, *, timeout=None):
+        self.port = port
+        self.timeout = timeout
+
+    def status(self):
+        connection = http.client.HTTPConnection(SERVICE_HOST, self.port, timeout=self.timeout)
+        try:
+            connection.request('GET', '/status')
+            return json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+
+    def dream(self, image_bytes, *, layer, model='InceptionV3', neuron_first=0, neuron_last=0, tiled_rendering=False,
+              dream_kwargs=None, previews=False):
+        '''
+        Generator of the events of a dream (see the module documentation), with the images decoded to bytes of PNG
+        files. Raises ServiceBusy if the service refused the request, or RuntimeError on other errors.
+        '''
+        request = dict(model=model, layer=layer, neuron_first=neuron_first, neuron_last=neuron_last,
+                       tiled_rendering=tiled_rendering, dream_kwargs=dream_kwargs or {}, previews=previews,
+                       image=base64.b64encode(image_bytes).decode('ascii'))
+        body = json.dumps(request).encode()
+        connection = http.client.HTTPConnection(SERVICE_HOST, self.port, timeout=self.timeout)
+        try:
+            connection.request('POST', '/dream', body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            if response.status == 503:
+                raise ServiceBusy(json.loads(response.read())['message'])
+            if response.status != 200:
+                raise RuntimeError(f'dream service error {response.status}: {response.read().decode()}')
+            for line in response:
+                event = json.loads(line)
+                for image_field in ('preview', 'image'):
+                    if image_field in event:
+                        event[image_field] = base64.b64decode(event[image_field])
+                yield event
+                if event['event'] in FINAL_EVENTS:
+                    return
+        finally:
+            connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cookadream.dream_service', description='Local dream service.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='runs the service')
+    serve_parser.add_argument('--port', type=int, default=SERVICE_PORT_DEF)
+    serve_parser.add_argument('--device', default=None)
+    serve_parser.add_argument('--engines', type=int, default=SERVICE_ENGINES_DEF)
+    serve_parser.add_argument('--workers', type=int, default=SERVICE_WORKERS_DEF)
+    serve_parser.add_argument('--queue-size', type=int, default=SERVICE_QUEUE_SIZE_DEF)
+    dream_parser = subparsers.add_parser('dream', help='dreams an image file with a running service')
+    dream_parser.add_argument('input')
+    dream_parser.add_argument('output')
+    dream_parser.add_argument('--port', type=int, default=SERVICE_PORT_DEF)
+    dream_parser.add_argument('--model', default='InceptionV3')
+    dream_parser.add_argument('--layer', default='mixed3')
+    dream_parser.add_argument('--neuron-first', type=int, default=0)
+    dream_parser.add_argument('--neuron-last', type=int, default=0)
+    dream_parser.add_argument('--steps', type=int, default=None, help='steps per octave')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(message)s')
+    if args.command == 'serve':
+        serve(args.port, device_name=args.device, max_engines=args.engines, workers=args.workers,
+              queue_size=args.queue_size)
+        return 0
+    dream_kwargs = {} if args.steps is None else dict(steps_per_octave=args.steps)
+    image_bytes = Path(args.input).read_bytes()
+    client = DreamClient(args.port)
+    for event in client.dream(image_bytes, layer=args.layer, model=args.model, neuron_first=args.neuron_first,
+                              neuron_last=args.neuron_last, dream_kwargs=dream_kwargs):
+        if event['event'] == 'queued':
+            logger.info('-- queued%s', ' (coalesced with an identical request)' if event['coalesced'] else '')
+        elif event['event'] == 'progress':
+            logger.info('-- progress %.0f%%', 100.*event['progress'])
+        elif event['event'] == 'result':
+            Path(args.output).write_bytes(event['image'])
+            logger.info('-- dream written to "%s"', args.output)
+        else:
+            logger.error('dream failed: %s', event['message'])
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
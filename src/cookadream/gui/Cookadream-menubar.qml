@@ -21,6 +21,8 @@
         action: stopaction
         @.MenuSeparator{}
         action: immediateaction
+        action: draftaction
+        action: draftonlyaction
         action: overwriteaction
         action: preferencesaction
     }
@@ -12,6 +12,8 @@
     action: saveaction
     @.MenuSeparator{}
     action: immediateaction
+    action: draftaction
+    action: draftonlyaction
     action: overwriteaction
     action: preferencesaction
 }
@@ -44,6 +44,8 @@ ApplicationWindow {
         category: 'settings_internals'
         property alias dreamImmediate: immediateaction.checked
         property alias overwriteConfirmation: overwriteaction.checked
+        property alias dreamDraft: draftaction.checked
+        property alias dreamDraftOnly: draftonlyaction.checked
     }
 
     // --- Settings - Global UI-Indepentent Values
@@ -126,7 +128,7 @@ ApplicationWindow {
     }
 
     // --- UI Actions and menus
-    // Used accelerators: a c d e f h i k l n m o p q r s w x
+    // Used accelerators: a c d e f h i k l n m o p q r s t w x y
     KeySequences {
         id: mksq
     }
@@ -144,7 +146,10 @@ ApplicationWindow {
                                           settings.value('st_octavesBlending',  GlobalSettings.st_octavesBlending),
                                           settings.value('st_dreamSpeed',       GlobalSettings.st_dreamSpeed),
                                           settings.value('st_dreamSmoothing',   GlobalSettings.st_dreamSmoothing),
-                                          settings.value('st_dreamShaking',     GlobalSettings.st_dreamSmoothing))
+                                          settings.value('st_dreamShaking',     GlobalSettings.st_dreamSmoothing),
+                                          settings.value('st_dreamConvergence', GlobalSettings.st_dreamConvergence),
+                                          draftaction.checked,
+                                          draftaction.checked && draftonlyaction.checked)
     }
     Action {
         id: stopaction
@@ -167,6 +172,20 @@ ApplicationWindow {
         checked: true
         enabled: true
     }
+    Action {
+        id: draftaction
+        text: qsTr('Quick Draf&t First')
+        checkable: true
+        checked: false
+        enabled: true
+    }
+    Action {
+        id: draftonlyaction
+        text: qsTr('Draft Onl&y, Without Refining')
+        checkable: true
+        checked: false
+        enabled: draftaction.checked
+    }
     Action {
         id: overwriteaction
         text: qsTr('Confirm Before Dream Over&write')
@@ -368,14 +387,33 @@ ApplicationWindow {
             ignoreImmediate = true
         }
         else if (imagePath === 'new://') {
-            result = bridge.newImage(imageWidth, imageHeight, maximumImageSize)
+            // Noise is generated off the GUI thread: the result arrives in bridge.onImageOpened
+            openingImagePath = imagePath
+            bridge.newImage(mainsignals, imageWidth, imageHeight, maximumImageSize)
+            return
         }
         else {
             if (String(imagePath).startsWith('file://')) {
                 imagePath = bridge.urlToPath(imagePath)
             }
-            result = bridge.openImage(imagePath, maximumImageSize)
+            // Files are decoded off the GUI thread: the result arrives in bridge.onImageOpened
+            openingImagePath = imagePath
+            bridge.openImage(mainsignals, imagePath, maximumImageSize)
+            return
+        }
+        imageOpened(result, imagePath, ignoreImmediate)
+    }
+
+    property string openingImagePath: ''
+
+    Connections {
+        target: bridge
+        function onImageOpened(result) {
+            imageOpened(result, openingImagePath, false)
         }
+    }
+
+    function imageOpened(result, imagePath, ignoreImmediate) {
         console.debug('result =', result)
         if (result[0]) {
             dreamImagePath = imagePath
@@ -401,10 +439,13 @@ ApplicationWindow {
         if (String(imagePath).startsWith('file://')) {
             imagePath = bridge.urlToPath(imagePath)
         }
+        // Images are encoded and written off the GUI thread: completion arrives in bridge.onImageSaved
         let result = bridge.saveImage(imagePath, imageSaveQuality)
         if (result === '') {
-            statusbar.state = 'ready'
-            statustext.text = 'dream saved'
+            if (!bridge.busy) {
+                statusbar.state = 'busy'
+                statustext.text = 'saving dream...'
+            }
         }
         else {
             statusbar.state = 'error'
@@ -412,6 +453,23 @@ ApplicationWindow {
         }
     }
 
+    Connections {
+        target: bridge
+        function onImageSaved(message) {
+            if (message === '') {
+                // Does not overwrite the status of an ongoing dream
+                if (!bridge.busy) {
+                    statusbar.state = 'ready'
+                    statustext.text = 'dream saved'
+                }
+            }
+            else {
+                statusbar.state = 'error'
+                statustext.text = message
+            }
+        }
+    }
+
     QtPl.MessageDialog {
         id: checksavedialog
         buttons: (QtPl.MessageDialog.Yes | QtPl.MessageDialog.No)
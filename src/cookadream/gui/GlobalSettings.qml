@@ -12,6 +12,7 @@ QtObject {
     readonly property double internals_ai_c_modelNeuronTo: 768.0
     readonly property int internals_ai_renderingDevice: -1
     readonly property int internals_ai_tiledRendering: 0
+    readonly property double internals_st_dreamConvergence: 0.0
     readonly property double internals_st_dreamOctavesFrom: 1.0
     readonly property double internals_st_dreamOctavesTo: 4.0
     readonly property double internals_st_dreamShaking: 64.0
@@ -30,6 +31,7 @@ QtObject {
     readonly property int ai_modelNeuronTo: 768
     readonly property string ai_renderingDevice: ''
     readonly property bool ai_tiledRendering: false
+    readonly property double st_dreamConvergence: 0.0
     readonly property int st_dreamOctavesFrom: 1
     readonly property int st_dreamOctavesTo: 4
     readonly property int st_dreamShaking: 64
@@ -53,12 +53,13 @@ Window {
 
         property alias ai_a_aiModel:          aimodel.currentIndex
         property alias ai_b_modelLayer:       modellayer.value
-        property alias ai_c_lastLayerConcept: lastlayerconcept.currentIndex
+        property int   ai_c_lastLayerConcept: 0 // Row of the full concept index, whatever the search filter
         property alias ai_c_modelNeuronFrom:  modelneuron.first.value
         property alias ai_c_modelNeuronTo:    modelneuron.second.value
         property alias ai_renderingDevice:    renderingdevice.currentIndex
         property alias ai_tiledRendering:     tiledrendering.checkState
         // property alias st_dreamDecorrelate:   dreamdecorrelate.checkState
+        property alias st_dreamConvergence:   dreamconvergence.value
         property alias st_dreamOctavesFrom:   dreamoctaves.first.value
         property alias st_dreamOctavesTo:     dreamoctaves.second.value
         property alias st_dreamShaking:       dreamshaking.value
@@ -79,6 +80,7 @@ Window {
             ai_c_modelNeuronTo = GlobalSettings.internals_ai_c_modelNeuronTo
             ai_renderingDevice = GlobalSettings.internals_ai_renderingDevice
             ai_tiledRendering = GlobalSettings.internals_ai_tiledRendering
+            st_dreamConvergence = GlobalSettings.internals_st_dreamConvergence
             st_dreamOctavesFrom = GlobalSettings.internals_st_dreamOctavesFrom
             st_dreamOctavesTo = GlobalSettings.internals_st_dreamOctavesTo
             st_dreamShaking = GlobalSettings.internals_st_dreamShaking
@@ -93,6 +95,8 @@ Window {
             internals.sync()
             settings.sync()
         }
+
+        onAi_c_lastLayerConceptChanged: lastlayerconcept.selectConcept()
     }
 
     Item {
@@ -115,13 +119,15 @@ Window {
         id: settings
         category: 'settings'
         readonly property string ai_aiModel:          aimodeldata.module
-        readonly property int    ai_lastLayerConcept: (modellayer.value == modellayer.to ? lastlayerconcept.currentValue : -1)
+        readonly property int    ai_lastLayerConcept: (modellayer.value == modellayer.to ?
+                                                       lastlayerconceptmodel.kerasIdOfSource(internals.ai_c_lastLayerConcept) : -1)
         readonly property string ai_modelLayer:       modellayer.layerName
         readonly property int    ai_modelNeuronFrom:  modelneuron.first.value
         readonly property int    ai_modelNeuronTo:    modelneuron.second.value
         readonly property string ai_renderingDevice:  (renderingdevice.currentValue ? renderingdevice.currentValue : '')
         readonly property bool   ai_tiledRendering:   tiledrendering.checkState === Qt.Checked
         // readonly property bool   st_dreamDecorrelate: dreamdecorrelate.checkState === Qt.Checked
+        readonly property real   st_dreamConvergence: dreamconvergence.valueValue
         readonly property int    st_dreamOctavesFrom: dreamoctaves.first.value
         readonly property int    st_dreamOctavesTo:   dreamoctaves.second.value
         readonly property int    st_dreamShaking:     dreamshaking.value
@@ -404,22 +410,38 @@ Window {
                         Label {
                             text: qsTr('Concept to dream about:')
                         }
+                        TextField {
+                            id: lastlayerconceptsearch
+                            placeholderText: qsTr('Search...')
+                            selectByMouse: true
+                            onTextChanged: {
+                                lastlayerconceptmodel.filter = text
+                                // Picks the best match if the current concept was filtered out
+                                if (lastlayerconceptmodel.rowOfSource(internals.ai_c_lastLayerConcept) < 0 &&
+                                        lastlayerconceptmodel.count > 0) {
+                                    internals.ai_c_lastLayerConcept = lastlayerconceptmodel.sourceRow(0)
+                                }
+                                lastlayerconcept.selectConcept()
+                            }
+                        }
                         ComboBox {
                             id: lastlayerconcept
                             implicitContentWidthPolicy: ComboBox.WidestText
-                            currentIndex: 0
                             model: lastlayerconceptmodel
                             textRole: 'imagenet_name'
                             valueRole: 'keras_id'
+                            onActivated: function(index) {
+                                internals.ai_c_lastLayerConcept = lastlayerconceptmodel.sourceRow(index)
+                            }
+                            function selectConcept() {
+                                currentIndex = lastlayerconceptmodel.rowOfSource(internals.ai_c_lastLayerConcept)
+                            }
+                            Component.onCompleted: selectConcept()
                         }
                     }
 
-                    XmlListModel {
+                    ImagenetClassesModel {
                         id: lastlayerconceptmodel
-                        source: (DATA_URI + '/imagenet.xml')
-                        query: '/imagenet_classes/imagenet_class'
-                        XmlListModelRole { name: 'imagenet_name'; elementName: 'imagenet_name' }
-                        XmlListModelRole { name: 'keras_id';      elementName: 'keras_id' }
                     }
 
                     // ... help for layers
@@ -500,6 +522,24 @@ Window {
                         readonly property int valueValue: (value**2 * 10)
                     }
 
+                    // - Early end of octaves
+                    Label {
+                        text: qsTr('End octaves early when they improve less than:')
+                    }
+                    IndicatorSlider {
+                        id: dreamconvergence
+                        preferredWidth: Constants.slidersSize
+                        from: 0
+                        to: (valueLabels.length-1)
+                        stepSize: 1
+                        value: 0
+                        viewerText: valueLabel
+                        readonly property var valueLabels: [qsTr('never'), '0.1%', '0.2%', '0.5%', '1%', '2%']
+                        readonly property var valueValues: [ 0,            0.001,  0.002,  0.005,  0.01,  0.02 ]
+                        readonly property string valueLabel: valueLabels[value]
+                        readonly property double valueValue: valueValues[value]
+                    }
+
                     // - Octave blending
                     Label {
                         text: qsTr('Blend octaves with original:')
@@ -0,0 +1,105 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+'''
+Procedural initialization of dream images: noise generated from random 2D Fourier spectra.
+
+The frequency grids and the spectral scales depend only on the image size and on the decay of the spectrum, so they
+are memoized, and generating a new image costs only the random draws and the inverse transform, all in float32.
+'''
+import functools
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('deep_dream')
+
+NOISE_SCALE_DEF = 0.01
+NOISE_CACHE_SIZE = 16
+# Decay of the power spectrum (1/f^decay) for each named kind of noise
+NOISE_DECAYS = {
+    'white': 0.,
+    'pink':  1.,
+    'brown': 2.,
+}
+NOISE_KIND_DEF = 'pink'
+
+
+@functools.lru_cache(maxsize=NOISE_CACHE_SIZE)
+def fft_frequencies_2d(width, height):
+    '''Computes 2D spectrum frequencies. The result is cached and read-only.'''
+    # When we have an odd width we need to add one frequency and later cut it off
+    width += width % 2
+    # On the n-dimensional real fft/inverse-fft only the innermost dimension uses the rfft, all the others use the
+    # complex fft, so np.irfft2 expects those frequencies:
+    fx = np.fft.rfftfreq(width).astype(np.float32)
+    fy = np.fft.fftfreq(height).astype(np.float32)
+    fy = fy[:, None] # Transposes into column vector
+    frequencies = np.sqrt(fx*fx + fy*fy)
+    frequencies.flags.writeable = False
+    return frequencies
+
+
+@functools.lru_cache(maxsize=NOISE_CACHE_SIZE)
+def spectrum_scale(width, height, decay):
+    '''Scales of the spectrum with the inverse of the frequencies, for a 1/f^decay noise. Cached and read-only.'''
+    frequencies = fft_frequencies_2d(width, height)
+    scale = (1. / np.maximum(frequencies, 1. / max(width, height)) ** decay).astype(np.float32)
+    scale.flags.writeable = False
+    return scale
+
+
+def noise_array(width, height, channels=3, *, kind=NOISE_KIND_DEF, decay=None, scale=NOISE_SCALE_DEF, seed=None,
+                rng=None):
+    '''
+    An image paramaterization using 2D Fourier coefficients. Returns a float32 array of shape (height, width,
+    channels), roughly in [-1, 1].
+
+    The spectrum decays as 1/f^decay, where decay is taken from kind ('white', 'pink', 'brown') unless given
+    explicitly. The decay may also be a sequence with one value per channel. The random draws come from rng, which must
+    be a numpy Generator, or from a new generator seeded with seed (fresh entropy if seed is None).
+    '''
+    if decay is None:
+        try:
+            decay = NOISE_DECAYS[kind]
+        except KeyError:
+            raise ValueError(f'unrecognized kind of noise: "{kind}"') from None
+    rng = np.random.default_rng(seed) if rng is None else rng
+    channel_decays = np.broadcast_to(np.asarray(decay, dtype=np.float32), (channels,))
+    # Creates starting complex spectrum from Gaussian distribution
+    frequencies_shape = fft_frequencies_2d(width, height).shape
+    spectrum_shape = (2, channels,) + frequencies_shape # Real/Imaginary, Channels, Height, Width
+    spectrum = rng.standard_normal(size=spectrum_shape, dtype=np.float32)
+    spectrum *= scale
+    spectrum = spectrum[0] + 1j*spectrum[1]
+    # ...the IFT at this point would produce the so called "white" noise, with a flat power spectrum
+    # Scales the spectrum with the inverse of the frequencies creating a "pinkish" noise
+    for c,channel_decay in enumerate(channel_decays):
+        spectrum[c] *= spectrum_scale(width, height, float(channel_decay))
+    # Applies inverse transform to obtain scaled image in the space domain
+    pixels = np.fft.irfft2(spectrum, norm='ortho')
+    pixels = np.transpose(pixels, axes=(1,2,0))
+    pixels = pixels[:height, :width, :channels]
+    return pixels.astype(np.float32, copy=False)
+
+
+def noise_to_image_array(noise, /):
+    '''Converts noise roughly in [-1, 1] into an uint8 image array.'''
+    return np.clip(127.5 * (noise + 1.), 0., 255.).astype(np.uint8)
+
+
+def noise_image_array(width, height, channels=3, **kwargs):
+    '''Generates an uint8 image array of noise; same arguments as noise_array().'''
+    logger.debug('-- width = %s, height = %s, kwargs = %s', width, height, kwargs)
+    return noise_to_image_array(noise_array(width, height, channels, **kwargs))
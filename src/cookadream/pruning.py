@@ -0,0 +1,133 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+'''
+Objective-aware pruning of the dream models. A dream on a range of neurons only needs those channels of the output
+layer, so the model is rewritten to compute just them: the selection is pushed down from the output through the
+concatenations, the sums and the channel-wise layers (activations, batch normalizations, dropouts), down to the
+convolutions and dense layers, which are replaced by copies that produce only the selected filters. Branches of a
+concatenation without selected channels are dropped. Tensors also needed in full by other layers are not pushed
+through, but simply sliced, since they must be computed anyway.
+'''
+import logging
+
+import tensorflow as tf
+
+logger = logging.getLogger('deep_dream')
+
+PRUNE_MAX_FRACTION = 0.5 # Larger selections save too little compute to be worth the rewrite
+
+CHANNEL_WISE_LAYERS = (tf.keras.layers.Activation, tf.keras.layers.ReLU,)
+DROPOUT_LAYERS = (tf.keras.layers.Dropout,) # Identities at inference time, including subclasses
+PRUNABLE_PRODUCERS = (tf.keras.layers.Conv2D, tf.keras.layers.Dense,) # Exact types: subclasses have other kernels
+
+
+def tensor_key(tensor):
+    layer, node_index, tensor_index = tensor._keras_history # pylint: disable=protected-access
+    return id(layer), node_index, tensor_index
+
+
+def producer_node(tensor):
+    layer, node_index, _tensor_index = tensor._keras_history # pylint: disable=protected-access
+    return layer, layer.inbound_nodes[node_index]
+
+
+def node_inputs(node):
+    '''The tensors of the first positional argument of a node, as a list.'''
+    return tf.nest.flatten(node.call_args[0])
+
+
+def count_consumers(output):
+    '''Counts, for each tensor that the output depends on, how many layers of that subgraph consume it.'''
+    consumers = {}
+    visited = set()
+    pending = [output]
+    while pending:
+        tensor = pending.pop()
+        layer, node = producer_node(tensor)
+        if node.is_input or (id(layer), id(node)) in visited:
+            continue
+        visited.add((id(layer), id(node)))
+        for input_tensor in node.keras_inputs:
+            key = tensor_key(input_tensor)
+            consumers[key] = consumers.get(key, 0) + 1
+            pending.append(input_tensor)
+    return consumers
+
+
+def slice_channels(tensor, start, stop):
+    return tf.keras.layers.Lambda(lambda t, start=start, stop=stop: t[..., start:stop])(tensor)
+
+
+def is_last_axis(axis, tensor):
+    return axis in (-1, len(tensor.shape)-1)
+
+
+def pruned_tensor(tensor, start, stop, consumers):
+    '''Returns a new symbolic tensor with the channels [start; stop) of tensor, computing as little as possible.'''
+    if start == 0 and stop == tensor.shape[-1]:
+        return tensor
+    layer, node = producer_node(tensor)
+    if node.is_input or consumers.get(tensor_key(tensor), 0) > 1:
+        return slice_channels(tensor, start, stop)
+    inputs = node_inputs(node)
+    if isinstance(layer, tf.keras.layers.Concatenate) and is_last_axis(layer.axis, tensor):
+        parts = []
+        offset = 0
+        for input_tensor in inputs:
+            size = input_tensor.shape[-1]
+            part_start, part_stop = max(start, offset), min(stop, offset+size)
+            if part_start < part_stop:
+                parts.append(pruned_tensor(input_tensor, part_start-offset, part_stop-offset, consumers))
+            offset += size
+        return parts[0] if len(parts) == 1 else tf.keras.layers.Concatenate(axis=-1)(parts)
+    if isinstance(layer, tf.keras.layers.Add):
+        return tf.keras.layers.Add()([pruned_tensor(t, start, stop, consumers) for t in inputs])
+    if isinstance(layer, DROPOUT_LAYERS):
+        return pruned_tensor(inputs[0], start, stop, consumers)
+    if isinstance(layer, CHANNEL_WISE_LAYERS):
+        # Calls the original activation (e.g., the patched ReLU), which is element-wise
+        return tf.keras.layers.Lambda(layer.call)(pruned_tensor(inputs[0], start, stop, consumers))
+    if isinstance(layer, tf.keras.layers.BatchNormalization) and is_last_axis(layer.axis[0], tensor) \
+            and len(layer.axis) == 1:
+        config = dict(layer.get_config(), name=f'{layer.name}_pruned')
+        pruned_layer = tf.keras.layers.BatchNormalization.from_config(config)
+        output = pruned_layer(pruned_tensor(inputs[0], start, stop, consumers))
+        pruned_layer.set_weights([w[start:stop] for w in layer.get_weights()])
+        return output
+    if type(layer) in PRUNABLE_PRODUCERS and getattr(layer, 'groups', 1) == 1: # pylint: disable=unidiomatic-typecheck
+        config = layer.get_config()
+        size_key = 'filters' if 'filters' in config else 'units'
+        config = dict(config, name=f'{layer.name}_pruned', **{size_key: stop-start})
+        pruned_layer = type(layer).from_config(config)
+        output = pruned_layer(inputs[0])
+        pruned_layer.set_weights([w[..., start:stop] for w in layer.get_weights()])
+        return output
+    return slice_channels(tensor, start, stop)
+
+
+def prune_output_channels(model, start, stop):
+    '''
+    Returns a model computing only the output channels [start; stop) of model, or model itself if the selection is too
+    large to be worth pruning. The pruned model shares the weights of all the layers it does not rewrite.
+    '''
+    size = model.output.shape[-1]
+    if stop - start > PRUNE_MAX_FRACTION * size:
+        return model
+    consumers = count_consumers(model.output)
+    output = pruned_tensor(model.output, start, stop, consumers)
+    pruned_model = tf.keras.Model(inputs=model.input, outputs=output)
+    logger.debug('-- pruned model to channels [%s; %s) of %s: %s layers instead of %s', start, stop, size,
+                 len(pruned_model.layers), len(model.layers))
+    return pruned_model
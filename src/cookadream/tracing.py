@@ -0,0 +1,143 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+'''
+Opt-in timeline tracing. While a trace is active, spans are recorded from every thread (the GUI thread, the workers
+of the Qt thread pools, the dream loops) and written as a single Chrome trace event file, which may be opened on
+chrome://tracing or on https://ui.perfetto.dev.
+
+When tracing is inactive, span() costs a single global lookup, so it may be left in the hot paths.
+'''
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('cookadream')
+
+TRACE_CATEGORY_DEF = 'cookadream'
+
+_tracer = None
+
+
+class Tracer:
+    '''Collects complete events ("ph": "X") in memory; thread-safe.'''
+
+    def __init__(self, *, tf_profiler_dir=None):
+        self.pid = os.getpid()
+        self.origin_ns = time.perf_counter_ns()
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.tf_profiler_dir = tf_profiler_dir
+
+    def add_span(self, name, category, start_ns, end_ns, args):
+        thread = threading.current_thread()
+        event = dict(name=name, cat=category, ph='X', pid=self.pid, tid=thread.ident,
+                     ts=(start_ns - self.origin_ns) / 1000., dur=(end_ns - start_ns) / 1000.)
+        if args:
+            event['args'] = {k: v if isinstance(v, (int, float, bool, str)) else str(v) for k,v in args.items()}
+        with self.lock:
+            self.events.append(event)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def trace_events(self):
+        with self.lock:
+            metadata = [dict(name='thread_name', ph='M', pid=self.pid, tid=tid, args=dict(name=name))
+                        for tid,name in self.thread_names.items()]
+            return metadata + list(self.events)
+
+
+def active():
+    return _tracer is not None
+
+
+@contextlib.contextmanager
+def span(name, category=TRACE_CATEGORY_DEF, **args):
+    '''Records the duration of the enclosed block as a span, if a trace is active.'''
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    annotation = contextlib.nullcontext()
+    if tracer.tf_profiler_dir is not None:
+        import tensorflow as tf  # pylint: disable=import-outside-toplevel
+        # Mirrors the span on the TensorFlow timeline, so both may be aligned by name
+        annotation = tf.profiler.experimental.Trace(name)
+    start_ns = time.perf_counter_ns()
+    try:
+        with annotation:
+            yield
+    finally:
+        tracer.add_span(name, category, start_ns, time.perf_counter_ns(), args)
+
+
+def traced(name=None, category=TRACE_CATEGORY_DEF):
+    '''Decorator that records every call of the function as a span.'''
+    def decorator(function):
+        span_name = name or function.__qualname__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with span(span_name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start(*, tf_profiler_dir=None):
+    '''
+    Starts recording spans. If tf_profiler_dir is given, the TensorFlow profiler is attached for the same window,
+    writing its own profile (viewable in TensorBoard) to that directory.
+    '''
+    global _tracer
+    if _tracer is not None:
+        return
+    tracer = Tracer(tf_profiler_dir=tf_profiler_dir)
+    if tf_profiler_dir is not None:
+        try:
+            import tensorflow as tf  # pylint: disable=import-outside-toplevel
+            tf.profiler.experimental.start(str(tf_profiler_dir))
+        except Exception: # pylint: disable=broad-except
+            logger.exception('could not start the tensorflow profiler')
+            tracer.tf_profiler_dir = None
+    _tracer = tracer
+    logger.info('-- tracing started, tf_profiler_dir = %s', tracer.tf_profiler_dir)
+
+
+def stop(path):
+    '''Stops recording and writes the trace to path. Returns the number of events written.'''
+    global _tracer
+    tracer = _tracer
+    if tracer is None:
+        return 0
+    _tracer = None
+    if tracer.tf_profiler_dir is not None:
+        try:
+            import tensorflow as tf  # pylint: disable=import-outside-toplevel
+            tf.profiler.experimental.stop()
+        except Exception: # pylint: disable=broad-except
+            logger.exception('could not stop the tensorflow profiler')
+    events = tracer.trace_events()
+    trace = dict(traceEvents=events, displayTimeUnit='ms')
+    if tracer.tf_profiler_dir is not None:
+        trace['otherData'] = dict(tf_profiler_dir=str(tracer.tf_profiler_dir))
+    with open(path, 'w', encoding='utf-8') as trace_file:
+        json.dump(trace, trace_file)
+    logger.info('-- trace written to "%s", %s events', path, len(events))
+    return len(events)
@@ -1,10 +1,11 @@
-import pkg_resources
-
 from PySide6.QtCore import (Property, QMimeData, QObject, QSysInfo, Signal, Slot)
 from PySide6.QtQml import QmlElement
 
 from .version_info import PRODUCT_COMMIT, PRODUCT_VERSION
 
+PACKAGES_MANIFEST_NAME = 'PACKAGES.tab'
+PACKAGES_MANIFEST_HEADER = ('package', 'license', 'homepage',)
+
 appName = None
 textDir = None
 clipboard = None
@@ -32,12 +33,23 @@ class AboutInfo(QObject):
         self._disclaimersText = None
         self._disclaimersPlainText = None
         self._locale = ''
-        self._packagesData = self.getPackagesData()
+        self._packagesData = None
+        self._packagesDataText = None
+        self._packagesDataPlainText = None
+        self._localeSet('enUS')
+
+    def _loadPackagesData(self):
+        # The manifest is generated when packaging (utils/prepare_packages_data.py); scanning the installed
+        # distributions is much slower, and is only a fallback for running from the sources
+        self._packagesData = self.readPackagesManifest(textDir / PACKAGES_MANIFEST_NAME)
+        if self._packagesData is None:
+            self._packagesData = self.getPackagesData()
         self._packagesDataText = self.formatPackagesData(self._packagesData, html=True)
         self._packagesDataPlainText = self.formatPackagesData(self._packagesData, html=False)
-        self._localeSet('enUS')
 
     def _loadLicenseTexts(self):
+        if self._packagesData is None:
+            self._loadPackagesData()
         aboutTextPath = textDir / f'ABOUT_{self.locale}.html'
         with open(aboutTextPath, 'rt', encoding='utf-8') as aboutTextFile:
             aboutText = aboutTextFile.read()
@@ -197,6 +209,7 @@ class AboutInfo(QObject):
 
     @classmethod
     def getPackagesData(cls):
+        import pkg_resources  # pylint: disable=import-outside-toplevel
         packages = pkg_resources.working_set
         packages = sorted(packages, key=lambda p: str(p).lower())
         packagesData = []
@@ -206,6 +219,23 @@ class AboutInfo(QObject):
             packagesData.append((packageName, packageLicense, packageHomepage,))
         return packagesData
 
+    @staticmethod
+    def readPackagesManifest(manifestPath):
+        '''Returns the packages data saved by writePackagesManifest, or None if there is no manifest.'''
+        try:
+            with open(manifestPath, 'rt', encoding='utf-8') as manifestFile:
+                lines = manifestFile.read().splitlines()[1:]
+        except FileNotFoundError:
+            return None
+        return [tuple(line.split('\t')) for line in lines if line]
+
+    @staticmethod
+    def writePackagesManifest(manifestPath, packagesData):
+        with open(manifestPath, 'wt', encoding='utf-8') as manifestFile:
+            print('\t'.join(PACKAGES_MANIFEST_HEADER), file=manifestFile)
+            for packageData in packagesData:
+                print('\t'.join(field.replace('\t', ' ') for field in packageData), file=manifestFile)
+
     @staticmethod
     def formatPackagesData(packagesData, html=False):
         if html:
@@ -0,0 +1,134 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+from PySide6.QtCore import Property, QAbstractListModel, QByteArray, QModelIndex, Qt, Signal, Slot
+from PySide6.QtQml import QmlElement
+
+INDEX_FILE_NAME = 'imagenet_index.tab'
+
+# The index is loaded once, and shared by all models: (keras_id, imagenet_name, search_names) per class
+imagenetIndex = None
+
+def configureImagenetClasses(dataDirPathObject):
+    '''Loads the class index built by utils/prepare_imagenet_data.py.'''
+    global imagenetIndex
+    indexPath = dataDirPathObject / INDEX_FILE_NAME
+    with open(indexPath, 'rt', encoding='utf-8') as indexFile:
+        next(indexFile) # Skips header
+        rows = (line.rstrip('\n').split('\t') for line in indexFile)
+        imagenetIndex = tuple((int(kerasId), name, tuple(searchNames.split('|'))) for kerasId, name, searchNames in rows)
+
+# --- Python-QML list model for the concept picker
+
+# To be used on the @QmlElement decorator
+QML_IMPORT_NAME = 'cookadream.dreamengine'
+QML_IMPORT_MAJOR_VERSION = 1
+QML_IMPORT_MINOR_VERSION = 0
+
+@QmlElement
+class ImagenetClassesModel(QAbstractListModel):
+    '''
+    The ImageNet classes, with roles imagenet_name and keras_id, filtered by the property filter: classes with a name
+    that starts with the filter come first, then classes with a name that contains it. Each row of the filtered model
+    maps to a row of the full index (the source row), which is stable and may be persisted.
+    '''
+
+    NameRole = Qt.UserRole + 1
+    KerasIdRole = Qt.UserRole + 2
+
+    filterChanged = Signal(name='filterChanged')
+    countChanged = Signal(name='countChanged')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if imagenetIndex is None:
+            raise RuntimeError('configureImagenetClasses() must be called before creating ImagenetClassesModel')
+        self._filter = ''
+        self._rows = list(range(len(imagenetIndex)))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def roleNames(self):
+        return {self.NameRole: QByteArray(b'imagenet_name'), self.KerasIdRole: QByteArray(b'keras_id')}
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._rows):
+            return None
+        kerasId, name, _searchNames = imagenetIndex[self._rows[index.row()]]
+        if role in (self.NameRole, Qt.DisplayRole):
+            return name
+        if role == self.KerasIdRole:
+            return kerasId
+        return None
+
+    # --- Property .filter
+    def filterGet(self):
+        return self._filter
+
+    def filterSet(self, filterText):
+        filterText = filterText.strip().lower()
+        if filterText == self._filter:
+            return
+        # Typing one more character only narrows the current matches, so they are the only candidates
+        if self._filter and filterText.startswith(self._filter):
+            candidates = self._rows
+        else:
+            candidates = range(len(imagenetIndex))
+        if filterText:
+            prefixRows = []
+            substringRows = []
+            for row in candidates:
+                searchNames = imagenetIndex[row][2]
+                if any(n.startswith(filterText) for n in searchNames):
+                    prefixRows.append(row)
+                elif any(filterText in n for n in searchNames):
+                    substringRows.append(row)
+            # Candidates kept their rank from the previous filter: re-sorts, so prefix matches stay in index order
+            rows = sorted(prefixRows) + sorted(substringRows)
+        else:
+            rows = list(range(len(imagenetIndex)))
+        self.beginResetModel()
+        self._filter = filterText
+        self._rows = rows
+        self.endResetModel()
+        self.filterChanged.emit()
+        self.countChanged.emit()
+
+    filter = Property(str, filterGet, filterSet, notify=filterChanged)
+
+    # --- Property .count (read-only)
+    def countGet(self):
+        return len(self._rows)
+
+    count = Property(int, countGet, notify=countChanged)
+
+    # --- Mapping between filtered rows and rows of the full index
+    @Slot(int, result=int)
+    def sourceRow(self, row):
+        '''Returns int: the row in the full index of a filtered row, or -1.'''
+        return self._rows[row] if 0 <= row < len(self._rows) else -1
+
+    @Slot(int, result=int)
+    def rowOfSource(self, sourceRow):
+        '''Returns int: the filtered row of a row in the full index, or -1 if it is filtered out.'''
+        try:
+            return self._rows.index(sourceRow)
+        except ValueError:
+            return -1
+
+    @Slot(int, result=int)
+    def kerasIdOfSource(self, sourceRow):
+        '''Returns int: the keras_id of a row in the full index, whatever the filter, or -1.'''
+        return imagenetIndex[sourceRow][0] if 0 <= sourceRow < len(imagenetIndex) else -1
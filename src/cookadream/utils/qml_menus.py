@@ -0,0 +1,160 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+'''
+Menu source translations to uniformize platform and Qt menus, and the cache of translated QML sources.
+
+The translated main window is written to a file named after a hash of its sources and of the translation flags, and
+loaded from that file URL, so the QML engine reuses its compiled cache across launches. Variants may also be
+pre-generated at build time (see utils/prepare_qml_variants.py) in the PREBUILT_DIR_NAME subfolder of the QML folder.
+'''
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from .version_info import PRODUCT_VERSION
+
+PREBUILT_DIR_NAME = 'prebuilt'
+PREBUILT_FOLDER_IMPORT = '..'
+CACHE_KEY_LENGTH = 16
+CACHED_VARIANTS_KEEP = 4
+
+def openUTF8Resource(resourcePath, lines=False):
+    with open(resourcePath, 'rt', encoding='utf-8') as resourceFile:
+        resource = resourceFile.readlines() if lines else resourceFile.read()
+    return resource
+
+def qmlProcessMenu(menuSource, platform, platformPrefix='QtPl.', qtPrefix='', sequenceGetter='mksq'):
+    '''Processes menu source, using or not platform version.'''
+    if platform:
+        menuSource = re.sub(r'action:\s*([A-Za-z0-9_]+)',
+                            r'QtPl.MenuItem { text: \1.text; shortcut: \1.shortcut; checkable: \1.checkable; '
+                            r'checked: \1.checked; enabled: \1.enabled; onTriggered: \1.trigger() }', menuSource)
+        importPrefix = platformPrefix
+        menuElement = 'Menu'
+        openFunction = 'open'
+    else:
+        if sequenceGetter:
+            replacement  = r'MenuItem { text: \1.text + '
+            replacement += sequenceGetter + r'.inMenu(\1.shortcut ? \1.shortcut  : ""); action: \1 }'
+        else:
+            replacement = r'MenuItem { action: \1 }'
+        menuSource = re.sub(r'action:\s*([A-Za-z0-9_]+)', replacement, menuSource)
+        importPrefix = qtPrefix
+        menuElement = 'MenuFit'
+        openFunction = 'popup'
+    menuSource = re.sub(r'^\s*@\.', importPrefix, menuSource, flags=re.MULTILINE)
+    menuSource = re.sub(r'<Menu>', menuElement, menuSource)
+    menuSource = re.sub(r'{([\t ]*\n)*[\t ]*', '{ ', menuSource)
+    menuSource = re.sub(r'}([\t ]*\n)*[\t ]*', '} ', menuSource)
+    menuSource = re.sub(r'([\t ]*\n)+[\t ]*', '; ', menuSource)
+    return menuSource, openFunction
+
+def qmlTranslateAllMenus(qmlSource, menuPathPrefix, platform, sequenceGetter='mksq'):
+    for menuType in ('menubar', 'menucontext',):
+        qmlMenuPath = menuPathPrefix + f'-{menuType}.qml'
+        qmlMenuSource = openUTF8Resource(qmlMenuPath)
+        qmlMenuSource, openFunction = qmlProcessMenu(qmlMenuSource, platform=platform, sequenceGetter=sequenceGetter)
+        if menuType == 'menubar' and not platform:
+            qmlMenuSource = f'menuBar: {qmlMenuSource}'
+        qmlSource = qmlSource.replace(f'//<<<application_{menuType}>>>//', qmlMenuSource)
+        qmlSource = qmlSource.replace(f'application_{menuType}_open_function', openFunction)
+    return qmlSource
+
+def qmlCacheKey(qmlPath, *, platform, sequenceGetter, theme, folderImport):
+    '''Hash of the main source, its menu sources, and every flag that changes the translation or its compilation.'''
+    qmlPath = Path(qmlPath)
+    menuPathPrefix = str(qmlPath.with_suffix(''))
+    sourceHash = hashlib.sha256()
+    for sourcePath in (qmlPath, Path(menuPathPrefix + '-menubar.qml'), Path(menuPathPrefix + '-menucontext.qml')):
+        with open(sourcePath, 'rb') as sourceFile:
+            sourceHash.update(sourceFile.read())
+    flags = f'{PRODUCT_VERSION}|{platform}|{sequenceGetter}|{theme}|{folderImport}'
+    sourceHash.update(flags.encode())
+    return sourceHash.hexdigest()[:CACHE_KEY_LENGTH]
+
+def qmlTranslatedSource(qmlPath, *, platform, sequenceGetter, folderImport):
+    '''
+    Translates the menus of a QML source. The result imports the folder of the original explicitly, as folderImport (an
+    URI, or a path relative to the folder of the translation), so it may be loaded from another folder.
+    '''
+    qmlPath = Path(qmlPath)
+    qmlSource = openUTF8Resource(qmlPath)
+    qmlSource = qmlTranslateAllMenus(qmlSource, str(qmlPath.with_suffix('')), platform=platform,
+                                     sequenceGetter=sequenceGetter)
+    # Inserts the import after the license header, before the first import of the source
+    firstImport = re.search(r'^import ', qmlSource, flags=re.MULTILINE)
+    insertAt = firstImport.start() if firstImport else 0
+    return qmlSource[:insertAt] + f'import "{folderImport}"\n' + qmlSource[insertAt:]
+
+def qmlVariantName(qmlPath, key):
+    return f'{Path(qmlPath).stem}_{key}.qml'
+
+def qmlWriteVariant(qmlSource, variantPath):
+    '''Writes atomically, so a concurrent launch never compiles a partial file.'''
+    variantPath = Path(variantPath)
+    os.makedirs(variantPath.parent, exist_ok=True)
+    fileHandle, temporaryPath = tempfile.mkstemp(prefix=f'.{variantPath.stem}_', suffix='.qml', dir=variantPath.parent)
+    try:
+        with os.fdopen(fileHandle, 'wt', encoding='utf-8') as variantFile:
+            variantFile.write(qmlSource)
+        os.replace(temporaryPath, variantPath)
+    except BaseException:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+
+def qmlPrebuildVariants(qmlPath, *, themes):
+    '''Pre-generates the translations for every combination of flags. Returns the list of paths written.'''
+    qmlPath = Path(qmlPath)
+    prebuiltDir = qmlPath.parent / PREBUILT_DIR_NAME
+    variantPaths = []
+    for platform in (False, True):
+        for sequenceGetter in ('', 'mksq'):
+            qmlSource = qmlTranslatedSource(qmlPath, platform=platform, sequenceGetter=sequenceGetter,
+                                            folderImport=PREBUILT_FOLDER_IMPORT)
+            for theme in themes:
+                key = qmlCacheKey(qmlPath, platform=platform, sequenceGetter=sequenceGetter, theme=theme,
+                                  folderImport=PREBUILT_FOLDER_IMPORT)
+                variantPath = prebuiltDir / qmlVariantName(qmlPath, key)
+                qmlWriteVariant(qmlSource, variantPath)
+                variantPaths.append(variantPath)
+    return variantPaths
+
+def qmlCachedVariant(qmlPath, cacheDir, *, platform, sequenceGetter, theme):
+    '''
+    Returns (path, cached): the path of the translated QML to load, pre-generated, cached from a previous launch, or
+    translated and cached now; and whether the translation was skipped.
+    '''
+    qmlPath = Path(qmlPath)
+    prebuiltKey = qmlCacheKey(qmlPath, platform=platform, sequenceGetter=sequenceGetter, theme=theme,
+                              folderImport=PREBUILT_FOLDER_IMPORT)
+    prebuiltPath = qmlPath.parent / PREBUILT_DIR_NAME / qmlVariantName(qmlPath, prebuiltKey)
+    if prebuiltPath.exists():
+        return prebuiltPath, True
+    # The cache lives outside the application: the folder is imported by its absolute URI, which is part of the key
+    folderImport = qmlPath.parent.as_uri()
+    key = qmlCacheKey(qmlPath, platform=platform, sequenceGetter=sequenceGetter, theme=theme, folderImport=folderImport)
+    cachedPath = Path(cacheDir) / qmlVariantName(qmlPath, key)
+    if cachedPath.exists():
+        return cachedPath, True
+    qmlSource = qmlTranslatedSource(qmlPath, platform=platform, sequenceGetter=sequenceGetter, folderImport=folderImport)
+    qmlWriteVariant(qmlSource, cachedPath)
+    # Keeps only the most recent variants
+    variants = sorted(Path(cacheDir).glob(f'{qmlPath.stem}_*.qml'), key=os.path.getmtime, reverse=True)
+    for stalePath in variants[CACHED_VARIANTS_KEEP:]:
+        os.remove(stalePath)
+    return cachedPath, False
@@ -24,7 +24,7 @@ from PySide6.QtQml import QmlElement, QQmlApplicationEngine
 from PySide6.QtQuickControls2 import QQuickStyle
 from PySide6.QtWidgets import QApplication
 
-from . import style_rc  # pylint: disable=unused-import
+from . import imagenet_classes, style_rc  # pylint: disable=unused-import
 from .version_info import PRODUCT_VERSION
 
 compileSettings = len(sys.argv) > 1 and sys.argv[1] == '--compile'
@@ -65,6 +65,8 @@ textDir = applicationDir / 'resources' / 'text'
 examplesDir = applicationDir / 'resources' / 'examples'
 qmlDir = applicationDir / 'gui'
 
+imagenet_classes.configureImagenetClasses(dataDirPathObject=dataDir)
+
 # Load fonts
 for typeface in ("Roboto-Regular.ttf", "Roboto-Italic.ttf", "Roboto-Medium.ttf", "Roboto-MediumItalic.ttf",
                  "Roboto-Bold.ttf", "Roboto-BoldItalic.ttf",):
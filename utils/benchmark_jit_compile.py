@@ -0,0 +1,92 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+# pylint: disable=invalid-name
+# Times the gradient steps of each model with and without XLA compilation (jit_compile), to choose the 'jit_compile'
+# entries of DeepDreamEngine.models. Example: python utils/benchmark_jit_compile.py --device /device:CPU:0
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+applicationPath = Path(__file__).resolve(strict=True)
+sys.path.insert(0, str(applicationPath.parent.parent / 'src'))
+
+# pylint: disable=wrong-import-position
+import numpy as np
+import tensorflow as tf
+
+from cookadream.deep_dream import DEEP_DREAM_ENGINE_DEVICES, JITTER_DEF, RELU_WARMUP_STEPS, DeepDreamEngine
+
+# A layer in the middle of each model, where the dreams are usually made
+BENCHMARK_LAYERS = {
+    'InceptionV3':    'mixed3',
+    'ResNet50':       'conv4_block6_out',
+    'EfficientNetB0': 'block5c_add',
+    'EfficientNetB4': 'block5c_add',
+}
+
+
+def time_steps(engine, size, steps):
+    '''Returns (warm-up seconds, seconds per step, final jit state) of the module set up in the engine.'''
+    deepdream = engine.deepdream
+    image_array = engine.noise_to_image_array(engine.get_noise_array(size, size))
+    image_tf = tf.convert_to_tensor(engine.preprocess(image_array.astype(np.float32)))
+    image_tf, _padding, crop_size = engine.pad_image(image_tf, jitter_pixels=JITTER_DEF)
+    deepdream.start_optimizer(image_tf, crop_size=crop_size, jitter_pixels=JITTER_DEF)
+    # The first steps trace (and, if enabled, compile) the graphs of both ReLU phases
+    start = time.perf_counter()
+    deepdream.run_steps(RELU_WARMUP_STEPS + 1)
+    engine.wait_for(deepdream.current_result)
+    warmup = time.perf_counter() - start
+    start = time.perf_counter()
+    deepdream.run_steps(steps)
+    engine.wait_for(deepdream.current_result)
+    return warmup, (time.perf_counter() - start) / steps, deepdream.jit_policy.state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--device', default=DEEP_DREAM_ENGINE_DEVICES[0])
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--models', nargs='*', default=list(BENCHMARK_LAYERS))
+    parser.add_argument('--weights', default='imagenet',
+                        help='"none" for random weights, which time the same (e.g., when the weights are unavailable)')
+    args = parser.parse_args()
+    weights = None if args.weights == 'none' else args.weights
+
+    print(f'device = {args.device}, size = {args.size}, steps = {args.steps}, weights = {args.weights}')
+    print('model           layer              plain ms/step  xla ms/step  xla warm-up s  speedup')
+    for model_name in args.models:
+        layer_name = BENCHMARK_LAYERS[model_name]
+        results = {}
+        for jit_compile in ('off', 'on'):
+            engine = DeepDreamEngine()
+            with tf.device(args.device):
+                engine.setup(args.device, model_name=model_name, layer_name=layer_name, neuron_first=0,
+                             neuron_last=31, jit_compile=jit_compile, weights=weights)
+                results[jit_compile] = time_steps(engine, args.size, args.steps)
+        _warmup, plain, _state = results['off']
+        warmup, xla, state = results['on']
+        if state == 'off':
+            print(f'{model_name:15} {layer_name:18} {1000.*plain:13.1f}  compilation failed, fell back to plain')
+        else:
+            print(f'{model_name:15} {layer_name:18} {1000.*plain:13.1f}  {1000.*xla:11.1f}  {warmup:13.1f}  '
+                  f'{plain/xla:7.2f}')
+
+
+if __name__ == '__main__':
+    main()
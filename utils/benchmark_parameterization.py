@@ -0,0 +1,111 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+# pylint: disable=invalid-name
+# Counts the optimizer steps each image parameterization of DeepDream.start_optimizer takes to reach the same
+# activation loss, from the same starting image. The target losses are fractions of the loss reached on the pixels after
+# --steps steps. Example: python utils/benchmark_parameterization.py --model InceptionV3 --layer mixed3
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+applicationPath = Path(__file__).resolve(strict=True)
+sys.path.insert(0, str(applicationPath.parent.parent / 'src'))
+
+# pylint: disable=wrong-import-position
+import numpy as np
+import PIL.Image
+import tensorflow as tf
+
+from cookadream.deep_dream import (DEEP_DREAM_ENGINE_DEVICES, JITTER_DEF, PARAMETERIZATIONS, STEPS_MIN,
+                                   DeepDreamEngine)
+
+TARGET_FRACTIONS = (0.5, 0.75, 0.9, 1.)
+
+
+def activation_loss(deepdream, image_tf):
+    '''The loss of the activations alone, without the smoothing term, to be maximized.'''
+    return -float(deepdream.dream_loss(image_tf, tf.constant(0., dtype=tf.float32)))
+
+
+def loss_curve(engine, image_array, parameterization, steps, smoothing_factor):
+    '''Returns ([(steps, activation loss)] after each block of STEPS_MIN steps, seconds per step).'''
+    deepdream = engine.deepdream
+    image_tf = tf.convert_to_tensor(engine.preprocess(image_array.astype(np.float32)))
+    image_tf, _padding, crop_size = engine.pad_image(image_tf, jitter_pixels=JITTER_DEF)
+    deepdream.start_optimizer(image_tf, crop_size=crop_size, jitter_pixels=JITTER_DEF,
+                              smoothing_factor=smoothing_factor, parameterization=parameterization)
+    # The first block traces the graphs: it is not timed
+    curve = [(0, activation_loss(deepdream, deepdream.current_result))]
+    seconds = 0.
+    for step in range(STEPS_MIN, steps+1, STEPS_MIN):
+        start = time.perf_counter()
+        deepdream.run_steps(STEPS_MIN)
+        engine.wait_for(deepdream.current_result)
+        if step > STEPS_MIN:
+            seconds += time.perf_counter() - start
+        curve.append((step, activation_loss(deepdream, deepdream.current_result)))
+    return curve, seconds / max(steps - STEPS_MIN, 1)
+
+
+def steps_to_reach(curve, target):
+    return next((step for step, loss in curve if loss >= target), None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--device', default=DEEP_DREAM_ENGINE_DEVICES[0])
+    parser.add_argument('--model', default='InceptionV3')
+    parser.add_argument('--layer', default='mixed3')
+    parser.add_argument('--neuron-first', type=int, default=0)
+    parser.add_argument('--neuron-last', type=int, default=31)
+    parser.add_argument('--image', help='starting image (default: pink noise)')
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--smoothing', type=float, default=0., help='smoothing_factor (default: no smoothing)')
+    parser.add_argument('--weights', default='imagenet',
+                        help='"none" for seeded random weights (e.g., offline): the same objective for both optimizers')
+    args = parser.parse_args()
+    weights = None if args.weights == 'none' else args.weights
+    if weights is None:
+        tf.keras.utils.set_random_seed(0)
+
+    engine = DeepDreamEngine()
+    with tf.device(args.device):
+        engine.setup(args.device, model_name=args.model, layer_name=args.layer, neuron_first=args.neuron_first,
+                     neuron_last=args.neuron_last, weights=weights)
+        if args.image:
+            image_array = np.asarray(engine.fit_image(PIL.Image.open(args.image).convert('RGB'), max_dim=args.size))
+        else:
+            image_array = engine.noise_to_image_array(engine.get_noise_array(args.size, args.size))
+        results = {p: loss_curve(engine, image_array, p, args.steps, args.smoothing) for p in PARAMETERIZATIONS}
+
+    reference_curve, _seconds = results['pixels']
+    start_loss, final_loss = reference_curve[0][1], reference_curve[-1][1]
+    targets = [start_loss + f*(final_loss-start_loss) for f in TARGET_FRACTIONS]
+    print(f'device = {args.device}, model = {args.model}, layer = {args.layer}, image = {image_array.shape}, '
+          f'steps = {args.steps}, smoothing = {args.smoothing}, weights = {args.weights}')
+    print(f'activation loss: start = {start_loss:.4g}, after {args.steps} steps on pixels = {final_loss:.4g}')
+    print('parameterization  ms/step  final loss  ' +
+          '  '.join(f'steps to {100*f:3.0f}%' for f in TARGET_FRACTIONS))
+    for parameterization, (curve, seconds) in results.items():
+        reached = [steps_to_reach(curve, t) for t in targets]
+        print(f'{parameterization:16}  {1000.*seconds:7.1f}  {curve[-1][1]:10.4g}  ' +
+              '  '.join(f'{"-" if r is None else r:>12}' for r in reached))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+# pylint: disable=invalid-name
+# Checks that engines in the same process do not share state: dreams run concurrently, one engine per thread, must give
+# the same results as the same dreams run one after the other. Jitter is off, so the dreams are deterministic.
+# Runs offline, on random weights seeded for repeatability, with --weights none.
+# Example: python utils/check_concurrent_engines.py --weights none
+
+import argparse
+import sys
+import threading
+from pathlib import Path
+
+applicationPath = Path(__file__).resolve(strict=True)
+sys.path.insert(0, str(applicationPath.parent.parent / 'src'))
+
+# pylint: disable=wrong-import-position
+import numpy as np
+import tensorflow as tf
+
+from cookadream.deep_dream import DEEP_DREAM_ENGINE_DEVICES, DeepDreamEngine
+
+# Different models and layers, so the ReLU warm-up of one engine would disturb the other if the state were shared
+ENGINES_SETUP = (
+    dict(model_name='InceptionV3', layer_name='mixed3', neuron_first=0, neuron_last=31),
+    dict(model_name='ResNet50', layer_name='conv3_block4_out', neuron_first=0, neuron_last=31),
+)
+DREAM_KWARGS = dict(octaves=range(-1, 1), steps_per_octave=20, jitter_pixels=0)
+IMAGE_SIZE = 256
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--device', default=DEEP_DREAM_ENGINE_DEVICES[0])
+    parser.add_argument('--weights', default='imagenet',
+                        help='"none" for random weights, which check the isolation the same (e.g., offline)')
+    args = parser.parse_args()
+    weights = None if args.weights == 'none' else args.weights
+    if weights is None:
+        tf.keras.utils.set_random_seed(0)
+
+    engines = []
+    for setup_kwargs in ENGINES_SETUP:
+        engine = DeepDreamEngine()
+        engine.setup(args.device, jit_compile='off', weights=weights, **setup_kwargs)
+        engines.append(engine)
+    rng = np.random.default_rng(0)
+    image_array = engines[0].noise_to_image_array(engines[0].get_noise_array(IMAGE_SIZE, IMAGE_SIZE, rng=rng))
+
+    sequential = [engine.dream(image_array, dream_kwargs=DREAM_KWARGS) for engine in engines]
+
+    concurrent = [None] * len(engines)
+    def run(i):
+        concurrent[i] = engines[i].dream(image_array, dream_kwargs=DREAM_KWARGS)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(engines))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = False
+    for setup_kwargs, sequential_result, concurrent_result in zip(ENGINES_SETUP, sequential, concurrent):
+        difference = np.abs(sequential_result.astype(int) - concurrent_result.astype(int)).max()
+        ok = difference <= 1 # Tolerates rounding differences in the conversion to uint8
+        failed = failed or not ok
+        print(f'{setup_kwargs["model_name"]:12} max difference = {difference:3}  {"OK" if ok else "FAILED"}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+# pylint: disable=invalid-name
+# Dreams poster-size images, far larger than the application accepts, out-of-core (see
+# DeepDreamEngine.dream_out_of_core). The input may be an image file or a .npy uint8 (height, width, 3) array, which is
+# read by strips; a .npy output is written by strips, other formats are encoded by Pillow from the whole result.
+# Example: python utils/dream_poster.py poster.png dreamed_poster.png --layer mixed5 --scratch-dir /tmp
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+applicationPath = Path(__file__).resolve(strict=True)
+sys.path.insert(0, str(applicationPath.parent.parent / 'src'))
+
+# pylint: disable=wrong-import-position
+import PIL.Image
+
+from cookadream.deep_dream import (DEEP_DREAM_ENGINE_DEVICES, STEPS_DEF, TILE_MARGIN_DEF, TILE_SIZE_DEF,
+                                   DeepDreamEngine)
+
+# Posters are not limited by the application's MAX_DIM
+PIL.Image.MAX_IMAGE_PIXELS = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--device', default=DEEP_DREAM_ENGINE_DEVICES[0])
+    parser.add_argument('--model', default='InceptionV3')
+    parser.add_argument('--layer', default='mixed3')
+    parser.add_argument('--neuron-first', type=int, default=0)
+    parser.add_argument('--neuron-last', type=int, default=31)
+    parser.add_argument('--steps', type=int, default=STEPS_DEF, help='steps per octave')
+    # Octaves as in the interface: from 0 (the full size) to the coarsest, scaling on a logarithmic scale, blending in %
+    parser.add_argument('--octaves-from', type=int, default=0)
+    parser.add_argument('--octaves-to', type=int, default=3)
+    parser.add_argument('--octaves-scaling', type=float, default=0.5)
+    parser.add_argument('--octaves-blending', type=float, default=25.)
+    parser.add_argument('--scratch-dir', help='folder for the octave arrays (default: the system temporary folder)')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE_DEF)
+    parser.add_argument('--tile-margin', type=int, default=TILE_MARGIN_DEF)
+    args = parser.parse_args()
+
+    engine = DeepDreamEngine()
+    engine.setup(args.device, model_name=args.model, layer_name=args.layer, neuron_first=args.neuron_first,
+                 neuron_last=args.neuron_last)
+    dream_kwargs = dict(octaves=range(-args.octaves_to, -args.octaves_from + 1),
+                        octaves_scaling=2.**args.octaves_scaling, octaves_blending=args.octaves_blending/100.,
+                        steps_per_octave=args.steps)
+    output_npy = args.output.lower().endswith('.npy')
+    start = time.perf_counter()
+    def progress_callback(progress, image_array=None): # pylint: disable=unused-argument
+        print(f'\r{100.*progress:5.1f}%  {time.perf_counter()-start:7.1f} s', end='', flush=True)
+    result_mm = engine.dream_out_of_core(args.input, output_path=args.output if output_npy else None,
+                                         scratch_dir=args.scratch_dir, tile_size=args.tile_size,
+                                         tile_margin=args.tile_margin, progress_callback=progress_callback,
+                                         dream_kwargs=dream_kwargs)
+    print()
+    if not output_npy:
+        result_path = result_mm.filename
+        PIL.Image.fromarray(result_mm).save(args.output)
+        del result_mm
+        Path(result_path).unlink()
+    print(f'wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
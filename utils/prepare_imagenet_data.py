@@ -68,3 +68,28 @@ imagenet_data.to_xml(xmlPath, index=False, root_name='imagenet_classes', row_nam
 
 csvPath = dataDir / 'imagenet.tab'
 imagenet_data.to_csv(csvPath, sep='\t', index=False)
+
+# Compact search index for the concept picker: one row per class, the curated classes first (in the order of
+# imagenet.tab, so their rows match the indices stored by older settings), then the remaining Keras classes
+indexPath = dataDir / 'imagenet_index.tab'
+indexHeader = ('keras_id', 'imagenet_name', 'search_names',)
+with open(csvPath, mode='rt', encoding='utf-8') as csvFile:
+    csvRows = [line.rstrip('\n').split('\t') for line in csvFile][1:]
+with open(kerasPath, mode='rt', encoding='utf-8') as kerasFile:
+    kerasRows = [line.rstrip('\n').split(sep) for line in kerasFile][1:]
+kerasNames = {int(keras_id): imagenet_name for keras_id, _wordnet_id, _imagenet_id, imagenet_name in kerasRows}
+indexedIds = set()
+with open(indexPath, mode='wt', encoding='utf-8') as indexFile:
+    print('\t'.join(indexHeader), file=indexFile)
+    for _imagenet_id, imagenet_name, keras_id in csvRows:
+        keras_id = int(keras_id)
+        synonyms = [imagenet_name] + kerasNames.get(keras_id, '').split(', ')
+        searchNames = '|'.join(dict.fromkeys(s.strip().lower() for s in synonyms if s.strip()))
+        print(keras_id, imagenet_name, searchNames, sep='\t', file=indexFile)
+        indexedIds.add(keras_id)
+    for keras_id, imagenet_name in sorted(kerasNames.items()):
+        if keras_id in indexedIds:
+            continue
+        synonyms = imagenet_name.split(', ')
+        searchNames = '|'.join(dict.fromkeys(s.strip().lower() for s in synonyms if s.strip()))
+        print(keras_id, synonyms[0], searchNames, sep='\t', file=indexFile)
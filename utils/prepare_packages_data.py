@@ -0,0 +1,34 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+# pylint: disable=invalid-name
+# Writes the manifest of installed packages and their licenses shown in the About window. Must be run with the
+# environment that will be bundled, right before packaging; without the manifest the application scans the installed
+# distributions at runtime instead.
+
+import sys
+from pathlib import Path
+
+applicationPath = Path(__file__).resolve(strict=True)
+sourceDir = applicationPath.parent.parent / 'src'
+sys.path.insert(0, str(sourceDir))
+
+from cookadream.utils.about_info import PACKAGES_MANIFEST_NAME, AboutInfo  # pylint: disable=wrong-import-position
+
+textDir = sourceDir / 'cookadream' / 'resources' / 'text'
+manifestPath = textDir / PACKAGES_MANIFEST_NAME
+
+packagesData = AboutInfo.getPackagesData()
+AboutInfo.writePackagesManifest(manifestPath, packagesData)
+print(f'{len(packagesData)} packages written to {manifestPath}')
@@ -0,0 +1,37 @@
+# ======================================================================================================================
+# Copyright 2022 Eduardo Valle.
+#
+# This file is part of Cook-a-Dream.
+#
+# Cook-a-Dream is free software: you can redistribute it and/or modify it under the terms of the version 3 of the GNU
+# General Public License as published by the Free Software Foundation.
+#
+# Cook-a-Dream is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with Cook-a-Dream. If not, see
+# https://www.gnu.org/licenses.
+# ======================================================================================================================
+# pylint: disable=invalid-name
+# Pre-generates the translated main window QML for every platform/shortcuts/theme combination, before bundling, so
+# the application never translates the menus at startup. Must be run again whenever the QML sources change (stale
+# variants are simply ignored by the application).
+
+import shutil
+import sys
+from pathlib import Path
+
+applicationPath = Path(__file__).resolve(strict=True)
+sourceDir = applicationPath.parent.parent / 'src'
+sys.path.insert(0, str(sourceDir))
+
+from cookadream.utils import qml_menus  # pylint: disable=wrong-import-position
+
+qmlDir = sourceDir / 'cookadream' / 'gui'
+qmlPath = qmlDir / 'Cookadream.qml'
+prebuiltDir = qmlDir / qml_menus.PREBUILT_DIR_NAME
+
+shutil.rmtree(prebuiltDir, ignore_errors=True)
+variantPaths = qml_menus.qmlPrebuildVariants(qmlPath, themes=('Material', 'Universal'))
+for variantPath in variantPaths:
+    print(variantPath.relative_to(qmlDir))